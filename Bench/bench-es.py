@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+ROYAL ASSAYER
+Measures the Established Source scripts so regressions can be caught between runs.
+
+Usage:
+    python3 Bench/bench-es.py exclusions [--paths N] [--seed S]
+    python3 Bench/bench-es.py tree DIR [--files N] [--depth D] [--seed S] ...
+    python3 Bench/bench-es.py pipeline [--platform deb|win] [--repeat N] [--output results.json] [--baseline old.json]
+"""
+
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GEN_SCRIPTS = {
+    'deb': os.path.join(REPO_ROOT, 'Deb13', 'gen-es-deb.py'),
+    'win': os.path.join(REPO_ROOT, 'Win11', 'gen-es-win.py'),
+}
+
+# The scripts each platform runs end to end, in pipeline order
+PIPELINE_SCRIPTS = {
+    'deb': {
+        'gen-es': os.path.join(REPO_ROOT, 'Deb13', 'gen-es-deb.py'),
+        'gen-sm': os.path.join(REPO_ROOT, 'Deb13', 'gen-sm-deb.py'),
+        'purify': os.path.join(REPO_ROOT, 'Deb13', 'purify-es-deb.py'),
+        'restore': os.path.join(REPO_ROOT, 'Deb13', 'restore-es-deb.py'),
+    },
+    'win': {
+        'gen-es': os.path.join(REPO_ROOT, 'Win11', 'gen-es-win.py'),
+        'gen-sm': os.path.join(REPO_ROOT, 'Win11', 'gen-sm-win.py'),
+        'purify': os.path.join(REPO_ROOT, 'Win11', 'purify-es-win.py'),
+        'restore': os.path.join(REPO_ROOT, 'Win11', 'restore-es-uni.py'),
+    },
+}
+
+# Stages timed by the pipeline benchmark; gen-es-warm reruns gen-es over its own cache
+PIPELINE_STAGES = ['gen-es', 'gen-es-warm', 'gen-sm', 'purify', 'restore']
+
+RESULTS_VERSION = 1
+
+# Synthetic tree vocabulary
+TEXT_EXTENSIONS = ['.py', '.js', '.ts', '.md', '.json', '.css', '.html', '.yaml', '.txt', '.sh']
+BINARY_EXTENSIONS = ['.bin', '.dat', '.so', '.woff']
+EXCLUDED_DIRS = ['node_modules', '.git', '__pycache__', 'venv', 'dist', 'build']
+WORDS = [
+    'royal', 'source', 'manifest', 'import', 'return', 'const', 'value', 'index',
+    'config', 'render', 'async', 'await', 'function', 'class', 'self', 'data',
+]
+
+# Vocabulary for synthetic paths - a mix of kept and excluded names
+DIR_NAMES = [
+    'src', 'lib', 'components', 'utils', 'tests', 'docs', 'scripts', 'app',
+    'node_modules', '.git', '__pycache__', 'dist', 'build', 'venv', 'env',
+    'environment', 'rebuild', 'data', 'assets', 'public',
+]
+FILE_NAMES = [
+    'index.js', 'app.py', 'README.md', 'main.rs', 'styles.css', 'config.yaml',
+    'package.json', 'package-lock.json', 'tsconfig.json', 'module.pyc',
+    'logo.png', 'photo.JPG', 'notes.log', 'thumbs.db', '.DS_Store', '.env',
+    'environment.ts', 'archive.tar.gz', 'report.pdf', 'icon.svg',
+]
+
+# Every synthetic file is dated 2020-01-01 UTC, well outside the generators'
+# racy window, so the first gen-es run already leaves a usable cache behind
+TREE_MTIME = 1577836800
+
+
+def load_script(path, name):
+    """Import a hyphen-named script as a module without running its main()."""
+    script_dir = os.path.dirname(path)
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)  # The scripts import es_manifest from beside them
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_paths(count, seed):
+    """Deterministic relative paths with realistic depth and name mix."""
+    rng = random.Random(seed)
+    paths = []
+    for _ in range(count):
+        depth = rng.randint(0, 5)
+        parts = [rng.choice(DIR_NAMES) for _ in range(depth)]
+        parts.append(rng.choice(FILE_NAMES))
+        paths.append(os.path.join(*parts))
+    return paths
+
+
+def time_per_path(check, paths):
+    """Return nanoseconds per path for a single pass of check over paths."""
+    start = time.perf_counter_ns()
+    for path in paths:
+        check(path)
+    return (time.perf_counter_ns() - start) / len(paths)
+
+
+def bench_exclusions(args):
+    """Compare the per-pattern is_excluded loop with the compiled matcher."""
+    paths = synthetic_paths(args.paths, args.seed)
+    print(f"⚖️  Exclusion microbenchmark over {len(paths)} synthetic paths")
+    print(f"{'platform':<10}{'patterns':>10}{'loop ns/path':>16}{'compiled ns/path':>18}{'speedup':>10}")
+
+    for target, script in GEN_SCRIPTS.items():
+        module = load_script(script, f"gen_es_{target}")
+        patterns = module.EXCLUDED_ITEMS
+
+        compiled = module.compile_exclusions(patterns)
+        mismatches = [p for p in paths if compiled(p) != module.is_excluded(p, patterns)]
+        if mismatches:
+            raise SystemExit(f"❌ {target}: compiled matcher disagrees on {len(mismatches)} paths, e.g. {mismatches[:5]}")
+
+        loop_ns = time_per_path(lambda p: module.is_excluded(p, patterns), paths)
+        # Fresh matcher so the per-directory memo starts cold, as in a real run
+        compiled = module.compile_exclusions(patterns)
+        compiled_ns = time_per_path(compiled, paths)
+
+        print(f"{target:<10}{len(patterns):>10}{loop_ns:>16.0f}{compiled_ns:>18.0f}{loop_ns / compiled_ns:>9.1f}x")
+
+    print("✅ Compiled matchers agree with is_excluded on every path")
+
+
+def synthetic_text(rng, size):
+    """Source-like lines of words, exactly size bytes long."""
+    lines = []
+    total = 0
+    while total < size:
+        line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))) + '\n'
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines)[:size]
+
+
+def synthetic_docx(path, text):
+    """Write a minimal .docx (one paragraph per line) that Word and python-docx open."""
+    paragraphs = ''.join(f'<w:p><w:r><w:t>{line}</w:t></w:r></w:p>' for line in text.splitlines())
+    parts = {
+        '[Content_Types].xml': (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>'),
+        '_rels/.rels': (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+            'relationships/officeDocument" Target="word/document.xml"/></Relationships>'),
+        'word/document.xml': (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{paragraphs}</w:body></w:document>'),
+    }
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, data in parts.items():
+            # Fixed timestamps keep the same seed byte-identical between runs
+            z.writestr(zipfile.ZipInfo(name, (2020, 1, 1, 0, 0, 0)), data)
+
+
+def file_size(rng, median, max_size):
+    """Log-normal file size around median bytes - many small files, a long tail of big ones."""
+    return max(0, min(max_size, int(rng.lognormvariate(0, 1.5) * median)))
+
+
+def build_tree(root, files=2000, depth=4, median_size=2048, max_size=1 << 20,
+               binary_ratio=0.1, docx=10, excluded_files=200, seed=1):
+    """Build a deterministic synthetic project tree; returns its shape as a dict.
+
+    files are spread over nested directories up to depth levels deep, with
+    binary_ratio of them binary and docx .docx documents among them.
+    excluded_files more go under node_modules, .git and friends, which the
+    scripts should skip without reading. Files and directories are all dated
+    TREE_MTIME.
+    """
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    dirs = ['']
+    for i in range(max(1, files // 20)):
+        parent = rng.choice(dirs)
+        if parent.count(os.sep) + 1 < depth:
+            dirs.append(os.path.join(parent, f"{rng.choice(DIR_NAMES[:8])}{i}"))
+    shape = {'files': 0, 'bytes': 0, 'binary': 0, 'docx': 0, 'excluded': 0, 'dirs': len(dirs)}
+
+    def place(directory, name):
+        path = os.path.join(root, directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    for i in range(files):
+        directory = rng.choice(dirs)
+        size = file_size(rng, median_size, max_size)
+        if i < docx:
+            path = place(directory, f"doc{i}.docx")
+            synthetic_docx(path, synthetic_text(rng, min(size, 64 << 10)))
+            shape['docx'] += 1
+        elif rng.random() < binary_ratio:
+            path = place(directory, f"blob{i}{rng.choice(BINARY_EXTENSIONS)}")
+            with open(path, 'wb') as f:
+                f.write(rng.randbytes(size))
+            shape['binary'] += 1
+        else:
+            path = place(directory, f"file{i}{rng.choice(TEXT_EXTENSIONS)}")
+            with open(path, 'w', encoding='utf-8', newline='\n') as f:
+                f.write(synthetic_text(rng, size))
+        shape['files'] += 1
+        shape['bytes'] += os.path.getsize(path)
+
+    for i in range(excluded_files):
+        directory = os.path.join(rng.choice(dirs), rng.choice(EXCLUDED_DIRS), f"pkg{i % 10}")
+        path = place(directory, f"file{i}.js")
+        with open(path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(synthetic_text(rng, file_size(rng, median_size, max_size)))
+        shape['excluded'] += 1
+
+    for directory, _, names in os.walk(root):
+        for name in names:
+            os.utime(os.path.join(directory, name), (TREE_MTIME, TREE_MTIME))
+        os.utime(directory, (TREE_MTIME, TREE_MTIME))
+    return shape
+
+
+def tree_options(parser):
+    """The synthetic tree knobs shared by the tree and pipeline commands."""
+    parser.add_argument('--files', type=int, default=2000, help="files to document (default: 2000)")
+    parser.add_argument('--depth', type=int, default=4, help="maximum directory depth (default: 4)")
+    parser.add_argument('--median-size', type=int, default=2048, help="median file size in bytes (default: 2048)")
+    parser.add_argument('--max-size', type=int, default=1 << 20, help="largest file in bytes (default: 1 MiB)")
+    parser.add_argument('--binary-ratio', type=float, default=0.1, help="share of binary files (default: 0.1)")
+    parser.add_argument('--docx', type=int, default=10, help=".docx documents among the files (default: 10)")
+    parser.add_argument('--excluded-files', type=int, default=200,
+                        help="files under node_modules/.git/... that should be skipped (default: 200)")
+    parser.add_argument('--seed', type=int, default=1, help="random seed for the tree")
+
+
+def tree_kwargs(args):
+    return dict(files=args.files, depth=args.depth, median_size=args.median_size, max_size=args.max_size,
+                binary_ratio=args.binary_ratio, docx=args.docx, excluded_files=args.excluded_files, seed=args.seed)
+
+
+def bench_tree(args):
+    """Build a synthetic tree for manual experiments."""
+    shape = build_tree(args.directory, **tree_kwargs(args))
+    print(f"🌳 Synthetic tree at {args.directory}: {json.dumps(shape)}")
+
+
+def run_measured(cmd, cwd, env, stdout=subprocess.DEVNULL):
+    """Run cmd to completion; returns wall/CPU seconds, peak RSS and bytes read and written.
+
+    Peak RSS comes from wait4 and byte counts from /proc/<pid>/io, read while the
+    finished child is still unreaped. Where those are unavailable (Windows)
+    the fields are None and only wall time is measured.
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=stdout, stderr=subprocess.PIPE)
+    if not hasattr(os, 'wait4'):
+        _, stderr = proc.communicate()
+        return {'wall_s': time.perf_counter() - start, 'cpu_s': None, 'peak_rss_kb': None,
+                'read_bytes': None, 'written_bytes': None, 'returncode': proc.returncode}, stderr
+    stderr = proc.stderr.read()
+    os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+    wall = time.perf_counter() - start
+    io = {}
+    try:
+        with open(f'/proc/{proc.pid}/io') as f:
+            io = dict(line.split(': ') for line in f.read().splitlines())
+    except OSError:
+        pass
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    proc.stderr.close()
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    rss = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    return {'wall_s': wall, 'cpu_s': usage.ru_utime + usage.ru_stime, 'peak_rss_kb': rss,
+            'read_bytes': int(io['rchar']) if 'rchar' in io else None,
+            'written_bytes': int(io['wchar']) if 'wchar' in io else None,
+            'returncode': proc.returncode}, stderr
+
+
+def pipeline_once(platform_name, tree_args, gen_args, workspace):
+    """Build a fresh tree and run one platform's scripts over it; returns {stage: sample}.
+
+    gen-es-deb writes absolute paths, which no restorer touches, so purify and
+    restore always work on the portable manifest written by gen-es-win - the
+    generate-on-Windows, restore-on-Linux hand-off the README describes.
+    """
+    scripts = PIPELINE_SCRIPTS[platform_name]
+    tree = os.path.join(workspace, 'project')
+    original = tree + '.orig'
+    shutil.rmtree(tree, ignore_errors=True)
+    shutil.rmtree(original, ignore_errors=True)
+    build_tree(tree, **tree_args)
+    env = dict(os.environ, XDG_CACHE_HOME=os.path.join(workspace, 'cache'), PYTHONIOENCODING='utf-8')
+    shutil.rmtree(env['XDG_CACHE_HOME'], ignore_errors=True)
+
+    def manifest_files(directory, prefix='established-source.txt'):
+        return [os.path.join(directory, name) for name in os.listdir(directory)
+                if name.startswith(prefix) and not name.endswith(('.cache', '.idx'))]
+
+    def measure(stage, script, cwd, *script_args):
+        with tempfile.TemporaryFile() as stdout:
+            sample, stderr = run_measured([sys.executable, script, *script_args], cwd, env, stdout)
+            stdout.seek(0)
+            output = stdout.read()
+        if sample['returncode'] != 0:
+            raise SystemExit(f"❌ {platform_name} {stage} failed:\n{stderr.decode(errors='replace')}")
+        sample['manifest_bytes'] = None
+        samples[stage] = sample
+        return output
+
+    samples = {}
+    measure('gen-es', scripts['gen-es'], tree, *gen_args)
+    warm = measure('gen-es-warm', scripts['gen-es'], tree, *gen_args)
+    reused = re.search(rb'Cache: (\d+) entries reused', warm)
+    if reused is None or int(reused.group(1)) == 0:
+        raise SystemExit(f"❌ {platform_name} gen-es-warm reused no cache entries - it would only time a cold run")
+    samples['gen-es']['manifest_bytes'] = sum(os.path.getsize(p) for p in manifest_files(tree))
+    measure('gen-sm', scripts['gen-sm'], tree)
+
+    if platform_name != 'win':
+        for name in os.listdir(tree):
+            if name.startswith('established-source.txt'):
+                os.remove(os.path.join(tree, name))
+        portable = subprocess.run([sys.executable, PIPELINE_SCRIPTS['win']['gen-es'], *gen_args],
+                                  cwd=tree, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if portable.returncode != 0:
+            raise SystemExit(f"❌ portable manifest failed:\n{portable.stderr.decode(errors='replace')}")
+    measure('purify', scripts['purify'], tree)
+
+    # Restore the purified manifest into an empty directory, keeping the original aside
+    os.rename(tree, original)
+    os.makedirs(tree)
+    for path in manifest_files(original, 'PURIFIED-established-source.txt'):
+        shutil.copy2(path, tree)
+    measure('restore', scripts['restore'], tree)
+    restored = sum(len(names) for _, _, names in os.walk(tree))
+    samples['restore']['files_restored'] = restored - len(manifest_files(tree, 'PURIFIED-'))
+    return samples
+
+
+def summarize(samples):
+    """Median of each measurement over the repeats of one stage."""
+    summary = {}
+    for key in samples[0]:
+        values = [s[key] for s in samples if s[key] is not None]
+        summary[key] = statistics.median_low(values) if values else None
+    return summary
+
+
+def bench_pipeline(args):
+    """Time gen-es, gen-sm, purify and restore end to end over synthetic trees."""
+    platforms = [args.platform] if args.platform else list(PIPELINE_SCRIPTS)
+    tree_args = tree_kwargs(args)
+    results = {
+        'version': RESULTS_VERSION,
+        'benchmark': 'pipeline',
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'cpu_count': os.cpu_count()},
+        'tree': tree_args,
+        'gen_args': args.gen_arg,
+        'repeat': args.repeat,
+        'platforms': {},
+    }
+    print(f"⚖️  Pipeline benchmark: {args.files} files, {args.repeat} repeat(s)")
+    with tempfile.TemporaryDirectory(prefix='bench-es-', dir=args.workdir) as workspace:
+        for platform_name in platforms:
+            runs = [pipeline_once(platform_name, tree_args, args.gen_arg, workspace) for _ in range(args.repeat)]
+            stages = {stage: {'median': summarize([run[stage] for run in runs]),
+                              'samples': [run[stage] for run in runs]}
+                      for stage in PIPELINE_STAGES}
+            total = {key: sum(stages[stage]['median'][key] or 0 for stage in PIPELINE_STAGES)
+                     for key in ('wall_s', 'cpu_s', 'read_bytes', 'written_bytes')}
+            total['peak_rss_kb'] = max(stages[stage]['median']['peak_rss_kb'] or 0 for stage in PIPELINE_STAGES)
+            results['platforms'][platform_name] = {'stages': stages, 'total': total}
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_pipeline(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f"💾 Results saved to {args.output}")
+
+
+def print_pipeline(results, baseline=None):
+    """Table of stage medians, with the change against a baseline run when given."""
+    header = f"{'platform':<10}{'stage':<13}{'wall s':>9}{'cpu s':>9}{'peak RSS MB':>13}{'read MB':>10}{'written MB':>12}"
+    if baseline:
+        header += f"{'vs base':>10}"
+    print(header)
+
+    def mb(value, scale):
+        return f"{value / scale:.1f}" if value is not None else '-'
+
+    for platform_name, result in results['platforms'].items():
+        rows = [(stage, result['stages'][stage]['median']) for stage in PIPELINE_STAGES]
+        rows.append(('total', result['total']))
+        for stage, m in rows:
+            line = (f"{platform_name:<10}{stage:<13}{m['wall_s']:>9.3f}{mb(m['cpu_s'], 1):>9}"
+                    f"{mb(m['peak_rss_kb'], 1024):>13}{mb(m['read_bytes'], 1 << 20):>10}"
+                    f"{mb(m['written_bytes'], 1 << 20):>12}")
+            if baseline:
+                try:
+                    old = baseline['platforms'][platform_name]
+                    old = old['total'] if stage == 'total' else old['stages'][stage]['median']
+                    line += f"{m['wall_s'] / old['wall_s']:>9.2f}x"
+                except (KeyError, ZeroDivisionError):
+                    line += f"{'-':>10}"
+            print(line)
+    if baseline and baseline.get('tree') != results['tree']:
+        print("⚠️  Baseline was measured on a different synthetic tree - ratios are not comparable")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Established Source scripts.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    ex = sub.add_parser('exclusions', help="per-path cost of exclusion matching")
+    ex.add_argument('--paths', type=int, default=200_000, help="number of synthetic paths (default: 200000)")
+    ex.add_argument('--seed', type=int, default=1, help="random seed for path generation")
+    ex.set_defaults(func=bench_exclusions)
+
+    tr = sub.add_parser('tree', help="build a synthetic project tree")
+    tr.add_argument('directory', help="where to build the tree")
+    tree_options(tr)
+    tr.set_defaults(func=bench_tree)
+
+    pl = sub.add_parser('pipeline', help="time gen-es, gen-sm, purify and restore end to end")
+    tree_options(pl)
+    pl.add_argument('--platform', choices=sorted(PIPELINE_SCRIPTS), help="benchmark one platform's scripts (default: both)")
+    pl.add_argument('--repeat', type=int, default=3, help="runs per platform; medians are reported (default: 3)")
+    pl.add_argument('--gen-arg', action='append', default=[], metavar='ARG',
+                    help="extra argument for gen-es, e.g. --gen-arg=--compress=gz (repeatable)")
+    pl.add_argument('--workdir', help="directory for the temporary workspace (default: system temp)")
+    pl.add_argument('--output', help="save the results as JSON")
+    pl.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    pl.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
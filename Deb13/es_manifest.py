@@ -0,0 +1,2919 @@
+# [file name]: es_manifest.py
+# [directory]: ./ (Keep beside the gen/restore/purify scripts)
+"""
+Shared plumbing for Established Source manifests.
+Identical copies live in Deb13/ and Win11/ - keep them in sync.
+"""
+
+import io
+import os
+import re
+import bz2
+import sys
+import gzip
+import json
+import mmap
+import stat
+import time
+import zlib
+import errno
+import base64
+import heapq
+import queue
+import bisect
+import codecs
+import ctypes
+import select
+import shutil
+import struct
+import fnmatch
+import hashlib
+import tempfile
+import threading
+import contextlib
+import ctypes.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    import lzma
+except ImportError:  # Python built without liblzma
+    lzma = None
+
+# ===== Manifest grammar =====
+MARKER_BEGIN = '[file content begin]'
+MARKER_END = '[file content end]'
+# Optional line after an entry's path: sha256 of its body with \n newlines
+DIGEST_PREFIX = '[file content sha256]:'
+# Stands in for the content block of a file identical to an earlier entry
+REFERENCE_PREFIX = '[file content same as]:'
+# Header line naming the manifest; the begin marker after it opens the whole file
+HEADER_NAME_PREFIX = '[file name]:'
+# An embedded binary: its bytes as base64 or base85 lines between these, the end
+# line recording the decoded size and sha256 (see BinaryEmbedder)
+EMBED_BEGIN_PREFIX = '[binary content begin]:'
+EMBED_END_PREFIX = '[binary content end]:'
+
+# Entry kinds recorded in the .idx index
+ENTRY_TEXT = 't'
+ENTRY_BINARY = 'b'
+ENTRY_REFERENCE = 'r'
+ENTRY_EMBEDDED = 'e'
+
+
+def is_path_line(stripped):
+    """True for a stripped manifest line that names an entry: ./path or .\\path."""
+    return stripped.startswith('.\\') or stripped.startswith('./')
+
+
+def reference_line(target):
+    """The line that replaces a duplicate's content block, naming the first copy."""
+    return f"{REFERENCE_PREFIX} {target}\n"
+
+
+def reference_target(stripped):
+    """The path a stripped reference line points at, or None for any other line."""
+    if not stripped.startswith(REFERENCE_PREFIX):
+        return None
+    return stripped[len(REFERENCE_PREFIX):].strip()
+
+
+def content_digest(body):
+    """Hex sha256 of an entry body given as UTF-8 bytes with \\n newlines."""
+    return hashlib.sha256(body).hexdigest()
+
+
+def digest_line(digest):
+    """The optional line recording an entry's digest, written after its path."""
+    return f"{DIGEST_PREFIX} {digest}\n"
+
+
+# Empty files share a body ("\n") but gain nothing from being written as references
+EMPTY_DIGEST = content_digest(b'\n')
+
+
+# ===== Incremental generation cache =====
+# Sidecar written next to the manifest: established-source.txt.cache
+CACHE_SUFFIX = '.cache'
+CACHE_VERSION = 3
+
+# Files modified this close to the start of a run are not cached: a second
+# write within the filesystem's timestamp granularity would go unnoticed.
+RACY_WINDOW_NS = 2_000_000_000
+
+# Embedded binaries longer than this are encoded afresh from the file rather
+# than served whole from the previous manifest
+EMBED_CACHE_BYTES = 4 << 20
+
+
+def stat_key(st):
+    """The (size, mtime_ns, inode) triple that identifies an unchanged file."""
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class ManifestCache:
+    """Read side of the stat-keyed cache left behind by the previous generation.
+
+    Cache lines are stored in manifest order, which is the same sorted order the
+    generators look paths up in, so lookups are a merge-join that holds only one
+    cache line in memory. Hits are served as raw bytes from the previous manifest,
+    inflated on the way when it is compressed.
+    A cache whose fingerprint or manifest identity does not match is ignored.
+    """
+
+    def __init__(self, manifest_path, fingerprint):
+        self.manifest_path = manifest_path
+        self.reused = 0
+        self.refreshed = 0
+        self._lines = None
+        self._manifest = None
+        self._current = None
+        try:
+            self._open(fingerprint)
+        except (OSError, ValueError, KeyError):
+            self.close()
+
+    @property
+    def active(self):
+        return self._lines is not None
+
+    def _open(self, fingerprint):
+        cache_path = self.manifest_path + CACHE_SUFFIX
+        self._lines = open(cache_path, 'r', encoding='utf-8', newline='\n')
+        header = json.loads(self._lines.readline())
+        if header['version'] != CACHE_VERSION or header['fingerprint'] != fingerprint:
+            raise ValueError("cache fingerprint mismatch")
+
+        trailer = json.loads(_read_last_line(cache_path))
+        st = os.stat(self.manifest_path)
+        if (st.st_size, st.st_mtime_ns) != (trailer['manifest_size'], trailer['manifest_mtime_ns']):
+            raise ValueError("manifest changed since the cache was written")
+
+        self._manifest = open_manifest(self.manifest_path)
+        self._advance()
+
+    def _advance(self):
+        line = self._lines.readline()
+        if not line or line.startswith('{'):
+            self._current = None
+            return
+        size, mtime_ns, ino, offset, length, kind, digest, path = line.rstrip('\n').split('\t', 7)
+        self._current = (path, (int(size), int(mtime_ns), int(ino)), int(offset), int(length), kind, digest)
+
+    def lookup(self, relative_path, st):
+        """Return (entry_bytes, kind, digest) for an unchanged file, or None to re-read it.
+
+        kind is the entry's ENTRY_* index kind and digest the sha256 of a text
+        entry's body ('' for binaries), so the generator can still spot
+        duplicates among entries it never reads. For ENTRY_REFERENCE the bytes
+        are the reference itself; the generator reads the file again if the
+        first copy it pointed at is gone.
+        """
+        if self._current is not None and st is not None:
+            while self._current is not None and self._current[0] < relative_path:
+                self._advance()
+            current = self._current
+            if current is not None and current[0] == relative_path and current[1] == stat_key(st):
+                self._manifest.seek(current[2])
+                data = self._manifest.read(current[3])
+                if len(data) == current[3]:
+                    self.reused += 1
+                    return data, current[4], current[5]
+        self.refreshed += 1
+        return None
+
+    def close(self):
+        for handle in (self._lines, self._manifest):
+            if handle is not None:
+                handle.close()
+        self._lines = self._manifest = self._current = None
+
+
+class ManifestCacheWriter:
+    """Write side of the cache: one line per entry, committed after the manifest is closed."""
+
+    def __init__(self, manifest_path, fingerprint, started_ns):
+        self.cache_path = manifest_path + CACHE_SUFFIX
+        self._tmp_path = self.cache_path + '.tmp'
+        self._racy_after = started_ns - RACY_WINDOW_NS
+        self._out = open(self._tmp_path, 'w', encoding='utf-8', newline='\n')
+        self._out.write(json.dumps({'version': CACHE_VERSION, 'fingerprint': fingerprint}) + '\n')
+
+    def add(self, relative_path, st, offset, length, kind, digest=''):
+        """Record an entry of ENTRY_* kind; for a reference the digest is what a later run reuses."""
+        if st is None or st.st_mtime_ns >= self._racy_after or '\n' in relative_path:
+            return
+        if kind == ENTRY_EMBEDDED and length > EMBED_CACHE_BYTES:
+            return
+        size, mtime_ns, ino = stat_key(st)
+        self._out.write(f"{size}\t{mtime_ns}\t{ino}\t{offset}\t{length}\t{kind}\t{digest}\t{relative_path}\n")
+
+    def commit(self, manifest_tmp_path):
+        """Seal the cache against the (not yet renamed) new manifest and publish it."""
+        st = os.stat(manifest_tmp_path)
+        self._out.write(json.dumps({'manifest_size': st.st_size, 'manifest_mtime_ns': st.st_mtime_ns}) + '\n')
+        self._out.close()
+        os.replace(self._tmp_path, self.cache_path)
+
+    def discard(self):
+        self._out.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+# ===== Byte-offset index =====
+# Sidecar written next to the manifest: established-source.txt.idx
+# One "offset<TAB>length<TAB>kind<TAB>path" line per entry, kind t(ext), b(inary)
+# placeholder, e(mbedded binary) or r(eference to an earlier identical entry).
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+
+def index_key(path):
+    """Normalise a manifest path line or relative path to the form used as an index key."""
+    key = path.strip().replace('\\', '/')
+    while key.startswith('./'):
+        key = key[2:]
+    return key
+
+
+class ManifestIndexWriter:
+    """Collects entry offsets while a manifest is written; committed once it is closed."""
+
+    def __init__(self, manifest_path):
+        self.index_path = manifest_path + INDEX_SUFFIX
+        self._tmp_path = self.index_path + '.tmp'
+        self._entries = 0
+        self._out = open(self._tmp_path, 'w', encoding='utf-8', newline='\n')
+        self._out.write(json.dumps({'version': INDEX_VERSION}) + '\n')
+
+    def add(self, path, offset, length, kind):
+        key = index_key(path)
+        if '\n' in key:
+            return
+        self._out.write(f"{offset}\t{length}\t{kind}\t{key}\n")
+        self._entries += 1
+
+    def commit(self, manifest_tmp_path, writer=None):
+        """Seal the index; a compressed ManifestWriter contributes its frame table."""
+        trailer = {'manifest_size': os.path.getsize(manifest_tmp_path), 'entries': self._entries}
+        if writer is not None and writer.codec is not None:
+            trailer.update(codec=writer.codec, manifest_bytes=writer.position, frames=writer.frames)
+        self._out.write(json.dumps(trailer) + '\n')
+        self._out.close()
+        os.replace(self._tmp_path, self.index_path)
+
+    def discard(self):
+        self._out.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def _iter_index(manifest_path):
+    """Yield (key, offset, length, kind) from the .idx sidecar; raises OSError or ValueError if it is unusable."""
+    index_path = manifest_path + INDEX_SUFFIX
+    trailer = json.loads(_read_last_line(index_path))
+    if trailer.get('manifest_size') != os.path.getsize(manifest_path):
+        raise ValueError(f"{index_path} belongs to another manifest")
+    if trailer.get('codec') != compression_of(manifest_path):
+        raise ValueError(f"{index_path} belongs to another manifest")
+    with open(index_path, 'r', encoding='utf-8', newline='\n') as index:
+        if json.loads(index.readline()).get('version') != INDEX_VERSION:
+            raise ValueError(f"{index_path}: unsupported index version")
+        for line in index:
+            if line.startswith('{'):
+                break
+            offset, length, kind, key = line.rstrip('\n').split('\t', 3)
+            yield key, int(offset), int(length), kind
+
+
+def find_indexed_entries(manifest_path, paths):
+    """Map each requested path to (offset, length, kind) using the .idx sidecar.
+
+    Returns None when there is no index or it was written for a different
+    manifest (e.g. one that has since been purified or edited), so callers can
+    fall back to a full scan. Paths missing from the manifest are simply absent.
+    """
+    wanted = {index_key(p) for p in paths}
+    try:
+        return {key: (offset, length, kind) for key, offset, length, kind in _iter_index(manifest_path)
+                if key in wanted}
+    except (OSError, ValueError):
+        return None
+
+
+def resolve_indexed_references(manifest_path, scan, entries, keys):
+    """Map each of keys that the index marks as a reference to the key it duplicates.
+
+    The index entries of targets that were not requested themselves are added
+    to entries. Raises ValueError when the index and the manifest disagree.
+    """
+    sources = {}
+    for key in keys:
+        if key in entries and entries[key][2] == ENTRY_REFERENCE:
+            offset, length, _ = entries[key]
+            sources[key] = scan.indexed_reference(offset, length, key)
+    missing = set(sources.values()) - entries.keys()
+    if missing:
+        targets = find_indexed_entries(manifest_path, missing)
+        if targets is None:
+            raise ValueError("index vanished while resolving references")
+        entries.update(targets)
+    return sources
+
+
+# ===== Tree walking (generators and site maps) =====
+
+def walk_tree(root, enter=None, tag=True):
+    """Yield (rel_path, entry, is_dir, tag) for everything below root, directories before their contents.
+
+    A single os.scandir pass per directory: rel_path is built by appending
+    to the parent's (a, a/b, a/b/c.txt with os.sep), entry is the DirEntry
+    with its cached type, and nothing is joined, split or made relative.
+    enter(rel_path, entry, tag) is asked about each directory and returns the
+    tag its contents are yielded with - a falsy tag prunes it - so several
+    consumers with different exclusions can share one traversal by tagging
+    which of them still want a subtree. Like os.walk, symlinked directories
+    are yielded but never entered and unreadable directories are skipped.
+    """
+    stack = [('', root, tag)]
+    while stack:
+        prefix, path, tag = stack.pop()
+        try:
+            listing = os.scandir(path)
+        except OSError:
+            continue
+        subdirs = []
+        with listing:
+            for entry in listing:
+                rel_path = prefix + entry.name
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                yield rel_path, entry, is_dir, tag
+                try:
+                    if not is_dir or entry.is_symlink():
+                        continue
+                except OSError:
+                    continue
+                sub_tag = enter(rel_path, entry, tag) if enter is not None else tag
+                if sub_tag:
+                    subdirs.append((rel_path + os.sep, entry.path, sub_tag))
+        stack.extend(reversed(subdirs))
+
+
+def walk_tree_parallel(root, gather, enter=None, tag=True, workers=4):
+    """walk_tree spread over worker threads; returns one gather() result per worker.
+
+    The workers share a stack of directories still to list: an idle worker
+    takes the most recently found one (so a single deep subtree is split up
+    as readily as many shallow ones), lists it and pushes the subdirectories
+    enter() lets through. Each worker calls gather once with a walk_tree-style
+    iterator over everything it lists, in whatever order it got there, on its
+    own thread. Together the parts hold exactly the items walk_tree yields, so
+    sorting each part and merging them (heapq.merge) gives the serial walk's
+    sorted order. os.scandir releases the GIL while the filesystem answers,
+    which is where slow and network trees spend their walk.
+    """
+    pending = [('', root, tag)]
+    ready = threading.Condition()
+    busy = 0
+    stopped = False
+
+    def take():
+        nonlocal busy
+        with ready:
+            while not pending and busy and not stopped:
+                ready.wait()
+            if not pending or stopped:
+                return None
+            busy += 1
+            return pending.pop()
+
+    def listed(subdirs):
+        nonlocal busy
+        with ready:
+            pending.extend(reversed(subdirs))
+            busy -= 1
+            ready.notify_all()
+
+    def items():
+        while True:
+            job = take()
+            if job is None:
+                return
+            prefix, path, tag = job
+            subdirs = []
+            try:
+                try:
+                    listing = os.scandir(path)
+                except OSError:
+                    continue
+                with listing:
+                    for entry in listing:
+                        rel_path = prefix + entry.name
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        yield rel_path, entry, is_dir, tag
+                        try:
+                            if not is_dir or entry.is_symlink():
+                                continue
+                        except OSError:
+                            continue
+                        sub_tag = enter(rel_path, entry, tag) if enter is not None else tag
+                        if sub_tag:
+                            subdirs.append((rel_path + os.sep, entry.path, sub_tag))
+            finally:
+                listed(subdirs)
+
+    def work():
+        nonlocal stopped
+        walk = items()
+        try:
+            return gather(walk)
+        except BaseException:
+            with ready:
+                stopped = True  # The others finish the directory in hand and give up
+                ready.notify_all()
+            raise
+        finally:
+            walk.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = [pool.submit(work) for _ in range(workers)]
+        return [part.result() for part in parts]
+
+
+# ===== Ignore files (generators) =====
+# Opt-in (--gitignore): .gitignore and .ignore files are honoured the way git
+# reads them, level by level - a pattern applies below the directory its file
+# is in, the deepest level with a matching pattern decides, and within a level
+# the last matching pattern wins (.ignore after .gitignore). The repository's
+# .git/info/exclude counts as the root's lowest-priority rules.
+
+IGNORE_FILES = ('.gitignore', '.ignore')
+IGNORE_EXCLUDE_FILE = os.path.join('.git', 'info', 'exclude')
+
+
+def _read_ignore_patterns(path):
+    """The pattern lines of one ignore file; a missing or unreadable file has none."""
+    try:
+        with open(path, encoding='utf-8', errors='surrogateescape') as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+
+def _ignore_glob(pattern):
+    """Translate one gitignore glob to a regex over '/'-separated paths."""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            j = i
+            while j < n and pattern[j] == '*':
+                j += 1
+            # '**' between slashes (or at either end) crosses directories
+            if j - i == 2 and (i == 0 or pattern[i - 1] == '/') and (j == n or pattern[j] == '/'):
+                if j == n:
+                    out.append('.*')
+                else:
+                    out.append('(?:.*/)?')
+                    j += 1
+            else:
+                out.append('[^/]*')
+            i = j
+        elif c == '?':
+            out.append('[^/]')
+            i += 1
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                out.append(re.escape(c))  # No closing bracket - a literal '['
+                i += 1
+                continue
+            body = pattern[i + 1:j]
+            negated = body[0] in '!^'
+            members = ''.join(ch if ch == '-' else re.escape(ch) for ch in body[negated:])
+            out.append(('[^/' if negated else '(?!/)[') + members + ']')
+            i = j + 1
+        elif c == '\\' and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return ''.join(out)
+
+
+def _compile_ignore(lines):
+    """Compile a level's pattern lines into (file_regex, file_negated, dir_regex, dir_negated).
+
+    Each regex is one alternation, last pattern first, so the first group
+    that matches (lastindex) is the pattern git would let decide.
+    """
+    files, dirs = [], []
+    for line in lines:
+        if not line or line.startswith('#'):
+            continue
+        while line.endswith(' ') and not line.endswith('\\ '):
+            line = line[:-1]
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            continue
+        # A slash anywhere but the end anchors the pattern to its own directory
+        if '/' in line:
+            regex = _ignore_glob(line.lstrip('/'))
+        else:
+            regex = '(?:.*/)?' + _ignore_glob(line)
+        dirs.append((regex, negated))
+        if not dir_only:
+            files.append((regex, negated))
+
+    def alternation(rules):
+        if not rules:
+            return None, ()
+        rules = rules[::-1]
+        flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+        return (re.compile('|'.join(f'({regex})' for regex, _ in rules), flags | re.DOTALL),
+                (None,) + tuple(negated for _, negated in rules))
+
+    return alternation(files) + alternation(dirs)
+
+
+class IgnoreRules:
+    """The ignore patterns in force in one directory, chained to its parent's.
+
+    A walk builds these once per directory level: IgnoreRules.for_root(root)
+    at the top, then rules.child(rel_dir, path) as it enters each directory -
+    which is the parent's own object when that directory has no ignore file.
+    ignored() is asked about each entry before the walk descends into it, so
+    an ignored directory is never listed (and, as in git, nothing below it
+    can be re-included).
+    """
+
+    def __init__(self, lines=(), parent=None, base=''):
+        self.parent = parent
+        self.base = base  # This level's directory relative to the root, '/'-separated with a trailing '/'
+        self._files, self._files_negated, self._dirs, self._dirs_negated = _compile_ignore(lines)
+
+    @classmethod
+    def for_root(cls, root):
+        """The root level: .git/info/exclude, then the root's own ignore files."""
+        lines = _read_ignore_patterns(os.path.join(root, IGNORE_EXCLUDE_FILE))
+        for name in IGNORE_FILES:
+            lines += _read_ignore_patterns(os.path.join(root, name))
+        return cls(lines)
+
+    def child(self, rel_dir, path):
+        """The rules in force inside rel_dir (relative to the root, os.sep-separated) found at path."""
+        lines = []
+        for name in IGNORE_FILES:
+            lines += _read_ignore_patterns(os.path.join(path, name))
+        if not lines:
+            return self
+        return IgnoreRules(lines, self, rel_dir.replace(os.sep, '/') + '/')
+
+    def ignored(self, rel_path, is_dir=False):
+        """Whether rel_path (relative to the root, inside this level's directory) is ignored."""
+        if os.sep != '/':
+            rel_path = rel_path.replace(os.sep, '/')
+        rules = self
+        while rules is not None:
+            regex, negated = (rules._dirs, rules._dirs_negated) if is_dir else (rules._files, rules._files_negated)
+            if regex is not None:
+                match = regex.fullmatch(rel_path, len(rules.base))
+                if match:
+                    return not negated[match.lastindex]
+            rules = rules.parent
+        return False
+
+
+# ===== Change watching (generators) =====
+# Both watchers report changes as a set of paths relative to root (os.sep
+# separated, '' for root itself): files written, created, deleted or moved
+# and directories created, deleted or moved. The caller re-stats each path to
+# learn what happened. None means events were lost and everything must be
+# rescanned.
+
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_DONT_FOLLOW = 0x2000000
+_IN_EXCL_UNLINK = 0x4000000
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Linux inotify watches on chosen directories below root; raises OSError where unavailable.
+
+    watch() raises OSError (ENOSPC) when fs.inotify.max_user_watches runs out.
+    """
+
+    MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE
+            | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR | _IN_DONT_FOLLOW | _IN_EXCL_UNLINK)
+
+    def __init__(self, root):
+        self.root = root
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except (OSError, TypeError, AttributeError):
+            raise OSError(errno.ENOSYS, "inotify is not available on this system") from None
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self._dirs = {}  # watch descriptor -> rel_dir
+        self._wds = {}  # rel_dir -> watch descriptor
+
+    def watch(self, rel_dir):
+        path = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        wd = self._add_watch(self._fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        self._dirs[wd] = rel_dir
+        self._wds[rel_dir] = wd
+
+    def unwatch(self, rel_dir):
+        """Stop watching rel_dir and every directory below it."""
+        below = rel_dir + os.sep
+        for name in [d for d in self._wds if d == rel_dir or d.startswith(below) or not rel_dir]:
+            wd = self._wds.pop(name)
+            self._dirs.pop(wd, None)
+            self._rm_watch(self._fd, wd)
+
+    def read(self, timeout=None):
+        """Wait up to timeout seconds (None = forever) for events; returns the changed paths."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        changed = set()
+        if not ready:
+            return changed
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, pos)
+                name = data[pos + _INOTIFY_EVENT.size:pos + _INOTIFY_EVENT.size + length].rstrip(b'\0')
+                pos += _INOTIFY_EVENT.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    return None
+                rel_dir = self._dirs.get(wd)
+                if mask & _IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    if rel_dir is not None and self._wds.get(rel_dir) == wd:
+                        del self._wds[rel_dir]
+                    continue
+                if rel_dir is None:
+                    continue  # Late event from a directory already unwatched
+                if name:
+                    name = os.fsdecode(name)
+                    changed.add(rel_dir + os.sep + name if rel_dir else name)
+                else:
+                    changed.add(rel_dir)  # The watched directory itself went away
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """The InotifyWatcher interface by periodic stats, for systems without inotify.
+
+    Every poll stats the watched directories and the files listed in them; a
+    directory is listed again only when its own mtime changed, so a poll costs
+    one stat per path rather than a walk.
+    """
+
+    def __init__(self, root, interval=1.0):
+        self.root = root
+        self.interval = interval
+        self._listings = {}  # rel_dir -> (dir signature, {name: signature})
+
+    def _path(self, rel):
+        return os.path.join(self.root, rel) if rel else self.root
+
+    @staticmethod
+    def _signature(st):
+        return (st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino, st.st_mode)
+
+    def _list(self, rel_dir):
+        path = self._path(rel_dir)
+        signature = self._signature(os.stat(path))
+        names = {}
+        with os.scandir(path) as listing:
+            for entry in listing:
+                try:
+                    names[entry.name] = self._signature(entry.stat(follow_symlinks=False))
+                except OSError:
+                    names[entry.name] = None
+        return signature, names
+
+    def watch(self, rel_dir):
+        try:
+            self._listings[rel_dir] = self._list(rel_dir)
+        except OSError:
+            self._listings[rel_dir] = (None, {})
+
+    def unwatch(self, rel_dir):
+        below = rel_dir + os.sep
+        for name in [d for d in self._listings if d == rel_dir or d.startswith(below) or not rel_dir]:
+            del self._listings[name]
+
+    def read(self, timeout=None):
+        """Poll every interval until something changed or timeout passes; returns the changed paths."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if wait > 0:
+                time.sleep(wait)
+            changed = self._poll()
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def _poll(self):
+        changed = set()
+        for rel_dir, (old_signature, names) in list(self._listings.items()):
+            prefix = rel_dir + os.sep if rel_dir else ''
+            try:
+                signature = self._signature(os.stat(self._path(rel_dir)))
+            except OSError:
+                changed.add(rel_dir)
+                continue
+            if signature != old_signature:
+                try:
+                    signature, current = self._list(rel_dir)
+                except OSError:
+                    changed.add(rel_dir)
+                    continue
+                changed.update(prefix + name for name in names.keys() ^ current.keys())
+                changed.update(prefix + name for name in names.keys() & current.keys()
+                               if names[name] != current[name])
+                self._listings[rel_dir] = (signature, current)
+                continue
+            for name, old in names.items():
+                try:
+                    current = self._signature(os.lstat(os.path.join(self._path(rel_dir), name)))
+                except OSError:
+                    current = None
+                if current != old:
+                    names[name] = current
+                    changed.add(prefix + name)
+        return changed
+
+    def close(self):
+        self._listings.clear()
+
+
+# ===== Content sniffing (generators) =====
+# How much of a file is inspected before committing to a full read
+SNIFF_BYTES = 8192
+
+# Leading bytes of binary formats that turn up in project trees
+BINARY_SIGNATURES = (
+    (b'SQLite format 3\x00', 'SQLite database'),
+    (b'\x7fELF', 'ELF executable'),
+    (b'\xcf\xfa\xed\xfe', 'Mach-O executable'),
+    (b'PK\x03\x04', 'ZIP archive'),
+    (b'\x1f\x8b', 'gzip archive'),
+    (b'\xfd7zXZ\x00', 'xz archive'),
+    (b"7z\xbc\xaf'\x1c", '7-Zip archive'),
+    (b'Rar!\x1a\x07', 'RAR archive'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'OLE compound document'),
+    (b'%PDF-', 'PDF document'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG image'),
+    (b'\xff\xd8\xff', 'JPEG image'),
+    (b'GIF8', 'GIF image'),
+    (b'wOFF', 'WOFF font'),
+    (b'wOF2', 'WOFF2 font'),
+)
+
+
+def format_size(size):
+    """Human-readable byte count for placeholders and reports."""
+    if size < 1024:
+        return f"{size} bytes"
+    for unit in ('KB', 'MB', 'GB', 'TB'):
+        size /= 1024
+        if size < 1024 or unit == 'TB':
+            return f"{size:.1f} {unit}"
+
+
+def parse_size(text):
+    """Parse a byte count such as 4096, 512K, 16M or 2G (binary multiples)."""
+    text = text.strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+    scale = 1
+    if text and text[-1] in 'KMGT':
+        scale = 1 << (10 * ('KMGT'.index(text[-1]) + 1))
+        text = text[:-1]
+    size = int(float(text) * scale)
+    if size < 0:
+        raise ValueError(f"negative size: {text}")
+    return size
+
+
+def _is_utf8_prefix(data):
+    try:
+        # Not final: a multi-byte character cut off at the end is fine
+        codecs.getincrementaldecoder('utf-8')().decode(data)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _sniff_binary(head, fallback_encoding=None):
+    for signature, kind in BINARY_SIGNATURES:
+        if head.startswith(signature):
+            return 'BINARY', kind
+    if b'\x00' in head:
+        return 'BINARY', 'contains NUL bytes'
+    if fallback_encoding is None and not _is_utf8_prefix(head):
+        return 'BINARY', 'not UTF-8 text'
+    return None
+
+
+def sniff_binary(path, fallback_encoding=None):
+    """The ('BINARY', reason) placeholder read_text_file would give path's head, or None for text.
+
+    For files read_text_file turned away as oversized before looking inside.
+    OSError propagates.
+    """
+    with open(path, 'rb') as f:
+        return _sniff_binary(f.read(SNIFF_BYTES), fallback_encoding)
+
+
+def read_text_file(path, st=None, limit=None, fallback_encoding=None):
+    """Read a file as text, sniffing it first so binaries and giants are never read in full.
+
+    Checked in order: not a regular file, st_size over limit (None or 0 means
+    no cap), then in the first SNIFF_BYTES a known binary signature, NUL bytes
+    and - without a fallback_encoding - bytes that are not UTF-8.
+    Returns (text, None), newlines translated as text-mode reading does, or
+    (None, (label, reason)) for a file to record as a placeholder. When the
+    whole file is not UTF-8 it is decoded with fallback_encoding if given
+    (bytes that encoding cannot decode become U+FFFD), otherwise stray bytes
+    past the head become U+FFFD. OSError propagates.
+    """
+    if st is None:
+        st = os.stat(path)
+    if not stat.S_ISREG(st.st_mode):
+        return None, ('SKIPPED', 'not a regular file')
+    if limit and st.st_size > limit:
+        return None, ('OVERSIZED', f"{format_size(st.st_size)} exceeds the {format_size(limit)} limit")
+
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+        skipped = _sniff_binary(head, fallback_encoding)
+        if skipped is not None:
+            return None, skipped
+        data = head + f.read() if len(head) == SNIFF_BYTES else head
+
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        if fallback_encoding:
+            text = data.decode(fallback_encoding, errors='replace')
+        else:
+            text = data.decode('utf-8', errors='replace')
+    return text.replace('\r\n', '\n').replace('\r', '\n'), None
+
+
+# ===== Embedded binaries =====
+# encoding -> (raw bytes per line, encode, decode). 57 bytes make a 76-character
+# base64 line and 64 an 80-character base85 one, so every line decodes alone.
+EMBED_CODECS = {
+    'base64': (57, base64.b64encode, base64.b64decode),
+    'base85': (64, base64.b85encode, base64.b85decode),
+}
+
+# Lines encoded or decoded at a time; a block is all of a file ever held in memory
+EMBED_BLOCK_LINES = 4096
+
+
+def _embed_width(encoding):
+    line_bytes = EMBED_CODECS[encoding][0]
+    return line_bytes // 3 * 4 if encoding == 'base64' else line_bytes // 4 * 5
+
+
+class BinaryEmbedder:
+    """Picks the binary files to embed in full, and streams them into a manifest.
+
+    A binary qualifies when it is a regular file of at most max_bytes (0 = no
+    cap) and, if patterns are given, its name or relative path matches one of
+    those globs. Its bytes are written as fixed-width lines of encoding.
+    """
+
+    def __init__(self, encoding='base64', max_bytes=0, patterns=()):
+        if encoding not in EMBED_CODECS:
+            raise ValueError(f"unknown embedding: {encoding}")
+        self.encoding = encoding
+        self.max_bytes = max_bytes
+        self.patterns = tuple(patterns)
+
+    def signature(self):
+        """The settings that shape embedded entries, for cache fingerprints."""
+        return [self.encoding, self.max_bytes, sorted(self.patterns)]
+
+    def size_to_embed(self, path, relative_path, st=None):
+        """The size of the binary at path if it should be embedded, else None."""
+        try:
+            st = st or os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode) or (self.max_bytes and st.st_size > self.max_bytes):
+            return None
+        if self.patterns:
+            key = index_key(relative_path)
+            name = key.rsplit('/', 1)[-1]
+            if not any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(key, p) for p in self.patterns):
+                return None
+        return st.st_size
+
+
+def embedded_length(size, encoding):
+    """Bytes iter_embedded_bytes writes for a size-byte file, with \\n newlines."""
+    line_bytes = EMBED_CODECS[encoding][0]
+    lines, rest = divmod(size, line_bytes)
+    if encoding == 'base64':
+        tail = -(-rest // 3) * 4
+    else:
+        tail = rest // 4 * 5 + (rest % 4 + 1 if rest % 4 else 0)
+    body = lines * (_embed_width(encoding) + 1) + (tail + 1 if rest else 0)
+    return len(f"{EMBED_BEGIN_PREFIX} {encoding}\n{EMBED_END_PREFIX} {size} {'0' * 64}\n") + body
+
+
+def iter_embedded_bytes(f, encoding, newline=b'\n'):
+    """Yield the begin line, encoded lines and end line embedding the rest of binary file f.
+
+    f is read EMBED_BLOCK_LINES lines' worth at a time; the end line records
+    the size and sha256 of the bytes actually read.
+    """
+    line_bytes, encode, _ = EMBED_CODECS[encoding]
+    width = _embed_width(encoding)
+    digest = hashlib.sha256()
+    size = 0
+    yield f"{EMBED_BEGIN_PREFIX} {encoding}".encode('ascii') + newline
+    while True:
+        block = f.read(line_bytes * EMBED_BLOCK_LINES)
+        if not block:
+            break
+        digest.update(block)
+        size += len(block)
+        # Blocks hold whole lines, so slicing the block's encoding splits it line by line
+        encoded = encode(block)
+        yield newline.join(encoded[i:i + width] for i in range(0, len(encoded), width)) + newline
+    yield f"{EMBED_END_PREFIX} {size} {digest.hexdigest()}".encode('ascii') + newline
+
+
+def embedded_trailer(scan, end):
+    """(size, sha256) recorded by the embedded binary end line at end of a ManifestScanner.
+
+    Raises ValueError when the line does not record both.
+    """
+    trailer_end, _ = scan.line_end(end)
+    fields = scan.text(end, trailer_end).strip()[len(EMBED_END_PREFIX):].split()
+    if len(fields) != 2 or not fields[0].isdigit():
+        raise ValueError("no size and sha256 after the embedded bytes")
+    return int(fields[0]), fields[1]
+
+
+def decode_embedded(scan, start, end, out):
+    """Decode the embedded binary spanning start:end of a ManifestScanner into out.
+
+    start is its begin line and end the start of its end line, as iter_entries
+    yields them; out takes write_bytes() calls. Lines are decoded a block at
+    a time. Raises ValueError when the encoding is unknown or the bytes do not
+    match the size and sha256 the end line records. Returns the size.
+    """
+    begin_end, data_start = scan.line_end(start)
+    encoding = scan.text(start, begin_end).strip()[len(EMBED_BEGIN_PREFIX):].strip()
+    if encoding not in EMBED_CODECS:
+        raise ValueError(f"unknown embedding {encoding!r}")
+    expected_size, expected_digest = embedded_trailer(scan, end)
+    decode = EMBED_CODECS[encoding][2]
+    digest = hashlib.sha256()
+    size = 0
+    for block in scan.iter_line_blocks(data_start, end, (_embed_width(encoding) + 1) * EMBED_BLOCK_LINES):
+        try:
+            data = decode(block.replace(b'\n', b''))
+        except ValueError as e:
+            raise ValueError(f"undecodable {encoding}: {e}") from e
+        digest.update(data)
+        size += len(data)
+        out.write_bytes(data)
+    if size != expected_size or digest.hexdigest() != expected_digest:
+        raise ValueError("decoded bytes do not match the recorded size and sha256")
+    return size
+
+
+# ===== Document extraction cache (generators) =====
+class ExtractionCache:
+    """Content-addressed store of document extraction results, shared across runs and projects.
+
+    An entry is keyed by the sha256 of the document's bytes and the signature
+    of the extractor that produced it, so a moved, renamed or copied document
+    still hits while an upgraded extractor misses. Each entry is one UTF-8
+    file whose mtime records its last use; close() evicts least recently used
+    entries until the store fits in max_bytes. Safe to share between reader
+    threads and concurrent runs: entries are published with an atomic rename
+    and a vanished entry is just a miss.
+
+    The extractor returns (text, cacheable); text from a degraded extraction
+    (a crashed or timed-out tool) is passed through but not stored.
+    """
+
+    SUFFIX = '.txt'
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def extract(self, path, signature, extractor):
+        """Return the text of extractor(path), served from the store when these bytes were extracted before."""
+        digest = hashlib.sha256(signature.encode('utf-8') + b'\0')
+        try:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(COPY_BLOCK), b''):
+                    digest.update(block)
+        except OSError:
+            # Let the extractor report the unreadable file as it always has
+            return extractor(path)[0]
+        entry = self._entry_path(digest.hexdigest())
+
+        try:
+            with open(entry, 'r', encoding='utf-8', newline='') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError):
+            text = None
+        if text is not None:
+            self._count(True)
+            try:
+                os.utime(entry)  # Last use, for LRU eviction
+            except OSError:
+                pass
+            return text
+
+        self._count(False)
+        text, cacheable = extractor(path)
+        if not cacheable:
+            return text
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with io.open(fd, 'w', encoding='utf-8', newline='') as f:
+                f.write(text)
+            os.replace(tmp_path, entry)
+        except (OSError, UnicodeError):
+            # A full or read-only store only costs the next run a re-extraction
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return text
+
+    def close(self):
+        """Evict least recently used entries until the store fits in max_bytes."""
+        try:
+            entries = []
+            with os.scandir(self.directory) as it:
+                for e in it:
+                    if e.name.endswith(self.SUFFIX):
+                        st = e.stat()
+                        entries.append((st.st_mtime_ns, st.st_size, e.path))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+# ===== Run profiling (generators) =====
+
+PROFILE_VERSION = 1
+
+
+class RunProfile:
+    """Per-stage timers, counters and the slowest files of one generator run.
+
+    A stage accumulates seconds and calls from any thread; reader threads add
+    to the same stage at once, so its seconds are thread-seconds and may
+    exceed the run's wall time. Callers hold None instead of a RunProfile when
+    profiling is off, so a disabled profile costs one comparison per call site.
+    """
+
+    def __init__(self, top=20):
+        self.top = top
+        self.timers = {}  # stage -> [seconds, calls]
+        self.counters = {}
+        self._slowest = []  # min-heap of (seconds, path, stage)
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def add(self, stage, seconds, calls=1):
+        with self._lock:
+            timer = self.timers.setdefault(stage, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += calls
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def file(self, path, stage, seconds, size):
+        """Record one file's pass through stage, keeping it if it is among the top slowest."""
+        with self._lock:
+            timer = self.timers.setdefault(stage, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += 1
+            self.counters[stage + '_bytes'] = self.counters.get(stage + '_bytes', 0) + size
+            if len(self._slowest) < self.top:
+                heapq.heappush(self._slowest, (seconds, path, stage))
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, (seconds, path, stage))
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def timed(self, stage, func):
+        """Wrap func so that every call is timed into stage."""
+        def timed_call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed_call
+
+    def timed_iter(self, stage, iterable):
+        """Yield from iterable, timing each wait for the next item into stage."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - start, 0)
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def report(self):
+        """The profile as a JSON-ready dict."""
+        with self._lock:
+            return {
+                'version': PROFILE_VERSION,
+                'wall_s': time.perf_counter() - self._started,
+                'stages': {name: {'seconds': seconds, 'calls': calls}
+                           for name, (seconds, calls) in self.timers.items()},
+                'counters': dict(sorted(self.counters.items())),
+                'slowest_files': [{'path': path, 'stage': stage, 'seconds': seconds}
+                                  for seconds, path, stage in sorted(self._slowest, reverse=True)],
+            }
+
+    def absorb(self, report, label=''):
+        """Fold another run's report() in: stages and counters add up, slowest files
+        compete for the top places with their paths joined onto label."""
+        with self._lock:
+            for name, timer in report['stages'].items():
+                mine = self.timers.setdefault(name, [0.0, 0])
+                mine[0] += timer['seconds']
+                mine[1] += timer['calls']
+            for name, value in report['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for item in report['slowest_files']:
+                slow = (item['seconds'], os.path.join(label, item['path']), item['stage'])
+                if len(self._slowest) < self.top:
+                    heapq.heappush(self._slowest, slow)
+                elif slow[0] > self._slowest[0][0]:
+                    heapq.heapreplace(self._slowest, slow)
+
+    def write_json(self, path, **extra):
+        """Write report(), plus any extra top-level keys, to path atomically."""
+        report = self.report()
+        report.update(extra)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        os.replace(tmp_path, path)
+
+
+# ===== Compressed manifests =====
+# established-source.txt.gz / .bz2 / .xz hold the manifest as a run of
+# independently compressed members ("frames") of whole entries. The standard
+# tools still see one valid file (gzip -d yields the plain manifest), while the
+# frame table in the .idx trailer lets a reader inflate only the frames it needs.
+# Offsets in the cache and index always refer to the uncompressed manifest.
+COMPRESSION_CODECS = {
+    'gzip': ('.gz', gzip.open, lambda: zlib.compressobj(6, zlib.DEFLATED, 31), gzip.decompress),
+    'bz2': ('.bz2', bz2.open, bz2.BZ2Compressor, bz2.decompress),
+}
+if lzma is not None:
+    COMPRESSION_CODECS['xz'] = ('.xz', lzma.open, lambda: lzma.LZMACompressor(lzma.FORMAT_XZ), lzma.decompress)
+
+_DECOMPRESS_ERRORS = (OSError, EOFError, zlib.error) + ((lzma.LZMAError,) if lzma is not None else ())
+
+# A frame is closed at the first entry boundary once it holds this many
+# uncompressed bytes; 0 gives every entry a frame of its own.
+FRAME_BYTES = 1 << 20
+
+
+def compression_of(path):
+    """The codec a manifest path's suffix calls for, or None for a plain manifest."""
+    for codec, (suffix, _, _, _) in COMPRESSION_CODECS.items():
+        if path.endswith(suffix):
+            return codec
+    return None
+
+
+def compressed_name(path, codec):
+    """path with the suffix for codec appended (unchanged for codec None)."""
+    return path + COMPRESSION_CODECS[codec][0] if codec else path
+
+
+def locate_manifest(path):
+    """Return path if it exists, else its first existing compressed variant, else path."""
+    for codec in (None, *COMPRESSION_CODECS):
+        candidate = compressed_name(path, codec)
+        if os.path.exists(candidate):
+            return candidate
+    return path
+
+
+def open_manifest(path):
+    """Open a manifest for sequential binary reading, inflating it if compressed.
+
+    Seeking works on the uncompressed stream (forward seeks decompress and discard).
+    """
+    codec = compression_of(path)
+    if codec is None:
+        return open(path, 'rb')
+    return COMPRESSION_CODECS[codec][1](path, 'rb')
+
+
+class ManifestWriter:
+    """Binary sink for a manifest: plain, or compressed in frames when path says so.
+
+    write() and tell() work in uncompressed bytes, so entry offsets recorded for
+    the cache and index are the same either way. Call mark() after each entry:
+    a frame only ends there, so an entry is inflated from as few frames as possible.
+    With digest, a sha256 of the bytes that reach the file is kept as they go.
+    """
+
+    def __init__(self, path, codec=None, frame_bytes=FRAME_BYTES, digest=False):
+        self.codec = codec if codec is not None else compression_of(path)
+        self._raw = open(path, 'wb')
+        self._frame_bytes = frame_bytes
+        self._compressor = None
+        self.position = 0
+        self.frames = []  # [compressed offset, uncompressed offset] of each frame
+        self.digest = hashlib.sha256() if digest else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data):
+        if self.codec is None:
+            self._emit(data)
+        else:
+            if self._compressor is None:
+                self.frames.append([self._raw.tell(), self.position])
+                self._compressor = COMPRESSION_CODECS[self.codec][2]()
+            self._emit(self._compressor.compress(data))
+        self.position += len(data)
+
+    def _emit(self, data):
+        self._raw.write(data)
+        if self.digest is not None:
+            self.digest.update(data)
+
+    def tell(self):
+        return self.position
+
+    def mark(self):
+        """An entry boundary: close the current frame if it is big enough."""
+        if self._compressor is not None and self.position - self.frames[-1][1] >= self._frame_bytes:
+            self._end_frame()
+
+    def _end_frame(self):
+        self._emit(self._compressor.flush())
+        self._compressor = None
+
+    def close(self):
+        if self._raw.closed:
+            return
+        try:
+            if self._compressor is not None:
+                self._end_frame()
+        finally:
+            self._raw.close()
+
+
+def _index_frames(manifest_path):
+    """Return (frames, uncompressed size) from the .idx of a compressed manifest, or None."""
+    index_path = manifest_path + INDEX_SUFFIX
+    try:
+        trailer = json.loads(_read_last_line(index_path))
+        if (trailer.get('manifest_size') != os.path.getsize(manifest_path)
+                or trailer.get('codec') != compression_of(manifest_path)):
+            return None
+        return trailer['frames'], trailer['manifest_bytes']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+# ===== Sharded manifests =====
+# With sharding, established-source.txt is a small shard table and the entries
+# live in established-source.txt.shards/ as standalone manifests, each with its
+# own header, .idx and .cache, holding contiguous runs of the sorted entries.
+# A shard is named after the sha256 of its file, so a shard whose entries did
+# not change keeps its name, bytes and mtime from one run to the next and sync
+# tools can skip it. Duplicates become references only within a shard, so
+# every shard restores on its own.
+SHARD_TABLE_MARKER = '[shard table]'
+SHARD_TABLE_VERSION = 1
+SHARD_DIR_SUFFIX = '.shards'
+SHARD_PREFIX = 'established-source-'
+SHARD_UNITS = ('bytes', 'entries')
+
+# Entries queued for a shard's writer thread - bounds memory like the read window
+SHARD_QUEUE = 256
+
+_SHARD_END = object()
+_SHARD_ABORT = object()
+
+
+def shard_dir(table_path):
+    """The directory holding the shards of the table at table_path."""
+    return table_path + SHARD_DIR_SUFFIX
+
+
+def shard_anchor(key):
+    """A pseudo-random number in [0, 1) fixed by the path alone."""
+    digest = hashlib.sha256(key.encode('utf-8', 'surrogateescape')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+
+class ShardPlanner:
+    """Decides where the sorted entry stream is cut into shards of about budget.
+
+    Cuts are content-defined: once a shard holds half its budget, an entry
+    starts the next shard when its path's anchor falls below weight / (budget / 2),
+    and any entry that would take a shard past twice the budget starts one too.
+    Shards therefore average the budget, and whether an entry is a cut depends
+    on its own path and weight, so an edit only moves the cuts beside it and
+    the other shards keep their bytes and names. An entry is never split; one
+    heavier than the budget simply gets a shard of its own.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.filled = 0
+
+    def cut(self, key, weight):
+        """Account for the next entry; True when it has to start a new shard."""
+        half = self.budget / 2
+        cut = self.filled > 0 and (self.filled + weight > 2 * self.budget or
+                                   (self.filled >= half and shard_anchor(key) < weight / half))
+        self.filled = (0 if cut else self.filled) + weight
+        return cut
+
+
+def read_shard_table(path):
+    """The shards a shard table lists, or None when path is an ordinary manifest (or missing).
+
+    Each shard is a dict of its 'name' (relative to the table), resolved 'path',
+    'entries', 'bytes', 'sha256' and 'first', the generator's key of its first entry.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.readline(64).rstrip(b'\r\n') != SHARD_TABLE_MARKER.encode('ascii'):
+                return None
+            header = json.loads(f.readline())
+            if header.get('version') != SHARD_TABLE_VERSION:
+                raise ValueError(f"{path}: unsupported shard table version {header.get('version')}")
+            shards = [json.loads(line) for line in f]
+    except OSError:
+        return None
+    base = os.path.dirname(path)
+    for shard in shards:
+        shard['path'] = os.path.join(base, shard['name'])
+    return shards
+
+
+def _write_shard_table(table_path, shards, unit, budget):
+    tmp_path = table_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(SHARD_TABLE_MARKER + '\n')
+        f.write(json.dumps({'version': SHARD_TABLE_VERSION, 'unit': unit, 'budget': budget,
+                            'shards': len(shards), 'entries': sum(s['entries'] for s in shards)}) + '\n')
+        for shard in shards:
+            f.write(json.dumps({key: shard[key] for key in ('name', 'entries', 'bytes', 'sha256', 'first')}) + '\n')
+    os.replace(tmp_path, table_path)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def prune_shards(table_path, keep=()):
+    """Delete the shard files (sidecars and leftover temporaries too) that keep does not name.
+
+    keep holds shard file names; the shard directory goes once it is empty.
+    """
+    directory = shard_dir(table_path)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    keep = set(keep)
+    for name in names:
+        if not name.startswith((SHARD_PREFIX, '.shard-')):
+            continue
+        base = name
+        while base.endswith(('.tmp', INDEX_SUFFIX, CACHE_SUFFIX)):
+            base = base.rsplit('.', 1)[0]
+        if base not in keep:
+            _remove_quietly(os.path.join(directory, name))
+    with contextlib.suppress(OSError):
+        os.rmdir(directory)
+
+
+def remove_shards(table_path):
+    """Retire a sharded layout once a single manifest has been written in its place.
+
+    The shard table goes too if it is still at table_path (e.g. the new
+    manifest was written compressed, beside it).
+    """
+    if read_shard_table(table_path) is not None:
+        os.remove(table_path)
+    prune_shards(table_path)
+
+
+def _shard_file(directory, provisional, out):
+    """(path, sha256, size, unchanged) of a shard written to provisional through out.
+
+    unchanged means a file of that content-derived name is already in place.
+    """
+    sha256 = out.digest.hexdigest()
+    path = os.path.join(directory, compressed_name(f'{SHARD_PREFIX}{sha256[:16]}.txt', out.codec))
+    size = os.path.getsize(provisional)
+    return path, sha256, size, os.path.isfile(path) and os.path.getsize(path) == size
+
+
+def _publish_sidecar(provisional, path):
+    # An identical sidecar is kept as it is, mtime and all, like its shard
+    try:
+        with open(provisional, 'rb') as new, open(path, 'rb') as old:
+            same = new.read() == old.read()
+    except FileNotFoundError:
+        same = False
+    if same:
+        os.remove(provisional)
+    else:
+        os.replace(provisional, path)
+
+
+class _ShardFeed:
+    """The entry stream of one shard, passed from the producer to its writer thread."""
+
+    def __init__(self):
+        self.queue = queue.Queue(SHARD_QUEUE)
+        self.ended = False
+
+    def __iter__(self):
+        while True:
+            entry = self.queue.get()
+            if entry is _SHARD_END or entry is _SHARD_ABORT:
+                self.ended = True
+                if entry is _SHARD_ABORT:
+                    raise RuntimeError("sharded write abandoned")
+                return
+            yield entry
+
+    def drain(self):
+        """Swallow the rest of the stream, so the producer never blocks on a dead writer."""
+        while not self.ended:
+            entry = self.queue.get()
+            self.ended = entry is _SHARD_END or entry is _SHARD_ABORT
+
+
+class ShardWriter:
+    """Writes a sorted entry stream as shards, then the shard table that lists them.
+
+    add() hands each entry to the current shard, starting a new one wherever
+    the ShardPlanner cuts; weigh(entry) gives an entry's bytes, and with the
+    'entries' unit every entry weighs 1. Each shard is written by
+    write_shard(out, entries, cache_writer, index_writer), which returns that
+    shard's tally, on one of jobs threads while later shards fill. A finished
+    shard whose file already exists is left untouched; only its sidecars are
+    rewritten. commit() publishes the table and removes whatever it no longer
+    names; close() abandons a run that did not get that far.
+    """
+
+    def __init__(self, table_path, write_shard, budget, unit='bytes', weigh=None, codec=None, jobs=1,
+                 fingerprint=None, write_index=True, started_ns=None):
+        if unit not in SHARD_UNITS:
+            raise ValueError(f"shard unit must be one of {SHARD_UNITS}, not {unit!r}")
+        self.table_path = table_path
+        self.directory = shard_dir(table_path)
+        self.unit = unit
+        self.budget = budget
+        self.codec = codec
+        self.shards = []  # table records, filled in by commit()
+        self._write_shard = write_shard
+        self._weigh = weigh if unit == 'bytes' else None
+        self._planner = ShardPlanner(budget)
+        self._fingerprint = fingerprint
+        self._write_index = write_index
+        self._started_ns = time.time_ns() if started_ns is None else started_ns
+        self._pending = []  # [first key, entries, future] of each shard so far
+        self._feed = None
+        os.makedirs(self.directory, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, jobs))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, key, entry):
+        weight = self._weigh(entry) if self._weigh is not None else 1
+        if self._planner.cut(key, weight) or self._feed is None:
+            self._start(key)
+        self._pending[-1][1] += 1
+        self._feed.queue.put(entry)
+
+    def _start(self, key):
+        if self._feed is not None:
+            self._feed.queue.put(_SHARD_END)
+        for _, _, future in self._pending:
+            if future.done():
+                future.result()  # A failed shard stops the run now rather than at commit()
+        self._feed = _ShardFeed()
+        self._pending.append([key, 0, self._pool.submit(self._write, len(self._pending), self._feed)])
+
+    def _write(self, seq, feed):
+        provisional = os.path.join(self.directory, f'.shard-{seq}.tmp')
+        cache_writer = index_writer = None
+        try:
+            if self._fingerprint is not None:
+                cache_writer = ManifestCacheWriter(provisional, self._fingerprint, self._started_ns)
+            if self._write_index:
+                index_writer = ManifestIndexWriter(provisional)
+            with ManifestWriter(provisional, self.codec, digest=True) as out:
+                tally = self._write_shard(out, feed, cache_writer, index_writer)
+            path, sha256, size, unchanged = _shard_file(self.directory, provisional, out)
+            # Sidecars are sealed against the file that stays: the old one when nothing changed
+            sealed = path if unchanged else provisional
+            if cache_writer is not None:
+                cache_writer.commit(sealed)
+                cache_writer = None
+                _publish_sidecar(provisional + CACHE_SUFFIX, path + CACHE_SUFFIX)
+            if index_writer is not None:
+                index_writer.commit(sealed, out)
+                index_writer = None
+                _publish_sidecar(provisional + INDEX_SUFFIX, path + INDEX_SUFFIX)
+            if unchanged:
+                os.remove(provisional)
+            else:
+                os.replace(provisional, path)
+            return os.path.basename(path), size, sha256, unchanged, tally
+        except BaseException:
+            feed.drain()
+            for writer in (cache_writer, index_writer):
+                if writer is not None:
+                    writer.discard()
+            _remove_quietly(provisional)
+            raise
+
+    def commit(self, cache=None):
+        """Wait for every shard, publish the table and prune stale files; returns the shard tallies.
+
+        cache, the previous run's cache, is closed before any old shard is removed.
+        """
+        if self._feed is not None:
+            self._feed.queue.put(_SHARD_END)
+            self._feed = None
+        tallies = []
+        prefix = os.path.basename(self.directory) + '/'
+        for first, entries, future in self._pending:
+            name, size, sha256, unchanged, tally = future.result()
+            self.shards.append({'name': prefix + name, 'entries': entries, 'bytes': size,
+                                'sha256': sha256, 'first': first, 'unchanged': unchanged})
+            tallies.append(tally)
+        self._pool.shutdown()
+        self._pool = None
+        if cache is not None:
+            cache.close()
+        _write_shard_table(self.table_path, self.shards, self.unit, self.budget)
+        # A single manifest written by an earlier run is superseded by the table
+        for codec in (None, *COMPRESSION_CODECS):
+            manifest_path = compressed_name(self.table_path, codec)
+            for path in (manifest_path + INDEX_SUFFIX, manifest_path + CACHE_SUFFIX):
+                _remove_quietly(path)
+            if codec is not None:
+                _remove_quietly(manifest_path)
+        prune_shards(self.table_path, [shard['name'][len(prefix):] for shard in self.shards])
+        return tallies
+
+    def close(self):
+        """Abandon the run unless commit() finished it; half-written shards are removed."""
+        if self._pool is None:
+            return
+        if self._feed is not None:
+            self._feed.queue.put(_SHARD_ABORT)
+            self._feed = None
+        self._pool.shutdown(cancel_futures=True)
+        self._pool = None
+
+
+class ShardedManifestCache:
+    """The previous run's cache when it wrote shards: a ManifestCache per shard, one open at a time.
+
+    Lookups arrive in sorted order, so each one is routed to the last shard
+    whose first key is not after it, and the shards are opened as the lookups
+    reach them.
+    """
+
+    def __init__(self, shards, fingerprint):
+        self.reused = 0
+        self.refreshed = 0
+        self._firsts = [shard['first'] for shard in shards]
+        self._paths = [shard['path'] for shard in shards]
+        self._fingerprint = fingerprint
+        self._at = -1
+        self._cache = None
+
+    @property
+    def active(self):
+        return bool(self._paths)
+
+    def lookup(self, relative_path, st):
+        at = bisect.bisect_right(self._firsts, relative_path) - 1
+        if at != self._at:
+            if self._cache is not None:
+                self._cache.close()
+            self._at = at
+            self._cache = ManifestCache(self._paths[at], self._fingerprint) if at >= 0 else None
+        hit = self._cache.lookup(relative_path, st) if self._cache is not None else None
+        if hit is None:
+            self.refreshed += 1
+        else:
+            self.reused += 1
+        return hit
+
+    def close(self):
+        if self._cache is not None:
+            self._cache.close()
+        self._cache = None
+        self._at = -1
+
+
+def open_cache(manifest_path, fingerprint):
+    """The cache the previous run left at manifest_path, whether it wrote a manifest or a shard table."""
+    shards = read_shard_table(manifest_path)
+    if shards is not None:
+        return ShardedManifestCache(shards, fingerprint)
+    return ManifestCache(manifest_path, fingerprint)
+
+
+def rewrite_shards(table_path, output_path, transform):
+    """Run transform(scan, out) over every shard of a table into a new table at output_path.
+
+    Each shard is copied through its own ManifestScanner and ManifestWriter,
+    keeping its codec, and named after its new bytes; the returned total sums
+    transform's results. Like a rewritten single manifest, no sidecars are written.
+    """
+    shards = read_shard_table(table_path)
+    with open(table_path, 'rb') as f:
+        f.readline()
+        header = json.loads(f.readline())
+    directory = shard_dir(output_path)
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.basename(directory) + '/'
+    records = []
+    total = 0
+    for seq, shard in enumerate(shards):
+        provisional = os.path.join(directory, f'.shard-{seq}.tmp')
+        try:
+            with ManifestScanner(shard['path']) as scan, \
+                    ManifestWriter(provisional, compression_of(shard['path']), digest=True) as out:
+                total += transform(scan, out)
+            path, sha256, size, unchanged = _shard_file(directory, provisional, out)
+            if unchanged:
+                os.remove(provisional)
+            else:
+                os.replace(provisional, path)
+        except BaseException:
+            _remove_quietly(provisional)
+            raise
+        records.append({'name': prefix + os.path.basename(path), 'entries': shard['entries'], 'bytes': size,
+                        'sha256': sha256, 'first': shard['first']})
+    _write_shard_table(output_path, records, header.get('unit'), header.get('budget'))
+    prune_shards(output_path, [record['name'][len(prefix):] for record in records])
+    return total
+
+
+def plan_shard_restore(shards, paths=None):
+    """Pair each shard with the keys to restore from it; returns (plan, keys no shard holds).
+
+    Without paths every shard is restored in full (keys None). Otherwise each
+    shard's .idx says which keys it holds, and a shard without a usable index
+    is handed every key the indexes did not place, to scan for itself.
+    """
+    if not paths:
+        return [(shard, None) for shard in shards], []
+    keys = list(dict.fromkeys(index_key(p) for p in paths))
+    placed = set()
+    plan = []
+    unindexed = []
+    for shard in shards:
+        found = find_indexed_entries(shard['path'], keys)
+        if found is None:
+            unindexed.append(len(plan))
+            plan.append((shard, None))
+            continue
+        held = [key for key in keys if key in found]
+        placed.update(held)
+        if held:
+            plan.append((shard, held))
+    rest = [key for key in keys if key not in placed]
+    for at in unindexed:
+        plan[at] = (plan[at][0], rest)
+    plan = [(shard, held) for shard, held in plan if held]
+    return plan, [] if unindexed else rest
+
+
+def restore_shards(plan, restore, jobs=1, writer=None):
+    """Yield (shard, restored count) as restore(shard path, keys, writer) works through plan.
+
+    With jobs > 1 and several shards, that many worker processes restore
+    shards at once, each with a RestoreWriter of its own marked shared (so it
+    reports in summary, like a pooled writer); restore must then be a
+    module-level function. Otherwise shards are restored here through writer.
+    Either way writer ends up counting every file written or left unchanged.
+    """
+    if jobs <= 1 or len(plan) <= 1:
+        for shard, keys in plan:
+            yield shard, restore(shard['path'], keys, writer)
+        return
+    keep_unchanged = writer is not None and writer.keep_unchanged
+    with ProcessPoolExecutor(max_workers=min(jobs, len(plan)), initializer=_line_buffered_stdout) as pool:
+        results = pool.map(_restore_shard, [(restore, shard['path'], keys, keep_unchanged) for shard, keys in plan])
+        for (shard, _), (count, written, skipped) in zip(plan, results):
+            if writer is not None:
+                writer.written += written
+                writer.skipped += skipped
+            yield shard, count
+
+
+def _line_buffered_stdout():
+    # Whole lines only, so reports from several workers never interleave mid-line
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=True)
+
+
+def _restore_shard(job):
+    restore, path, keys, keep_unchanged = job
+    writer = RestoreWriter(shared=True, keep_unchanged=keep_unchanged)
+    try:
+        count = restore(path, keys, writer)
+    finally:
+        writer.close()
+    return count, writer.written, writer.skipped
+
+
+# ===== mmap manifest scanner =====
+_LINESEP = os.linesep.encode('ascii')
+
+# Bodies that need newline translation are copied through in blocks this big
+COPY_BLOCK = 1 << 20
+
+
+class ManifestScanner:
+    """Read-only mmap of a manifest, searched with bytes-level find().
+
+    Positions are byte offsets into the file. Lines end at \\n, \\r\\n or a
+    lone \\r, exactly as text-mode reading splits them, but only the short
+    lines a caller asks about (paths and marker candidates) are ever decoded.
+    Entry bodies are written to disk straight from memoryview slices of the
+    map, so content that is only copied through never becomes a str.
+
+    A compressed manifest is inflated into an anonymous temporary file that is
+    mapped instead. With lazy and a frame table in the .idx, that file starts
+    out sparse and the indexed_* lookups inflate just the frames they touch;
+    everything else reads as NUL bytes, so lazy scanners suit index lookups only.
+    """
+
+    def __init__(self, path, lazy=False):
+        self.codec = compression_of(path)
+        self._source = None
+        self._frames = None
+        if self.codec is None:
+            self._file = open(path, 'rb')
+            access = mmap.ACCESS_READ
+        else:
+            self._file = tempfile.TemporaryFile()
+            table = _index_frames(path) if lazy else None
+            if table is not None:
+                frames, total = table
+                self._source = open(path, 'rb')
+                self._frames = frames + [[os.path.getsize(path), total]]
+                self._frame_starts = [start for _, start in self._frames]
+                self._loaded = set()
+                self._file.truncate(total)
+                access = mmap.ACCESS_WRITE
+            else:
+                with open_manifest(path) as source:
+                    shutil.copyfileobj(source, self._file, COPY_BLOCK)
+                self._file.flush()
+                access = mmap.ACCESS_READ
+        try:
+            self.data = mmap.mmap(self._file.fileno(), 0, access=access)
+        except ValueError:
+            # Empty files cannot be mapped
+            self.data = b''
+        self.size = len(self.data)
+        # Without a \r anywhere, lines end at \n and bodies need no translation
+        self._has_cr = self._frames is None and self.data.find(b'\r') != -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self._file.close()
+        if self._source is not None:
+            self._source.close()
+
+    def inflate(self, offset, length):
+        """Make offset:offset+length readable in a lazy scanner by inflating its frames."""
+        if self._frames is None:
+            return
+        i = max(0, bisect.bisect_right(self._frame_starts, offset) - 1)
+        decompress = COMPRESSION_CODECS[self.codec][3]
+        while i < len(self._frames) - 1 and self._frame_starts[i] < offset + length:
+            if i not in self._loaded:
+                (packed, start), (packed_end, end) = self._frames[i], self._frames[i + 1]
+                self._source.seek(packed)
+                try:
+                    chunk = decompress(self._source.read(packed_end - packed))
+                except _DECOMPRESS_ERRORS as e:
+                    raise ValueError(f"frame {i} is corrupt: {e}") from e
+                if len(chunk) != end - start:
+                    raise ValueError(f"frame {i} does not match the index")
+                self.data[start:end] = chunk
+                self._has_cr = self._has_cr or b'\r' in chunk
+                self._loaded.add(i)
+            i += 1
+
+    def find(self, needle, start=0):
+        return self.data.find(needle, start)
+
+    def line_end(self, pos):
+        """Return (end, next) for the line at pos: where its text stops and where the next line starts."""
+        data = self.data
+        nl = data.find(b'\n', pos)
+        if nl == -1:
+            nl = self.size
+        if self._has_cr:
+            cr = data.find(b'\r', pos, nl)
+            if cr != -1:
+                if cr + 1 == nl and nl < self.size:
+                    return cr, nl + 1
+                return cr, cr + 1
+        return nl, min(nl + 1, self.size)
+
+    def line_start(self, pos, floor=0):
+        """Start of the line holding pos, never earlier than floor."""
+        start = self.data.rfind(b'\n', floor, pos) + 1
+        if self._has_cr:
+            start = max(start, self.data.rfind(b'\r', floor, pos) + 1)
+        return max(start, floor)
+
+    def text(self, start, end):
+        """Decode one short span, such as a path or marker line."""
+        return self.data[start:end].decode('utf-8', errors='replace')
+
+    def find_marker_line(self, marker, pos, exact=True):
+        """Find the first line at or after pos holding marker.
+
+        With exact, the stripped line must be the marker itself; otherwise any
+        line containing it counts. Returns (start, next) for that line, or None
+        when the manifest ends first. Only candidate lines are decoded.
+        """
+        needle = marker.encode('utf-8')
+        while True:
+            hit = self.data.find(needle, pos)
+            if hit == -1:
+                return None
+            start = self.line_start(hit, pos)
+            end, following = self.line_end(start)
+            if not exact or self.text(start, end).strip() == marker:
+                return start, following
+            pos = following
+
+    def _indexed_header(self, offset, length, key, count):
+        """Read the first count lines of the entry an index places at offset.
+
+        Returns (lines, pos after them), or raises ValueError unless the lines
+        are the blank separator and the path line for key, followed by at most
+        one digest line that is not counted.
+        """
+        stop = offset + length
+        if stop > self.size or length <= 0:
+            raise ValueError(f"index does not point at {key}")
+        self.inflate(offset, length)
+        header = []
+        pos = offset
+        while len(header) < count:
+            if pos >= stop:
+                raise ValueError(f"index does not point at {key}")
+            end, following = self.line_end(pos)
+            line = self.text(pos, end)
+            pos = following
+            if len(header) == 2 and line.startswith(DIGEST_PREFIX):
+                continue
+            header.append(line)
+        if header[0] != '' or not index_key(header[1]).endswith(key):
+            raise ValueError(f"index does not point at {key}")
+        return header, pos
+
+    def indexed_reference(self, offset, length, key):
+        """Return the index key of the entry a reference the index places at offset points at.
+
+        Path lines may carry a prefix the index keys lack (the Deb13 generator
+        writes absolute paths); the target is written the same way and has the
+        same prefix dropped. Raises ValueError if the bytes there are not a
+        reference entry for key.
+        """
+        header, _ = self._indexed_header(offset, length, key, 3)
+        target = reference_target(header[2].strip())
+        if not target:
+            raise ValueError(f"index does not point at a reference for {key}")
+        prefix = index_key(header[1])[:-len(key)]
+        target = index_key(target)
+        if not target.startswith(prefix):
+            raise ValueError(f"reference for {key} points outside the manifest")
+        return target[len(prefix):]
+
+    def indexed_content(self, offset, length, key):
+        """Return the (start, stop) span of everything after the path line of the entry an index places at offset.
+
+        Raises ValueError if the bytes there are not the entry for key.
+        """
+        _, pos = self._indexed_header(offset, length, key, 2)
+        return pos, offset + length
+
+    def indexed_body(self, offset, length, key):
+        """Return the (start, end) body span of the text entry an index places at offset.
+
+        Raises ValueError if the bytes there are not the entry for key (check the
+        index kind flag first - binary placeholders and references have no body).
+        """
+        header, pos = self._indexed_header(offset, length, key, 3)
+        if header[2] != MARKER_BEGIN:
+            raise ValueError(f"index does not point at {key}")
+        trailer, line = self._indexed_trailer(pos, offset + length, key)
+        if line != MARKER_END:
+            raise ValueError(f"entry for {key} is truncated")
+        return pos, trailer
+
+    def indexed_embedded(self, offset, length, key):
+        """Return the (start, end) span of the embedded binary an index places at offset.
+
+        The span is the one iter_entries yields for decode_embedded. Raises
+        ValueError if the bytes there are not an embedded entry for key.
+        """
+        _, pos = self._indexed_header(offset, length, key, 2)
+        begin_end, _ = self.line_end(pos)
+        if not self.text(pos, begin_end).startswith(EMBED_BEGIN_PREFIX):
+            raise ValueError(f"index does not point at an embedded binary for {key}")
+        trailer, line = self._indexed_trailer(pos, offset + length, key)
+        if trailer <= pos or not line.startswith(EMBED_END_PREFIX):
+            raise ValueError(f"entry for {key} is truncated")
+        return pos, trailer
+
+    def _indexed_trailer(self, pos, stop, key):
+        """(start, text) of an indexed entry's last line, which must end right at stop."""
+        last = stop - 1
+        if self.data[last] not in b'\r\n':
+            raise ValueError(f"entry for {key} is truncated")
+        if self.data[last] == 10 and last > pos and self.data[last - 1] == 13:
+            last -= 1
+        trailer = self.line_start(last, pos)
+        if trailer < pos:
+            raise ValueError(f"entry for {key} is truncated")
+        return trailer, self.text(trailer, last)
+
+    def copied_size(self, start, end):
+        """Bytes copy_text() writes for start:end, or None when only translating would tell."""
+        if _LINESEP == b'\n' and not (self._has_cr and self.data.find(b'\r', start, end) != -1):
+            return max(0, end - start)
+        return None
+
+    def copy_text(self, start, end, out):
+        """Write start:end to out as text-mode reading then writing would.
+
+        When nothing needs translating the bytes go out as one memoryview slice
+        of the map; otherwise they are translated COPY_BLOCK at a time.
+        """
+        if end <= start:
+            return
+        if _LINESEP == b'\n' and not (self._has_cr and self.data.find(b'\r', start, end) != -1):
+            with memoryview(self.data) as view, view[start:end] as body:
+                out.write_bytes(body)
+            return
+        pos = start
+        while pos < end:
+            stop = min(pos + COPY_BLOCK, end)
+            if stop < end and self.data[stop - 1] == 13:
+                stop += 1  # keep a \r\n pair together
+            out.write_bytes(encode_newlines(self.normalise(self.data[pos:stop])))
+            pos = stop
+
+    def normalise(self, data):
+        """Translate \\r\\n and lone \\r to \\n, as text-mode reading does."""
+        if self._has_cr and b'\r' in data:
+            data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        return data
+
+    def iter_line_blocks(self, start=0, end=None, size=COPY_BLOCK):
+        """Yield runs of whole lines from start:end, about size bytes each.
+
+        Blocks end on a line boundary (or at end), so rules that never cross a
+        line can be applied block by block. Newlines are normalised to \\n.
+        """
+        end = self.size if end is None else end
+        pos = start
+        while pos < end:
+            stop = pos + size
+            stop = end if stop >= end else min(self.line_end(stop)[1], end)
+            yield self.normalise(self.data[pos:stop])
+            pos = stop
+
+
+def iter_entries(scan):
+    """Walk a mapped manifest the way restore-es-deb.py reads it.
+
+    Yields (kind, start, end, path) spans in file order:
+      'path' - a ./ or .\\ path line outside any body (end stops before its newline)
+      'body' - an entry body closed by an end marker; path is the stripped
+               path line that named it, or None
+      'cut'  - a body the manifest ends in the middle of
+      'ref'  - a reference line standing in for the body of path (end stops
+               before its newline; reference_target() gives the first copy)
+      'embed' - an embedded binary of path, from its begin line to the start
+               of its end line (decode_embedded() reads it)
+    Everything between the spans (markers, blank lines, headers) is framing.
+    """
+    def line_at(pos):
+        end, following = scan.line_end(pos)
+        return scan.text(pos, end).strip(), end, following
+
+    path = None
+    previous = ''
+    pos = 0
+    while pos < scan.size:
+        start = pos
+        stripped, end, pos = line_at(pos)
+        opens_manifest = previous.startswith(HEADER_NAME_PREFIX)
+        if stripped:
+            previous = stripped
+
+        if is_path_line(stripped):
+            path = stripped
+            yield 'path', start, end, path
+            continue
+
+        if stripped == MARKER_BEGIN and opens_manifest:
+            # The header's opener frames every entry (and each shard repeats it);
+            # reading it as an entry opener would run a binary or referenced
+            # first entry into the next file's body
+            continue
+
+        if path is not None and stripped.startswith(EMBED_BEGIN_PREFIX):
+            # Encoded lines never hold a [, so the first end line found closes the block
+            found = scan.find_marker_line(EMBED_END_PREFIX, pos, exact=False)
+            if found is None:
+                yield 'cut', start, scan.size, path
+                return
+            yield 'embed', start, found[0], path
+            pos = found[1]
+            path = None
+            continue
+
+        if stripped != MARKER_BEGIN:
+            if path is not None and stripped.startswith(REFERENCE_PREFIX):
+                yield 'ref', start, end, path
+                path = None
+            continue
+
+        # A file-block opener. Manifests sometimes put a path between two begin markers.
+        # Content starts on the line after the opener unless a path (and maybe a
+        # second begin marker) follows, skipping blank lines to find it.
+        body_start = pos
+        nxt = pos
+        while nxt < scan.size:
+            nextstr, next_end, after = line_at(nxt)
+            if nextstr:
+                break
+            nxt = after
+        if nxt < scan.size:
+            if is_path_line(nextstr):
+                path = nextstr
+                yield 'path', nxt, next_end, path
+                body_start = after
+                if after < scan.size:
+                    again, _, beyond = line_at(after)
+                    if again.startswith(DIGEST_PREFIX) and beyond < scan.size:
+                        again, _, beyond = line_at(beyond)
+                    if again == MARKER_BEGIN:
+                        body_start = beyond
+            elif nextstr == MARKER_BEGIN:
+                # nested begin - consume both
+                body_start = after
+
+        found = scan.find_marker_line(MARKER_END, body_start)
+        if found is None:
+            yield 'cut', body_start, scan.size, path
+            return
+        body_end, pos = found
+        yield 'body', body_start, body_end, path
+        path = None
+
+
+# ===== Scoped rewriting (purifiers) =====
+def _compile_rules(rules, counter):
+    """Fold (pattern, replacement) pairs into one single-pass bytes rewriter.
+
+    Patterns are bytes regexes without groups of their own; each becomes one
+    alternative of a single compiled matcher. counter[0] counts replacements.
+    """
+    if not rules:
+        return None
+    matcher = re.compile(b'|'.join(b'(' + pattern + b')' for pattern, _ in rules))
+    replacements = [None] + [replacement for _, replacement in rules]
+
+    def replace(match):
+        counter[0] += 1
+        return replacements[match.lastindex]
+
+    return lambda data: matcher.sub(replace, data)
+
+
+def rewrite_manifest(scan, out, rules):
+    """Stream a mapped manifest into the ManifestWriter out, applying scoped rules.
+
+    rules are (scope, pattern, replacement) triples. Scope 'path' applies to
+    path lines, 'content' to every entry body, and anything else is an
+    fnmatch pattern on an entry's file name (e.g. 'package.json') whose body
+    it alone applies to. Framing, reference lines and embedded binaries are
+    copied untouched. Everything is one pass, a block of whole lines at a
+    time, so memory stays flat. Returns the number of replacements made.
+    """
+    counter = [0]
+    path_rewrite = _compile_rules([(p, r) for scope, p, r in rules if scope == 'path'], counter)
+    entry_scopes = sorted({scope for scope, _, _ in rules} - {'path', 'content'})
+    body_rewrites = {}
+
+    def body_rewrite(path):
+        name = os.path.basename(index_key(path)) if path else ''
+        matched = tuple(scope for scope in entry_scopes if name and fnmatch.fnmatch(name, scope))
+        if matched not in body_rewrites:
+            selected = [(p, r) for scope, p, r in rules if scope == 'content' or scope in matched]
+            body_rewrites[matched] = _compile_rules(selected, counter)
+        return body_rewrites[matched]
+
+    def emit(start, end, rewrite=None):
+        for block in scan.iter_line_blocks(start, end):
+            out.write(encode_newlines(rewrite(block) if rewrite else block))
+
+    pos = 0
+    for kind, start, end, path in iter_entries(scan):
+        if kind in ('ref', 'embed'):
+            # Targets are matched by index_key, which any path-rule rewrite preserves
+            continue
+        emit(pos, start)
+        emit(start, end, path_rewrite if kind == 'path' else body_rewrite(path))
+        pos = end
+        if kind == 'body':
+            out.mark()
+    emit(pos, scan.size)
+    return counter[0]
+
+
+# ===== Delta manifests =====
+# A delta carries one manifest generation to the next. It is a manifest of its
+# own, established-source.txt.delta, holding every entry that was added or
+# changed, written in full, and a "[file removed]" line for each entry that
+# went away. Its header pins both generations by fingerprint - a sha256 over
+# every key and the sha256 of what follows its path line - so it only ever
+# patches the manifest it was made from, and the result is checked too.
+DELTA_FILENAME = 'established-source.txt.delta'
+DELTA_BASE_PREFIX = '[delta base]:'
+DELTA_TARGET_PREFIX = '[delta target]:'
+MARKER_REMOVED = '[file removed]'
+
+# Change kind read_delta gives a removal (the others are ENTRY_* kinds)
+DELTA_REMOVED = '-'
+
+
+def _manifest_order(key):
+    """Sort key placing an index key where the generators put its entry."""
+    return key.replace('/', os.sep)
+
+
+def _span_digest(scan, start, stop):
+    with memoryview(scan.data) as view, view[start:stop] as span:
+        return hashlib.sha256(span).digest()
+
+
+def _copy_span(scan, start, stop, out):
+    """Write start:stop of a ManifestScanner to the ManifestWriter out, COPY_BLOCK at a time."""
+    with memoryview(scan.data) as view:
+        for pos in range(start, stop, COPY_BLOCK):
+            with view[pos:min(pos + COPY_BLOCK, stop)] as block:
+                out.write(block)
+
+
+def _fold(fingerprint, key, signature):
+    fingerprint.update(key.encode('utf-8') + b'\0' + signature)
+
+
+def _entry_spans(manifest_path):
+    """Yield (key, scan, start, stop, target) for each entry of a manifest or shard table, in order.
+
+    start:stop is everything after the entry's path line, and target the key
+    a reference points at (None for any other entry). Every manifest is read
+    through its .idx, raising OSError or ValueError when one is missing or stale.
+    """
+    shards = read_shard_table(manifest_path)
+    for path in [manifest_path] if shards is None else [shard['path'] for shard in shards]:
+        with ManifestScanner(path) as scan:
+            for key, offset, length, kind in _iter_index(path):
+                start, stop = scan.indexed_content(offset, length, key)
+                target = scan.indexed_reference(offset, length, key) if kind == ENTRY_REFERENCE else None
+                yield key, scan, start, stop, target
+
+
+def _iter_signatures(manifest_path):
+    """Yield (key, signature, target) for each entry; a reference signs as the entry it names."""
+    signatures = {}
+    for key, scan, start, stop, target in _entry_spans(manifest_path):
+        signature = signatures.get(target) if target is not None else None
+        if signature is None:
+            signature = _span_digest(scan, start, stop)
+        signatures[key] = signature
+        yield key, signature, target
+
+
+def write_delta(base_path, target_path, delta_path):
+    """Write the delta that carries the manifest at base_path to the one at target_path.
+
+    Either may be a shard table. Entries are compared through the indexes, so
+    only changed entries are ever copied. A reference goes into the delta as
+    its target's content, and an unchanged base reference whose target changed
+    or went away is written too, so applying the delta never needs an entry it
+    does not carry. Returns (added, changed, removed) counts; raises OSError
+    or ValueError when a manifest has no usable index.
+    """
+    base = {}
+    base_print = hashlib.sha256()
+    for key, signature, target in _iter_signatures(base_path):
+        base[key] = (signature, target)
+        _fold(base_print, key, signature)
+    signatures = {}
+    target_print = hashlib.sha256()
+    for key, signature, _ in _iter_signatures(target_path):
+        signatures[key] = signature
+        _fold(target_print, key, signature)
+
+    removed = [key for key in base if key not in signatures]
+    changed = {key for key, signature in signatures.items() if base.get(key, (None,))[0] != signature}
+    stale = changed.union(removed)
+    changed.update(key for key, (_, target) in base.items() if target in stale and key in signatures)
+    added = sum(1 for key in changed if key not in base)
+
+    tmp_path = delta_path + '.tmp'
+    try:
+        with ManifestWriter(tmp_path, compression_of(delta_path)) as out:
+            out.write(f"{DELTA_BASE_PREFIX} {base_print.hexdigest()}\n"
+                      f"{DELTA_TARGET_PREFIX} {target_print.hexdigest()}\n"
+                      f"{HEADER_NAME_PREFIX} {os.path.basename(delta_path)}\n{MARKER_BEGIN}\n".encode('utf-8'))
+            for key in removed:
+                out.write(f"\n./{key}\n{MARKER_REMOVED}\n".encode('utf-8'))
+                out.mark()
+            spans = {}
+            for key, scan, start, stop, target in _entry_spans(target_path):
+                if target is None:
+                    spans[key] = (scan, start, stop)
+                if key not in changed:
+                    continue
+                if target is not None:
+                    if spans.get(target, (None,))[0] is not scan:
+                        raise ValueError(f"reference for {key} points at an entry not before it")
+                    _, start, stop = spans[target]
+                newline = b'\r\n' if scan.data[start - 2:start] == b'\r\n' else b'\n'
+                out.write(newline + f"./{key}".encode('utf-8') + newline)
+                _copy_span(scan, start, stop, out)
+                out.mark()
+            out.write(f"{MARKER_END}\n".encode('utf-8'))
+        os.replace(tmp_path, delta_path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+    return added, len(changed) - added, len(removed)
+
+
+def read_delta(scan):
+    """Read the delta mapped by a ManifestScanner.
+
+    Returns (base, target, changes): the two fingerprints, and a dict mapping
+    each key the delta touches to (kind, start, stop, span) in delta order.
+    kind is DELTA_REMOVED or the ENTRY_* kind of the new entry, start:stop is
+    everything after its path line, and span the body of a text entry or the
+    decode_embedded span of an embedded binary (None otherwise). Raises
+    ValueError for anything that is not a whole delta.
+    """
+    def line_at(pos):
+        end, following = scan.line_end(pos)
+        return scan.text(pos, end), following
+
+    prints = {}
+    pos = 0
+    while True:
+        if pos >= scan.size:
+            raise ValueError("not a delta manifest")
+        line, pos = line_at(pos)
+        line = line.strip()
+        if line == MARKER_BEGIN:
+            break
+        for prefix in (DELTA_BASE_PREFIX, DELTA_TARGET_PREFIX):
+            if line.startswith(prefix):
+                prints[prefix] = line[len(prefix):].strip()
+    if len(prints) != 2:
+        raise ValueError("not a delta manifest")
+
+    changes = {}
+    while True:
+        if pos >= scan.size:
+            raise ValueError("delta is truncated")
+        line, pos = line_at(pos)
+        if not line:
+            continue
+        if line == MARKER_END:
+            break
+        if not is_path_line(line.strip()):
+            raise ValueError(f"unexpected line in delta: {line[:80]}")
+        key = index_key(line)
+        start = pos
+        line, following = line_at(pos)
+        if line.startswith(DIGEST_PREFIX):
+            pos = following
+            line, following = line_at(pos)
+        span = None
+        if line == MARKER_REMOVED:
+            kind, stop = DELTA_REMOVED, following
+        elif line == MARKER_BEGIN:
+            found = scan.find_marker_line(MARKER_END, following)
+            if found is None:
+                raise ValueError(f"entry for {key} is truncated")
+            kind, span, stop = ENTRY_TEXT, (following, found[0]), found[1]
+        elif line.startswith(EMBED_BEGIN_PREFIX):
+            found = scan.find_marker_line(EMBED_END_PREFIX, following, exact=False)
+            if found is None:
+                raise ValueError(f"entry for {key} is truncated")
+            kind, span, stop = ENTRY_EMBEDDED, (pos, found[0]), found[1]
+        else:
+            kind, stop = ENTRY_BINARY, following
+        changes[key] = (kind, start, stop, span)
+        pos = stop
+    return prints[DELTA_BASE_PREFIX], prints[DELTA_TARGET_PREFIX], changes
+
+
+def _path_style(scan, offset, length, key):
+    """(prefix, separator, newline) of the path line of the entry an index places at offset."""
+    header, _ = scan._indexed_header(offset, length, key, 2)
+    line = header[1].strip()
+    prefix = line[:len(line) - len(key)]
+    separator = '\\' if '\\' in line[len(prefix):] or prefix.endswith('\\') else '/'
+    newline = b'\r\n' if scan.data[offset:offset + 2] == b'\r\n' else b'\n'
+    return prefix, separator, newline
+
+
+def patch_manifest(manifest_path, delta_path):
+    """Apply the delta at delta_path to the manifest at manifest_path in place.
+
+    The manifest must be the delta's base and is rewritten as its target, both
+    checked by fingerprint before anything is replaced. Untouched entries are
+    copied byte for byte (a duplicate may so stay in full where a fresh run
+    would write a reference), new ones get path lines written the way the
+    manifest already writes them, and a fresh .idx is committed; the .cache
+    is dropped, so the next generator run reads the tree afresh. Returns
+    (added, changed, removed) counts. Raises ValueError for a shard table, a
+    manifest without a usable index, or a delta made from another manifest.
+    """
+    if read_shard_table(manifest_path) is not None:
+        raise ValueError(f"{manifest_path} is a shard table - regenerate it, or apply the delta to a restored tree")
+    tmp_path = manifest_path + '.tmp'
+    index = ManifestIndexWriter(manifest_path)
+    counts = [0, 0, 0]
+    try:
+        with ManifestScanner(delta_path) as delta:
+            base_print, target_print, changes = read_delta(delta)
+            pending = sorted((key for key, change in changes.items() if change[0] != DELTA_REMOVED),
+                             key=_manifest_order, reverse=True)
+            with ManifestScanner(manifest_path) as scan, ManifestWriter(tmp_path, compression_of(manifest_path)) as out:
+                style = None
+                signatures = {}
+                old_print, new_print = hashlib.sha256(), hashlib.sha256()
+
+                def put(key):
+                    kind, start, stop, _ = changes[key]
+                    prefix, separator, newline = style
+                    offset = out.tell()
+                    out.write(newline + (prefix + key.replace('/', separator)).encode('utf-8') + newline)
+                    _copy_span(delta, start, stop, out)
+                    index.add(key, offset, out.tell() - offset, kind)
+                    out.mark()
+                    _fold(new_print, key, _span_digest(delta, start, stop))
+
+                copied = 0
+                for key, offset, length, kind in _iter_index(manifest_path):
+                    if style is None:
+                        style = _path_style(scan, offset, length, key)
+                        _copy_span(scan, 0, offset, out)
+                    start, stop = scan.indexed_content(offset, length, key)
+                    target = scan.indexed_reference(offset, length, key) if kind == ENTRY_REFERENCE else None
+                    signature = signatures.get(target) if target is not None else None
+                    if signature is None:
+                        signature = _span_digest(scan, start, stop)
+                    signatures[key] = signature
+                    _fold(old_print, key, signature)
+                    copied = stop
+                    while pending and _manifest_order(pending[-1]) < _manifest_order(key):
+                        put(pending.pop())
+                        counts[0] += 1
+                    change = changes.get(key)
+                    if change is None:
+                        index.add(key, out.tell(), length, kind)
+                        _copy_span(scan, offset, stop, out)
+                        out.mark()
+                        _fold(new_print, key, signature)
+                    elif change[0] == DELTA_REMOVED:
+                        counts[2] += 1
+                    else:
+                        if pending and pending[-1] == key:
+                            pending.pop()
+                        put(key)
+                        counts[1] += 1
+                if old_print.hexdigest() != base_print:
+                    raise ValueError(f"{manifest_path} is not the manifest this delta was made from")
+                if style is None:
+                    found = scan.find_marker_line(MARKER_BEGIN, 0)
+                    copied = found[1] if found is not None else 0
+                    style = ('./', '/', b'\n')
+                    _copy_span(scan, 0, copied, out)
+                while pending:
+                    put(pending.pop())
+                    counts[0] += 1
+                _copy_span(scan, copied, scan.size, out)
+                if new_print.hexdigest() != target_print:
+                    raise ValueError(f"patching {manifest_path} did not produce the delta's target")
+        index.commit(tmp_path, out)
+        os.replace(tmp_path, manifest_path)
+    except BaseException:
+        index.discard()
+        _remove_quietly(tmp_path)
+        raise
+    _remove_quietly(manifest_path + CACHE_SUFFIX)
+    return tuple(counts)
+
+
+# ===== Restore targets =====
+def _current_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+_UMASK = _current_umask()
+
+
+def encode_newlines(data):
+    """Translate \\n to os.linesep, as writing a text-mode file does."""
+    if _LINESEP != b'\n':
+        data = data.replace(b'\n', _LINESEP)
+    return data
+
+
+class RestoreTarget:
+    """Temp file an entry is streamed into; nothing is visible at path until commit().
+
+    The temp file sits beside path when its directory already exists, so the
+    final rename stays on one filesystem; otherwise it waits in the current
+    directory and the missing directories are only created on commit.
+
+    With keep_unchanged, a regular file already at path is read alongside the
+    entry instead (unless size says up front that it differs). No temp file
+    exists until the first byte that differs, when the part that matched is
+    copied into one; a file that matches to the end is left alone, mtime and
+    all, and commit() returns False.
+    """
+
+    def __init__(self, path, writer=None, keep_unchanged=False, size=None):
+        self.path = path
+        self._writer = writer
+        self.size = 0
+        self.file = None
+        self._existing = _open_unchanged_candidate(path, size) if keep_unchanged else None
+        self._matched = 0
+        if self._existing is None:
+            self._open_temp()
+
+    def _open_temp(self):
+        dirpath = os.path.dirname(self.path)
+        self._dir_ready = not dirpath or os.path.isdir(dirpath)
+        fd, self.tmp_path = tempfile.mkstemp(prefix='.es-restore-', dir=dirpath if dirpath and self._dir_ready else '.')
+        # mkstemp creates 0600; give new files the usual umask-derived mode (commit keeps an existing file's)
+        os.chmod(fd if os.chmod in os.supports_fd else self.tmp_path, 0o666 & ~_UMASK)
+        self.file = io.open(fd, 'wb')
+
+    def write_bytes(self, data):
+        self.size += len(data)
+        if self._existing is None:
+            self.file.write(data)
+            return
+        with memoryview(data) as view:
+            for pos in range(0, len(view), COPY_BLOCK):
+                with view[pos:pos + COPY_BLOCK] as block:
+                    if self._existing.read(len(block)) == block:
+                        self._matched += len(block)
+                        continue
+                self._diverge()
+                with view[pos:] as rest:
+                    self.file.write(rest)
+                return
+
+    def _diverge(self):
+        """The entry differs from the file at path after all: start the temp file with the part that matched."""
+        existing, self._existing = self._existing, None
+        try:
+            self._open_temp()
+            existing.seek(0)
+            remaining = self._matched
+            while remaining:
+                chunk = existing.read(min(COPY_BLOCK, remaining))
+                if not chunk:
+                    raise OSError(errno.EIO, "file changed while it was compared", self.path)
+                self.file.write(chunk)
+                remaining -= len(chunk)
+        finally:
+            existing.close()
+
+    def commit(self):
+        """Put the entry in place; False when the file at path already held it and was left alone."""
+        if self._existing is not None:
+            if not self._existing.read(1):
+                self._existing.close()
+                self._existing = None
+                if self._writer is not None:
+                    self._writer.finished(written=False)
+                return False
+            self._diverge()
+        self.file.close()
+        if not self._dir_ready:
+            dirpath = os.path.dirname(self.path)
+            if self._writer is not None:
+                self._writer.make_dirs(dirpath)
+            else:
+                os.makedirs(dirpath, exist_ok=True)
+        if self._writer is not None:
+            self._writer.settle(self.path)
+        if self._dir_ready:
+            self._keep_mode()
+        os.replace(self.tmp_path, self.path)
+        if self._writer is not None:
+            self._writer.finished()
+        return True
+
+    def _keep_mode(self):
+        """Give the temp file the mode of the file it replaces, so a changed script stays executable."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return
+        os.chmod(self.tmp_path, stat.S_IMODE(st.st_mode))
+
+    def abandon(self):
+        if self._existing is not None:
+            self._existing.close()
+            self._existing = None
+        if self.file is None:
+            return
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def _open_unchanged_candidate(path, size=None):
+    """The regular file at path opened for comparison, or None when it cannot hold the entry."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode) or (size is not None and st.st_size != size):
+        return None
+    try:
+        return open(path, 'rb')
+    except OSError:
+        return None
+
+
+def file_matches(path, size, digest):
+    """True when path is a regular file of size bytes whose sha256 is the hex digest."""
+    existing = _open_unchanged_candidate(path, size)
+    if existing is None:
+        return False
+    with existing:
+        found = hashlib.sha256()
+        for chunk in iter(lambda: existing.read(COPY_BLOCK), b''):
+            found.update(chunk)
+    return found.hexdigest() == digest
+
+
+class BufferedTarget:
+    """In-memory entry handed to the writer's pool on commit.
+
+    Entries that grow past SPILL_BYTES fall back to a RestoreTarget streamed
+    from the main thread, so memory stays bounded whatever the entry size.
+    """
+
+    def __init__(self, path, writer):
+        self.path = path
+        self._writer = writer
+        self._chunks = []
+        self._spilled = None
+        self.size = 0
+
+    def write_bytes(self, data):
+        if self._spilled is None and self.size + len(data) > SPILL_BYTES:
+            self._spill()
+        if self._spilled is not None:
+            self._spilled.write_bytes(data)
+        else:
+            # Copy: the caller's memoryview of the manifest is only valid until it returns
+            self._chunks.append(bytes(data))
+        self.size += len(data)
+
+    def _spill(self):
+        self._spilled = RestoreTarget(self.path, self._writer, self._writer.keep_unchanged)
+        for data in self._chunks:
+            self._spilled.write_bytes(data)
+        self._chunks = []
+
+    def commit(self):
+        """Hand the entry over; None, as whether it was written is only known once the pool is done."""
+        if self._spilled is not None:
+            self._spilled.commit()
+        else:
+            self._writer.submit(self.path, self._chunks, self.size)
+        self._chunks = []
+
+    def abandon(self):
+        if self._spilled is not None:
+            self._spilled.abandon()
+        self._chunks = []
+
+
+# Parallel restore: entries above this are streamed from the main thread, and at
+# most PENDING_BYTES of buffered content waits for the pool at any time.
+SPILL_BYTES = 8 << 20
+PENDING_BYTES = 64 << 20
+
+
+class RestoreWriter:
+    """Creates restore targets and, with jobs > 1, writes them on a thread pool.
+
+    Each directory is created once (tracked in a set of known directories)
+    from the main thread, so workers only open, write and rename. A path that
+    appears twice in a manifest still ends up with its last entry, because a
+    new write waits for any pending one to the same path. Replaces the
+    per-file print with an optional progress counter. A shared writer
+    restores one shard while other processes restore the rest, and reports
+    in summary too.
+
+    With keep_unchanged, files that already hold exactly what an entry would
+    write are left alone (see RestoreTarget) and counted in skipped rather
+    than written, so restoring over an existing tree touches only what changed.
+    """
+
+    def __init__(self, jobs=1, progress=False, shared=False, keep_unchanged=False):
+        self.jobs = jobs
+        self.progress = progress
+        self.shared = shared
+        self.keep_unchanged = keep_unchanged
+        self.written = 0
+        self.skipped = 0
+        self._dirs = {''}
+        self._pool = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        self._pending = deque()
+        self._pending_bytes = 0
+        self._pending_paths = set()
+
+    @property
+    def parallel(self):
+        return self._pool is not None or self.shared
+
+    def make_dirs(self, dirpath):
+        if dirpath in self._dirs:
+            return
+        os.makedirs(dirpath, exist_ok=True)
+        while dirpath not in self._dirs:
+            self._dirs.add(dirpath)
+            dirpath = os.path.dirname(dirpath)
+
+    def prepare_dirs(self, paths):
+        """Create every parent directory of paths up front, shallowest first."""
+        for dirpath in sorted({os.path.dirname(p) for p in paths}):
+            self.make_dirs(dirpath)
+
+    def open(self, path, size=None):
+        """A target for path; size, when known, is what the entry will write."""
+        if self._pool is None:
+            return RestoreTarget(path, self, self.keep_unchanged, size)
+        return BufferedTarget(path, self)
+
+    def restore(self, path, scanner, start, end):
+        """Restore path from the body span start:end of a ManifestScanner.
+
+        Returns True once written, False when path already held the entry,
+        and None when the pool has yet to decide.
+        """
+        out = self.open(path, scanner.copied_size(start, end))
+        try:
+            scanner.copy_text(start, end, out)
+        except BaseException:
+            out.abandon()
+            raise
+        return out.commit()
+
+    def restore_embedded(self, path, scanner, start, end):
+        """Restore path byte for byte from the embedded binary at start:end of a ManifestScanner.
+
+        With keep_unchanged, a file matching the size and sha256 the entry
+        records is left alone without decoding anything. A binary that fails
+        to decode or verify raises ValueError and leaves nothing behind.
+        Returns as restore() does.
+        """
+        size = None
+        if self.keep_unchanged:
+            size, digest = embedded_trailer(scanner, end)
+            self.settle(path)
+            if file_matches(path, size, digest):
+                self.finished(written=False)
+                return False
+        out = self.open(path, size)
+        try:
+            decode_embedded(scanner, start, end, out)
+        except BaseException:
+            out.abandon()
+            raise
+        return out.commit()
+
+    def settle(self, path):
+        """Wait until no earlier write to path is still in flight."""
+        while path in self._pending_paths:
+            self._collect()
+
+    def submit(self, path, chunks, size):
+        self.make_dirs(os.path.dirname(path))
+        self.settle(path)
+        self._pending.append((self._pool.submit(_write_restored, path, chunks, self.keep_unchanged, size), path, size))
+        self._pending_paths.add(path)
+        self._pending_bytes += size
+        while self._pending and (self._pending_bytes > PENDING_BYTES or len(self._pending) > 8 * self.jobs):
+            self._collect()
+
+    def _collect(self):
+        future, path, size = self._pending.popleft()
+        written = future.result()
+        self._pending_bytes -= size
+        self._pending_paths.discard(path)
+        self.finished(written)
+
+    def finished(self, written=True):
+        if written:
+            self.written += 1
+        else:
+            self.skipped += 1
+        if self.progress and (self.written + self.skipped) % 1000 == 0:
+            print(f"\r   ⏳ {self._tally()}", end='', flush=True)
+
+    def _tally(self):
+        tally = f"{self.written + self.skipped} files restored"
+        return tally + f" ({self.skipped} unchanged)" if self.skipped else tally
+
+    def close(self):
+        """Wait for outstanding writes; re-raises the first worker error."""
+        try:
+            while self._pending:
+                self._collect()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+            if self.progress and self.written + self.skipped >= 1000:
+                print(f"\r   ⏳ {self._tally()}")
+
+
+def _write_restored(path, chunks, keep_unchanged=False, size=None):
+    target = RestoreTarget(path, keep_unchanged=keep_unchanged, size=size)
+    try:
+        for data in chunks:
+            target.write_bytes(data)
+    except BaseException:
+        target.abandon()
+        raise
+    return target.commit()
+
+
+def _read_last_line(path, block=4096):
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        while True:
+            # Trailers carrying a frame table can be longer than one block
+            f.seek(max(0, size - block))
+            tail = f.read().rstrip(b'\n')
+            if b'\n' in tail or block >= size:
+                return tail.rsplit(b'\n', 1)[-1].decode('utf-8')
+            block *= 4
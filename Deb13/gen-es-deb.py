@@ -9,7 +9,29 @@ Decreed by The Dual Pimpinator. Forged with pimp-tight precision.
 # Generate Site-Map             find . \( -name node_modules -o -name .git \) -prune -o -type f -print | cat -n > site-map.txt
 
 import os
+import re
+import json
+import stat
+import sys
+import time
+import shutil
 import fnmatch
+import bisect
+import hashlib
+import functools
+import heapq
+import argparse
+import contextlib
+import io
+import importlib.util
+import importlib.metadata
+import subprocess
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed
+
+import es_manifest
 
 # ===== CONFIGURATION: The Royal Edicts =====
 # The root directory of the project to map
@@ -33,6 +55,8 @@ EXCLUDED_ITEMS = {
     'gen-sm-deb.py',
     'purify-es-deb.py',
     'restore-es-uni.py',
+    'delta-es-uni.py',
+    'es_manifest.py',
     '*.png',
     '*.jpg',
     '*.jpeg',
@@ -69,10 +93,121 @@ BINARY_EXTENSIONS = {
 
 # Special handlers for complex document types that can extract text
 SPECIAL_DOCUMENT_EXTENSIONS = {'.doc', '.docx'}
+
+# Files above this size are recorded as an [OVERSIZED FILE] placeholder instead of
+# being read (override with --max-file-size; 0 = no cap). Everything else is
+# sniffed first: a binary signature or NUL bytes in the first few KB make it a
+# [BINARY FILE] placeholder without reading the rest.
+MAX_FILE_BYTES = 16 << 20
+
+# Per-file size caps that override MAX_FILE_BYTES, matched against the file name (first match wins)
+FILE_SIZE_LIMITS = {
+    # '*.csv': 64 << 20,
+    # 'schema.sql': 0,    # never capped
+}
+
+# Worker threads for reading files and running extractors (override with --jobs; 1 = serial)
+READ_JOBS = min(32, (os.cpu_count() or 1) + 4)
+
+# Reuse unchanged entries from the previous manifest via its .cache sidecar (disable with --no-cache)
+USE_CACHE = True
+
+# Write the established-source.txt.idx byte-offset index used for random access (disable with --no-index)
+WRITE_INDEX = True
+
+# Write a file whose content matches an earlier entry as a one-line reference to
+# that entry instead of a second copy (override with --dedup / --no-dedup). Off by
+# default: [file content same as] entries need the restorers of this release.
+DEDUPLICATE = False
+
+# Record each text entry's sha256 on a line after its path (enable with --digests)
+WRITE_DIGESTS = False
+
+# Threads listing directories during the survey (override with --walk-jobs; 1 = serial).
+# Worth raising on network filesystems and very wide trees, where the walk waits on
+# the filesystem; on a local disk the serial walk is usually just as fast.
+WALK_JOBS = 1
+
+# Also leave out what the project's .gitignore and .ignore files (and .git/info/exclude)
+# ignore, read level by level as git does, negations and anchored patterns included
+# (override with --gitignore). Ignored directories are never walked into.
+HONOR_GITIGNORE = False
+
+# Persistent store of .doc/.docx extraction results, keyed by document content and
+# extractor version so moved or renamed documents are not re-extracted. Least
+# recently used results are evicted beyond EXTRACTION_CACHE_BYTES (override with
+# --extraction-cache-size; 0 = no store).
+EXTRACTION_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                                    'established-source', 'extractions')
+EXTRACTION_CACHE_BYTES = 256 << 20
+
+# Bump when the DOCUMENT_EXTRACTORS change what they produce
+EXTRACTOR_REVISION = 1
+
+# Document extractors run in this many long-lived worker processes, each document
+# limited to EXTRACT_TIMEOUT seconds (override with --extract-timeout). An
+# extractor is switched off after EXTRACTOR_FAILURE_LIMIT failures in a row.
+EXTRACT_WORKERS = min(4, os.cpu_count() or 1)
+EXTRACT_TIMEOUT = 30
+EXTRACTOR_FAILURE_LIMIT = 3
+
+# Compress the manifest in independently readable frames: None, 'gzip', 'bz2' or 'xz'
+# (override with --compress). The suffix is appended: established-source.txt.gz
+COMPRESSION = None
+
+# Also write site-map.txt from the manifest's own traversal (override with --site-map),
+# using the rules in this script's gen-sm-deb.py
+WRITE_SITE_MAP = False
+SITE_MAP_SCRIPT = "gen-sm-deb.py"
+
+# Sharded output: established-source.txt becomes a small shard table and the
+# entries are split into standalone manifests of about SHARD_BYTES (--shard-size)
+# or SHARD_ENTRIES entries (--shard-entries) each, in established-source.txt.shards/.
+# Set one of them; 0 writes a single manifest. SHARD_WRITERS threads write shards at once.
+SHARD_BYTES = 0
+SHARD_ENTRIES = 0
+SHARD_WRITERS = min(4, os.cpu_count() or 1)
+
+# Embed binary files in full instead of placeholders (--embed-binaries), so a
+# restore gives their exact bytes back. Each is streamed into the manifest as
+# EMBED_ENCODING lines ('base64', or the denser but slower 'base85';
+# --embed-encoding). Only binaries of at most EMBED_MAX_BYTES (--embed-max-size;
+# 0 = no cap) whose name or path matches one of EMBED_PATTERNS (--embed PATTERN;
+# empty = any) qualify. Excluded files stay excluded.
+EMBED_BINARIES = False
+EMBED_ENCODING = 'base64'
+EMBED_MAX_BYTES = 64 << 20
+EMBED_PATTERNS = []
+
+# After each run, also write established-source.txt.delta carrying this earlier
+# manifest (or shard table, with its .shards folder) to the new one, so boxes
+# that hold it can catch up with delta-es-uni.py apply (override with
+# --delta-from; None = no delta). It must be a copy, not the output itself.
+DELTA_BASE = None
+
+# --watch keeps the manifest current: changes are gathered until WATCH_DEBOUNCE
+# seconds pass quietly (at most WATCH_MAX_DELAY), then only the affected entries
+# are re-read. Without inotify the tree is polled every WATCH_POLL_INTERVAL seconds.
+WATCH_DEBOUNCE = 0.2
+WATCH_MAX_DELAY = 2.0
+WATCH_POLL_INTERVAL = 1.0
+
+# --batch ROOT... (or --batch-file FILE) forges one manifest per project root in a
+# single invocation, BATCH_WORKERS roots at a time in worker processes
+# (override with --batch-workers). Extractor detection happens once for the batch;
+# each worker compiles the exclusions and opens the extraction cache once.
+BATCH_WORKERS = min(4, os.cpu_count() or 1)
+
+# --profile prints per-stage timings and this many of the slowest files;
+# --metrics FILE saves the same report as JSON
+PROFILE_TOP = 10
 # ===== END CONFIGURATION =====
 
 def is_excluded(path, excluded_set):
-    """Check if a path should be excluded based on patterns - PIMP-TIGHT VERSION"""
+    """Check if a path should be excluded based on patterns - PIMP-TIGHT VERSION
+
+    Reference implementation; the walk uses the equivalent compile_exclusions matcher.
+    """
     basename = os.path.basename(path)
 
     # Convert path to forward slashes for consistent matching
@@ -103,111 +238,360 @@ def is_excluded(path, excluded_set):
 
     return False
 
-def extract_docx_text(filepath):
-    """Extract text from .docx files using python-docx if available."""
+_GLOB_CHARS = frozenset('*?[')
+
+def compile_exclusions(excluded_set):
+    """Compile the exclusion patterns once into a fast matcher - same decisions as is_excluded.
+
+    Exact names go into a set, '*.ext' patterns into an extension set and any
+    remaining globs into one combined regex. The substring fallback (strategy 4)
+    becomes a single alternation whose result is memoised per parent directory.
+    """
+    literal_names = set()
+    extensions = set()
+    globs = []
+    for pattern in excluded_set:
+        if not _GLOB_CHARS.intersection(pattern):
+            literal_names.add(os.path.normcase(pattern))
+        elif (pattern.startswith('*.') and '.' not in pattern[2:]
+              and not _GLOB_CHARS.intersection(pattern[2:])):
+            extensions.add(os.path.normcase(pattern[1:]))
+        else:
+            globs.append(pattern)
+
+    glob_re = None
+    if globs:
+        glob_re = re.compile('|'.join(fnmatch.translate(os.path.normcase(g)) for g in globs))
+
+    # Strategy 4 is a case-sensitive substring test of every pattern, wildcards included
+    raw_patterns = frozenset(excluded_set)
+    substring_re = None
+    longest = 0
+    if raw_patterns:
+        ordered = sorted(raw_patterns, key=len, reverse=True)
+        substring_re = re.compile('|'.join(re.escape(p) for p in ordered))
+        longest = len(ordered[0])
+
+    dir_hits = {}
+
+    def matcher(path):
+        basename = os.path.basename(path)
+        # ULTIMATE GUARANTEE: no package-lock.json shall pass!
+        if basename == 'package-lock.json' or basename in raw_patterns:
+            return True
+
+        name = os.path.normcase(basename)
+        if name in literal_names:
+            return True
+        dot = name.rfind('.')
+        if dot >= 0 and name[dot:] in extensions:
+            return True
+
+        normalized_path = path.replace('\\', '/')
+        if substring_re is not None:
+            head = normalized_path.rpartition('/')[0]
+            hit = dir_hits.get(head)
+            if hit is None:
+                hit = dir_hits[head] = substring_re.search(head) is not None
+            if hit:
+                return True
+            # Only occurrences reaching past the memoised directory part remain
+            if substring_re.search(normalized_path, max(0, len(head) - longest + 1)):
+                return True
+
+        full = os.path.normcase(normalized_path)
+        if full in literal_names:
+            return True
+        if glob_re is not None and (glob_re.match(name) or glob_re.match(full)):
+            return True
+
+        return False
+
+    return matcher
+
+# ===== Document extractors =====
+def _package_version(name):
+    """Installed version of a distribution, found without importing it."""
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+def _tool_version(name):
+    """Identify an external tool by path, size and mtime - an upgrade changes them."""
+    path = shutil.which(name)
+    if path is None:
+        return None
+    st = os.stat(path)
+    return [path, st.st_size, st.st_mtime_ns]
+
+def _extract_with_python_docx(filepath, timeout):
+    import docx  # Imported in the worker, and only once a .docx turns up
     try:
-        import docx
         doc = docx.Document(filepath)
-        full_text = []
-        for paragraph in doc.paragraphs:
-            full_text.append(paragraph.text)
-        return '\n'.join(full_text)
-    except ImportError:
-        return "[DOCX FILE - python-docx library not installed for text extraction]"
     except Exception as e:
         return f"[DOCX FILE - Error extracting text: {str(e)}]"
+    return '\n'.join(paragraph.text for paragraph in doc.paragraphs)
 
-def extract_doc_text(filepath):
-    """Extract text from .doc files using multiple strategies."""
-    # Strategy 1: Try antiword (Linux command-line tool)
+def _run_doc_tool(tool, filepath, timeout):
     try:
-        import subprocess
-        result = subprocess.run(['antiword', filepath],
-                              capture_output=True, text=True, check=True)
-        if result.stdout.strip():
-            return f"EXTRACTED TEXT FROM .DOC:\n{result.stdout}"
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass  # antiword not available, try next method
-    except Exception as e:
-        pass
+        result = subprocess.run([tool, filepath], capture_output=True, text=True,
+                                check=True, timeout=timeout)
+    except subprocess.CalledProcessError:
+        return None  # Not a document this tool understands - try the next one
+    if result.stdout.strip():
+        return f"EXTRACTED TEXT FROM .DOC:\n{result.stdout}"
+    return None
 
-    # Strategy 2: Try catdoc (alternative Linux tool)
-    try:
-        import subprocess
-        result = subprocess.run(['catdoc', filepath],
-                              capture_output=True, text=True, check=True)
-        if result.stdout.strip():
-            return f"EXTRACTED TEXT FROM .DOC:\n{result.stdout}"
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass  # catdoc not available
-    except Exception as e:
-        pass
+def _extract_with_antiword(filepath, timeout):
+    return _run_doc_tool('antiword', filepath, timeout)
 
-    # Strategy 3: Python-only extraction
+def _extract_with_catdoc(filepath, timeout):
+    return _run_doc_tool('catdoc', filepath, timeout)
+
+def _extract_with_oletools(filepath, timeout):
+    from oletools.olevba import VBA_Parser
     try:
-        from oletools.olevba import VBA_Parser
         parser = VBA_Parser(filepath)
-        text_content = []
-
+    except Exception:
+        return None
+    text_content = []
+    try:
         if parser.detect_vba_macros():
             for (filename, stream_path, vba_filename, vba_code) in parser.extract_macros():
                 if vba_code:
                     text_content.append(f"--- VBA Macro: {vba_filename} ---")
                     text_content.append(vba_code)
-
+    except Exception:
+        return None
+    finally:
         parser.close()
-        if text_content:
-            return "EXTRACTED VBA MACROS FROM .DOC:\n" + "\n".join(text_content)
-    except ImportError:
-        pass  # oletools not available
-    except Exception as e:
-        pass
-
-    # Final fallback
-    return "[DOC FILE - Install 'antiword' (sudo apt install antiword) for best text extraction, or 'oletools' (pip install oletools) for VBA macro extraction]"
-
-def check_document_dependencies():
-    """Check if document parsing dependencies are available."""
-    deps_available = {
-        'python-docx': False,
-        'antiword': False,
-        'catdoc': False,
-        'oletools': False
-    }
+    if text_content:
+        return "EXTRACTED VBA MACROS FROM .DOC:\n" + "\n".join(text_content)
+    return None
 
-    # Check python-docx
-    try:
-        import docx
-        deps_available['python-docx'] = True
+# Extractors per document type, tried in order until one returns text:
+# (name, extension, probe, extract). Probes run once per run and import nothing;
+# extract(filepath, timeout) runs in a worker process and returns the text, or
+# None to let the next extractor try.
+DOCUMENT_EXTRACTORS = [
+    ('python-docx', '.docx', lambda: _package_version('python-docx'), _extract_with_python_docx),
+    ('antiword', '.doc', lambda: _tool_version('antiword'), _extract_with_antiword),
+    ('catdoc', '.doc', lambda: _tool_version('catdoc'), _extract_with_catdoc),
+    ('oletools', '.doc', lambda: _package_version('oletools'), _extract_with_oletools),
+]
+
+# What an entry says when no extractor produced text
+DOCUMENT_FALLBACKS = {
+    '.docx': "[DOCX FILE - python-docx library not installed for text extraction]",
+    '.doc': "[DOC FILE - Install 'antiword' (sudo apt install antiword) for best text extraction, or 'oletools' (pip install oletools) for VBA macro extraction]",
+}
+
+def _extraction_worker(conn):
+    """Worker process loop: run (extractor, path, timeout) requests until told to stop."""
+    extractors = {name: extract for name, _, _, extract in DOCUMENT_EXTRACTORS}
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        name, filepath, timeout = request
+        try:
+            conn.send((True, extractors[name](filepath, timeout)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+class ExtractionFailed(Exception):
+    """An extractor crashed, raised or overran its timeout on one document."""
+
+class ExtractorPool:
+    """Long-lived extraction worker processes, each serving one document at a time.
+
+    Reader threads check a worker out, hand it one document and wait at most
+    timeout seconds. A worker that overruns or dies is killed and replaced on
+    demand, so a hostile document costs one process, never the run.
+    """
+
+    def __init__(self, size, timeout):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context()
+
+    def _start_worker(self):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_extraction_worker, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, conn
+
+    def run(self, name, filepath):
+        """Run one extractor on one document in a worker; raises ExtractionFailed."""
+        with self._slots:
+            with self._lock:
+                worker = self._idle.pop() if self._idle else None
+            if worker is None:
+                worker = self._start_worker()
+            process, conn = worker
+            try:
+                conn.send((name, filepath, self.timeout))
+                # A little grace so a tool timing out inside the worker reports first
+                if not conn.poll(self.timeout + 1):
+                    raise ExtractionFailed(f"timed out after {self.timeout:g}s")
+                ok, result = conn.recv()
+            except (OSError, EOFError, ExtractionFailed) as e:
+                process.kill()
+                process.join()
+                conn.close()
+                if isinstance(e, ExtractionFailed):
+                    raise
+                raise ExtractionFailed(f"worker died (exit code {process.exitcode})") from e
+            with self._lock:
+                self._idle.append(worker)
+        if not ok:
+            raise ExtractionFailed(result)
+        return result
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for process, conn in idle:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+
+def probe_extractors():
+    """Which DOCUMENT_EXTRACTORS are installed: name -> version, or None when missing."""
+    return {name: probe() for name, _, probe, _ in DOCUMENT_EXTRACTORS}
+
+class DocumentExtractors:
+    """Probe-once front end to DOCUMENT_EXTRACTORS, with a worker pool and circuit breaker.
+
+    Capabilities are detected when the registry is built, unless a probe_extractors()
+    result is handed in (a batch probes once for all its workers); the pool only starts
+    once a document needs an available extractor. An extractor that fails
+    failure_limit times in a row (crash, exception or timeout) is switched off
+    for the rest of the run. Results go through the optional ExtractionCache;
+    text produced while an extractor failed or was switched off is not cached.
+    """
+
+    def __init__(self, workers=EXTRACT_WORKERS, timeout=EXTRACT_TIMEOUT,
+                 failure_limit=EXTRACTOR_FAILURE_LIMIT, cache=None, profile=None, available=None):
+        self.available = probe_extractors() if available is None else available
+        self.cache = cache
+        self.profile = profile
+        self.disabled = set()
+        self._workers = workers
+        self._timeout = timeout
+        self._failure_limit = failure_limit
+        self._failures = {}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def signature(self, ext):
+        """Everything that shapes the extracted text of a document type, for the extraction cache."""
+        tools = {name: self.available[name] for name, e, _, _ in DOCUMENT_EXTRACTORS if e == ext}
+        return json.dumps([ext, EXTRACTOR_REVISION, tools], sort_keys=True)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ExtractorPool(self._workers, self._timeout)
+            return self._pool
+
+    def _record(self, name, failed):
+        with self._lock:
+            if not failed:
+                self._failures[name] = 0
+                return False
+            self._failures[name] = self._failures.get(name, 0) + 1
+            if self._failures[name] >= self._failure_limit and name not in self.disabled:
+                self.disabled.add(name)
+                return True
+            return False
+
+    def _extract(self, filepath, ext):
+        """Return (text, cacheable) from the first extractor for ext that produces text."""
+        cacheable = True
+        for name, e, _, _ in DOCUMENT_EXTRACTORS:
+            if e != ext or not self.available[name]:
+                continue
+            if name in self.disabled:
+                cacheable = False
+                continue
+            start = time.perf_counter()
+            try:
+                text = self._get_pool().run(name, filepath)
+            except ExtractionFailed as error:
+                if self.profile is not None:
+                    self.profile.add(f'extractor:{name}', time.perf_counter() - start)
+                    self.profile.count(f'extractor_failures:{name}')
+                print(f"⚠️  {name} failed on {filepath}: {error}")
+                if self._record(name, True):
+                    print(f"🔌 {name} disabled after {self._failure_limit} failures in a row")
+                cacheable = False
+                continue
+            if self.profile is not None:
+                self.profile.add(f'extractor:{name}', time.perf_counter() - start)
+            self._record(name, False)
+            if text:
+                return text, cacheable
+        if not cacheable:
+            return f"[{ext[1:].upper()} FILE - text extraction failed or was disabled]", False
+        return DOCUMENT_FALLBACKS[ext], True
+
+    def extract(self, filepath):
+        """Extracted text (or a placeholder) for a .doc/.docx file."""
+        ext = os.path.splitext(filepath)[1].lower()
+        if self.cache is not None:
+            return self.cache.extract(filepath, self.signature(ext), lambda path: self._extract(path, ext))
+        return self._extract(filepath, ext)[0]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+        if self.cache is not None:
+            self.cache.close()
+
+_default_extractors = None
+
+def default_extractors():
+    """A shared registry for callers that do not build their own."""
+    global _default_extractors
+    if _default_extractors is None:
+        _default_extractors = DocumentExtractors()
+    return _default_extractors
+
+def check_document_dependencies(available):
+    """Report the document extractors found by the registry probe."""
+    if available['python-docx']:
         print("📄 Document Support: python-docx available for .docx text extraction")
-    except ImportError:
+    else:
         print("📄 Document Support: python-docx not installed - .docx files will have limited support")
         print("   Install with: pip install python-docx")
 
-    # Check antiword
-    try:
-        import subprocess
-        result = subprocess.run(['which', 'antiword'], capture_output=True, text=True)
-        if result.returncode == 0:
-            deps_available['antiword'] = True
-            print("📄 Document Support: antiword available for .doc text extraction")
-        else:
-            print("📄 Document Support: antiword not installed - .doc files will have basic support")
-            print("   Install with: sudo apt install antiword")
-    except:
-        print("📄 Document Support: antiword check failed")
+    if available['antiword']:
+        print("📄 Document Support: antiword available for .doc text extraction")
+    elif available['catdoc']:
+        print("📄 Document Support: catdoc available for .doc text extraction")
+    else:
+        print("📄 Document Support: antiword not installed - .doc files will have basic support")
+        print("   Install with: sudo apt install antiword")
 
-    # Check oletools
-    try:
-        from oletools.olevba import VBA_Parser
-        deps_available['oletools'] = True
+    if available['oletools']:
         print("📄 Document Support: oletools available for .doc macro extraction")
-    except ImportError:
+    else:
         print("📄 Document Support: oletools not installed - .doc macro extraction unavailable")
         print("   Install with: pip install oletools")
 
-    return deps_available
-
 def should_read_file_content(filepath):
     """Determine if we should read and include file content."""
     _, ext = os.path.splitext(filepath)
@@ -219,102 +603,741 @@ def should_read_file_content(filepath):
 
     return ext not in BINARY_EXTENSIONS
 
-def read_file_content(filepath):
-    """Read file content with special handling for document types."""
+def size_limit_for(filepath, max_bytes=MAX_FILE_BYTES):
+    """The size cap for one file: its first FILE_SIZE_LIMITS match, else max_bytes."""
+    name = os.path.basename(filepath)
+    for pattern, limit in FILE_SIZE_LIMITS.items():
+        if fnmatch.fnmatch(name, pattern):
+            return limit
+    return max_bytes
+
+def read_file_content(filepath, st=None, limit=None, extractors=None):
+    """Read file content with special handling for document types.
+
+    Returns (content, is_binary, skipped); skipped is a (label, reason) pair
+    when the file is recorded as a placeholder without being read in full.
+    Documents are extracted through the DocumentExtractors registry given,
+    or a default one built on first use.
+    """
     _, ext = os.path.splitext(filepath)
     ext = ext.lower()
 
-    # Special document type handling
-    if ext == '.docx':
-        return extract_docx_text(filepath), False  # False = not binary
-    elif ext == '.doc':
-        return extract_doc_text(filepath), False   # False = not binary
-
-    # Standard text file handling
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return content, False
-    except (UnicodeDecodeError, PermissionError, OSError) as e:
-        # Fallback for files that might have different encoding
-        try:
-            with open(filepath, 'r', encoding='latin-1') as f:
-                content = f.read()
-            return content, False
-        except Exception:
-            return f"[UNREADABLE FILE - {str(e)}]", True
+        # Special document type handling - capped, but not sniffed (.docx is a ZIP)
+        if ext in SPECIAL_DOCUMENT_EXTENSIONS:
+            size = (st or os.stat(filepath)).st_size
+            if limit and size > limit:
+                reason = f"{es_manifest.format_size(size)} exceeds the {es_manifest.format_size(limit)} limit"
+                return None, True, ('OVERSIZED', reason)
+            if extractors is None:
+                extractors = default_extractors()
+            return extractors.extract(filepath), False, None  # False = not binary
+
+        # Standard text file handling: sniff the head, then one read; latin-1 if not UTF-8
+        content, skipped = es_manifest.read_text_file(filepath, st, limit, fallback_encoding='latin-1')
+        return content, skipped is not None, skipped
+    except OSError as e:
+        return f"[UNREADABLE FILE - {str(e)}]", True, None
+
+# Traversal tags: which outputs still want a directory's contents
+_MANIFEST = 1
+_SITE_MAP = 2
 
-def gather_project_structure(root_dir, excluded_items):
-    """Walk the project directory and gather all files with their content."""
-    project_data = []
+def gather_project_structure(root_dir, excluded_items, profile=None, site_map=None, site_entries=None,
+                             excluded=None, walk_jobs=1, gitignore=False):
+    """Walk the project directory and return the sorted (path, relative_path) pairs to document.
+
+    Only paths are gathered here; contents are read one entry at a time by
+    iter_project_entries so memory stays bounded by the largest single file.
+    With a RunProfile, the walk and every exclusion check are timed.
+    With site_map (the rules of gen-sm-deb.py), the same traversal also
+    collects the site map's lines into site_entries; a directory is entered
+    while either output still wants it. A matcher already compiled from
+    excluded_items may be passed as excluded. With walk_jobs > 1 the walk is
+    spread over that many threads, each sorting its own share, and the
+    shares are merged - the result is the same list the serial walk gives.
+    With gitignore, .gitignore/.ignore files (and .git/info/exclude) prune
+    the manifest's walk too: their rules are compiled once per directory as
+    it is entered, and an ignored directory is never listed.
+    """
+    if excluded is None:
+        excluded = compile_exclusions(excluded_items)
+    if profile is not None:
+        excluded = profile.timed('exclusions', excluded)
+        walk_start = time.perf_counter()
 
     print("⚜️  The Royal Cartographer begins the survey...")
 
-    for root, dirs, files in os.walk(root_dir):
+    prefix = os.path.join(root_dir, '')
+    # The ignore rules in force in each directory the manifest's walk entered
+    levels = {'': es_manifest.IgnoreRules.for_root(root_dir)} if gitignore else None
+    ignored_dirs = []
+
+    def enter(relative_dir, entry, wanted):
         # Remove excluded directories from walk to prevent traversing them
-        dirs[:] = [d for d in dirs if not is_excluded(os.path.join(root, d), excluded_items)]
+        keep = 0
+        if wanted & _MANIFEST and not excluded(prefix + relative_dir):
+            if levels is None:
+                keep |= _MANIFEST
+            else:
+                rules = levels[relative_dir.rpartition(os.sep)[0]]
+                if rules.ignored(relative_dir, True):
+                    ignored_dirs.append(relative_dir)
+                else:
+                    levels[relative_dir] = rules.child(relative_dir, entry.path)
+                    keep |= _MANIFEST
+        if wanted & _SITE_MAP and site_map.enter_dir(entry.name):
+            keep |= _SITE_MAP
+        return keep
 
-        for file in files:
-            file_path = os.path.join(root, file)
-            relative_path = os.path.relpath(file_path, root_dir)
+    def survey(walk):
+        paths, lines, ignored = [], [], 0
+        for relative_path, entry, is_dir, wanted in walk:
+            if wanted & _SITE_MAP:
+                line = site_map.map_entry(relative_path, entry.name, is_dir)
+                if line is not None:
+                    lines.append(line)
 
             # DEBUG: Uncomment this line to see package-lock.json detection
-            # if 'package-lock.json' in file:
-            #     print(f"DEBUG: Found {relative_path} - excluded: {is_excluded(relative_path, excluded_items)}")
+            # if 'package-lock.json' in entry.name:
+            #     print(f"DEBUG: Found {relative_path} - excluded: {excluded(relative_path)}")
 
-            if is_excluded(relative_path, excluded_items):
+            if is_dir or not wanted & _MANIFEST or excluded(relative_path):
+                continue
+            if levels is not None and levels[relative_path.rpartition(os.sep)[0]].ignored(relative_path):
+                ignored += 1
                 continue
 
-            file_data = {"path": file_path, "relative_path": relative_path}
+            paths.append((entry.path, relative_path))
 
-            if should_read_file_content(file_path):
-                content, is_binary = read_file_content(file_path)
-                file_data["content"] = content
-                file_data["is_binary"] = is_binary
-            else:
-                file_data["content"] = "[BINARY FILE - CONTENT EXCLUDED]"
-                file_data["is_binary"] = True
+        # Sort by relative path for consistent output
+        paths.sort(key=lambda x: x[1])
+        return paths, lines, ignored
+
+    start_tag = _MANIFEST | (_SITE_MAP if site_map is not None else 0)
+    if walk_jobs > 1:
+        parts = es_manifest.walk_tree_parallel(root_dir, survey, enter, start_tag, walk_jobs)
+    else:
+        parts = [survey(es_manifest.walk_tree(root_dir, enter, start_tag))]
+    # Each worker's part is sorted on its own; one streaming merge gives the serial order
+    if len(parts) == 1:
+        project_paths = parts[0][0]
+    else:
+        project_paths = list(heapq.merge(*(paths for paths, _, _ in parts), key=lambda x: x[1]))
+    if site_map is not None:
+        for _, lines, _ in parts:
+            site_entries.extend(lines)  # write_site_map sorts these itself
+    if levels is not None:
+        ignored_files = sum(ignored for _, _, ignored in parts)
+        print(f"🙈 Ignore Files: {len(ignored_dirs)} directories and {ignored_files} files left out")
+        if profile is not None:
+            profile.count('ignored_dirs', len(ignored_dirs))
+            profile.count('ignored_files', ignored_files)
+    if profile is not None:
+        profile.add('walk', time.perf_counter() - walk_start)
+        profile.count('files_surveyed', len(project_paths))
+    return project_paths
+
+def load_site_map_rules():
+    """Load the site-map rules from gen-sm-deb.py beside this script (for --site-map)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), SITE_MAP_SCRIPT)
+    spec = importlib.util.spec_from_file_location('gen_sm_deb', path)
+    rules = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(rules)
+    return rules
 
-            project_data.append(file_data)
+def read_project_entry(file_path, relative_path, st=None, max_bytes=MAX_FILE_BYTES, extractors=None,
+                       profile=None, embedder=None):
+    """Read a single file into the entry dict consumed by generate_established_source.
+
+    With a RunProfile, the read (or extraction) is timed per file. Binaries
+    the BinaryEmbedder picks get an "embed" (encoding, size) pair instead of
+    being read; their bytes are streamed from the file as the entry is written.
+    """
+    file_data = {"path": file_path, "relative_path": relative_path, "stat": st}
+    if profile is not None:
+        start = time.perf_counter()
+
+    if should_read_file_content(file_path):
+        content, is_binary, skipped = read_file_content(file_path, st, size_limit_for(file_path, max_bytes),
+                                                        extractors)
+        file_data["is_binary"] = is_binary
+        file_data["skipped"] = skipped
+        if is_binary:
+            file_data["content"] = content
+            if skipped and skipped[0] in ('BINARY', 'OVERSIZED'):
+                embed_binary(file_data, embedder, oversized=skipped[0] == 'OVERSIZED')
+        else:
+            # Encoded and hashed in the worker so the writer only compares digests
+            body = content if content.endswith('\n') else content + '\n'
+            file_data["body"] = body.encode('utf-8')
+            file_data["digest"] = es_manifest.content_digest(file_data["body"])
+    else:
+        file_data["content"] = "[BINARY FILE - CONTENT EXCLUDED]"
+        file_data["is_binary"] = True
+        if not embed_binary(file_data, embedder) and profile is not None:
+            profile.count('placeholders')
+        return file_data
 
-    # Sort by relative path for consistent output
-    project_data.sort(key=lambda x: x["relative_path"])
-    return project_data
+    if profile is not None:
+        stage = 'extract' if os.path.splitext(file_path)[1].lower() in SPECIAL_DOCUMENT_EXTENSIONS else 'read'
+        try:
+            size = st.st_size if st is not None else os.path.getsize(file_path)
+        except OSError:
+            size = 0
+        profile.file(relative_path, stage, time.perf_counter() - start, size)
+    return file_data
+
+def embed_binary(file_data, embedder, oversized=False):
+    """Mark a binary entry for embedding if the embedder wants it; returns whether it does.
+
+    An oversized file was never looked at, so its head is sniffed first: only
+    binaries are embedded, however large a text file is.
+    """
+    if embedder is None:
+        return False
+    size = embedder.size_to_embed(file_data["path"], file_data["relative_path"], file_data["stat"])
+    if size is None:
+        return False
+    if oversized:
+        try:
+            if es_manifest.sniff_binary(file_data["path"], fallback_encoding='latin-1') is None:
+                return False
+        except OSError:
+            return False
+    file_data["embed"] = (embedder.encoding, size)
+    return True
 
-def generate_established_source(project_data, output_path):
-    """Generate the established-source.txt file in the proper format."""
-    print(f"⚜️  The Royal Scribe begins inscribing to {output_path}...")
+def iter_project_entries(project_paths, jobs=1, cache=None, max_bytes=MAX_FILE_BYTES, extractors=None,
+                         profile=None, stats=None, embedder=None):
+    """Lazily yield one entry per surveyed path, in the order given.
 
-    with open(output_path, 'w', encoding='utf-8') as outfile:
-        outfile.write("[file name]: established-source.txt\n")
-        outfile.write("[file content begin]\n")
+    With jobs > 1 the reads and document extractions overlap on a thread pool,
+    but entries are still yielded strictly in input order so the manifest is
+    byte-identical to a serial run. At most 2 * jobs entries are held at once.
 
-        for file_info in project_data:
-            outfile.write(f"\n{file_info['path']}\n")
+    With a ManifestCache, files whose (size, mtime_ns, inode) are unchanged are
+    not opened at all; their previous entry bytes are yielded as "chunk",
+    along with the body "digest" the cache recorded. A file last written as a
+    reference comes back as just its digest and a "reread" callable, for the
+    writer to call should its first copy be gone. stats may map relative
+    paths to stat results already known to be current (watch mode), which
+    are then used instead of stat-ing those files again. embedder is the
+    BinaryEmbedder choosing binaries to embed, if any.
+    """
+    pool = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    window = 2 * jobs if pool else 1
+    pending = deque()
 
-            if not file_info['is_binary']:
-                outfile.write("[file content begin]\n")
-                outfile.write(file_info["content"])
-                if not file_info["content"].endswith('\n'):
-                    outfile.write("\n")
-                outfile.write("[file content end]\n")
+    try:
+        for file_path, relative_path in project_paths:
+            st = None
+            if cache is not None:
+                st = stats.get(relative_path) if stats is not None else None
+                if st is None:
+                    try:
+                        st = os.stat(file_path)
+                    except OSError:
+                        pass
+                hit = cache.lookup(relative_path, st)
+                if hit is not None:
+                    if profile is not None:
+                        profile.count('cache_hits')
+                    chunk, kind, digest = hit
+                    if kind == es_manifest.ENTRY_REFERENCE:
+                        pending.append({"path": file_path, "relative_path": relative_path, "stat": st,
+                                        "is_binary": False, "digest": digest,
+                                        "reread": functools.partial(read_project_entry, file_path, relative_path,
+                                                                    st, max_bytes, extractors, profile, embedder)})
+                    else:
+                        pending.append({"path": file_path, "relative_path": relative_path, "stat": st,
+                                        "is_binary": kind != es_manifest.ENTRY_TEXT, "kind": kind,
+                                        "chunk": chunk, "digest": digest})
+                    if len(pending) >= window:
+                        yield _resolve_entry(pending.popleft())
+                    continue
+
+            if pool is not None:
+                pending.append(pool.submit(read_project_entry, file_path, relative_path, st, max_bytes,
+                                           extractors, profile, embedder))
             else:
-                outfile.write(f"[BINARY FILE - {file_info['relative_path']}]\n")
+                pending.append(read_project_entry(file_path, relative_path, st, max_bytes, extractors, profile,
+                                                  embedder))
+            if len(pending) >= window:
+                yield _resolve_entry(pending.popleft())
+
+        while pending:
+            yield _resolve_entry(pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+def _resolve_entry(entry):
+    return entry.result() if isinstance(entry, Future) else entry
+
+def iter_entry_bytes(file_info, same_as=None, write_digest=WRITE_DIGESTS):
+    """Yield the pieces of one manifest entry exactly as they appear in established-source.txt.
+
+    same_as names the path line of an earlier entry with identical content; the
+    content block is then replaced by a reference to it and no body is needed.
+    A binary marked for embedding is streamed from its file in blocks; should
+    it have become unreadable, it falls back to (and is left marked as) a
+    placeholder.
+    """
+    if file_info.get('embed'):
+        try:
+            source = open(file_info['path'], 'rb')
+        except OSError:
+            file_info['embed'] = None
+        else:
+            with source:
+                yield f"\n{file_info['path']}\n".encode('utf-8')
+                yield from es_manifest.iter_embedded_bytes(source, file_info['embed'][0])
+            return
+
+    yield f"\n{file_info['path']}\n".encode('utf-8')
+
+    if not file_info['is_binary']:
+        if write_digest:
+            yield es_manifest.digest_line(file_info['digest']).encode('utf-8')
+        if same_as is not None:
+            yield es_manifest.reference_line(same_as).encode('utf-8')
+            return
+        yield b"[file content begin]\n"
+        yield file_info["body"]
+        yield b"[file content end]\n"
+    elif file_info.get('skipped'):
+        label, reason = file_info['skipped']
+        yield f"[{label} FILE - {file_info['relative_path']} - {reason}]\n".encode('utf-8')
+    else:
+        yield f"[BINARY FILE - {file_info['relative_path']}]\n".encode('utf-8')
+
+def cache_fingerprint(project_root, max_bytes=MAX_FILE_BYTES, write_digests=WRITE_DIGESTS, extractors=None,
+                      embedder=None):
+    """Everything besides a file's own bytes that shapes its entry - any change invalidates the cache."""
+    settings = {
+        'project_root': project_root,
+        'excluded_items': sorted(EXCLUDED_ITEMS),
+        'binary_extensions': sorted(BINARY_EXTENSIONS),
+        'special_document_extensions': sorted(SPECIAL_DOCUMENT_EXTENSIONS),
+        'max_file_bytes': max_bytes,
+        'file_size_limits': FILE_SIZE_LIMITS,
+        'write_digests': write_digests,
+        'embed': embedder.signature() if embedder is not None else None,
+        'sniff': [es_manifest.SNIFF_BYTES, [kind for _, kind in es_manifest.BINARY_SIGNATURES]],
+        'extractors': [(extractors or default_extractors()).signature(ext)
+                       for ext in sorted(SPECIAL_DOCUMENT_EXTENSIONS)],
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+def inscribe_manifest(outfile, project_data, cache_writer=None, index_writer=None, deduplicate=DEDUPLICATE,
+                      write_digests=WRITE_DIGESTS, profile=None):
+    """Write the manifest header, every entry of project_data and the closing marker to outfile.
+
+    outfile is a ManifestWriter; the cache and index writers, when given, are
+    fed each entry's offset and length. Returns the (text_files, binary_files,
+    duplicate_files, embedded_files) tally described in generate_established_source.
+    """
+    text_files = 0
+    binary_files = 0
+    duplicate_files = 0
+    embedded_files = 0
+    first_seen = {}  # body digest -> path line of the entry holding that body
 
-        outfile.write("[file content end]\n")
+    outfile.write(b"[file name]: established-source.txt\n")
+    outfile.write(b"[file content begin]\n")
 
-    print("⚜️  VICTORY! The Established Source manifest has been forged!")
+    for file_info in project_data:
+        if profile is not None:
+            start = time.perf_counter()
+        offset = outfile.tell()
+        digest = file_info.get('digest') or ''
+        if 'reread' in file_info and not (deduplicate and digest in first_seen):
+            # A cached duplicate whose first copy is gone (or dedup is off) is written in full again
+            file_info = file_info['reread']()
+            digest = file_info.get('digest') or ''
+        same_as = None
+        if deduplicate and digest and digest != es_manifest.EMPTY_DIGEST:
+            same_as = first_seen.get(digest)
+            if same_as is None:
+                first_seen[digest] = file_info['path']
+
+        if same_as is None and "chunk" in file_info:
+            outfile.write(file_info["chunk"])
+        else:
+            # A reference needs only the path and digest, which cache hits carry too
+            for piece in iter_entry_bytes(file_info, same_as, write_digests):
+                outfile.write(piece)
+
+        if same_as is not None:
+            kind = es_manifest.ENTRY_REFERENCE
+        elif "chunk" in file_info:
+            kind = file_info['kind']
+        elif file_info.get('embed'):
+            kind = es_manifest.ENTRY_EMBEDDED
+        else:
+            kind = es_manifest.ENTRY_BINARY if file_info['is_binary'] else es_manifest.ENTRY_TEXT
+        if file_info['is_binary']:
+            binary_files += 1
+            embedded_files += kind == es_manifest.ENTRY_EMBEDDED
+        else:
+            text_files += 1
+            duplicate_files += kind == es_manifest.ENTRY_REFERENCE
+        length = outfile.tell() - offset
+        if cache_writer is not None:
+            cache_writer.add(file_info['relative_path'], file_info['stat'], offset, length, kind, digest)
+        if index_writer is not None:
+            index_writer.add(file_info['relative_path'], offset, length, kind)
+        outfile.mark()
+        if profile is not None:
+            profile.add('write', time.perf_counter() - start)
+
+    outfile.write(b"[file content end]\n")
+    if profile is not None:
+        profile.count('manifest_bytes', outfile.tell())
+    return text_files, binary_files, duplicate_files, embedded_files
+
+def entry_weight(file_info, write_digest=WRITE_DIGESTS):
+    """Bytes an entry takes when written in full - what a byte budget counts, whatever dedup makes of it."""
+    if "reread" in file_info:
+        file_info.update(file_info.pop("reread")())  # Only the file itself knows a cached duplicate's full size
+    if "chunk" in file_info:
+        return len(file_info["chunk"])
+    if file_info.get('embed'):
+        encoding, size = file_info['embed']
+        return len(f"\n{file_info['path']}\n".encode('utf-8')) + es_manifest.embedded_length(size, encoding)
+    return sum(map(len, iter_entry_bytes(file_info, None, write_digest)))
+
+def generate_established_source(project_data, output_path, fingerprint=None, cache=None, write_index=True,
+                                 deduplicate=DEDUPLICATE, write_digests=WRITE_DIGESTS, profile=None, announce=True):
+    """Generate the established-source.txt file in the proper format.
+
+    project_data may be any iterable of entries (typically the iter_project_entries
+    generator); each entry is written and released before the next one is read.
+    The manifest is written to a temporary file and renamed into place,
+    compressed in frames when output_path ends in a codec suffix. When a
+    cache fingerprint is given, the .cache sidecar is rewritten alongside it; the
+    ManifestCache reading the previous manifest is closed before the rename.
+    With write_index, the .idx sidecar maps each relative path to its entry's
+    byte offset and length so restorers can seek straight to it.
+    With deduplicate, a text file whose body digest matches an earlier entry is
+    written as a reference to that entry; the cache remembers its digest, so
+    an unchanged duplicate is not read again while its first copy stays.
+    Returns a (text_files, binary_files, duplicate_files, embedded_files)
+    tally, duplicates being counted among the text files and embedded
+    binaries among the binary files too.
+    With a RunProfile, time spent waiting on project_data, writing entries and
+    committing the sidecars is recorded, along with the manifest's size.
+    announce=False skips the progress messages (watch mode).
+    """
+    if announce:
+        print(f"⚜️  The Royal Scribe begins inscribing to {output_path}...")
+
+    tmp_path = output_path + '.tmp'
+    cache_writer = None
+    index_writer = None
+    if fingerprint is not None:
+        cache_writer = es_manifest.ManifestCacheWriter(output_path, fingerprint, time.time_ns())
+    if write_index:
+        index_writer = es_manifest.ManifestIndexWriter(output_path)
+    if profile is not None:
+        project_data = profile.timed_iter('wait', project_data)
 
-def check_document_dependencies():
-    """Check if document parsing dependencies are available."""
     try:
-        import docx
-        print("📄 Document Support: python-docx available for .docx text extraction")
-        return True
-    except ImportError:
-        print("📄 Document Support: python-docx not installed - .docx files will have limited support")
-        print("   Install with: pip install python-docx")
-        return False
+        with es_manifest.ManifestWriter(tmp_path, es_manifest.compression_of(output_path)) as outfile:
+            counts = inscribe_manifest(outfile, project_data, cache_writer, index_writer, deduplicate,
+                                       write_digests, profile)
+        if profile is not None:
+            start = time.perf_counter()
+
+        if cache is not None:
+            cache.close()
+        if cache_writer is not None:
+            cache_writer.commit(tmp_path)
+            cache_writer = None
+        if index_writer is not None:
+            index_writer.commit(tmp_path, outfile)
+            index_writer = None
+        os.replace(tmp_path, output_path)
+        if profile is not None:
+            profile.add('finalize', time.perf_counter() - start)
+            profile.count('output_bytes', os.path.getsize(output_path))
+            count_entries(profile, counts)
+    finally:
+        if cache is not None:
+            cache.close()
+        if cache_writer is not None:
+            cache_writer.discard()
+        if index_writer is not None:
+            index_writer.discard()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if announce:
+        print("⚜️  VICTORY! The Established Source manifest has been forged!")
+    return counts
+
+def count_entries(profile, counts):
+    """Record an inscription tally in a RunProfile."""
+    text_files, binary_files, duplicate_files, embedded_files = counts
+    profile.count('entries_text', text_files - duplicate_files)
+    profile.count('entries_reference', duplicate_files)
+    profile.count('entries_binary', binary_files - embedded_files)
+    profile.count('entries_embedded', embedded_files)
+
+def generate_sharded_source(project_data, table_path, budget, unit='bytes', codec=None, fingerprint=None, cache=None,
+                            write_index=True, deduplicate=DEDUPLICATE, write_digests=WRITE_DIGESTS, profile=None,
+                            announce=True, jobs=SHARD_WRITERS):
+    """Generate the manifest as shards of about budget bytes (or entries) listed in a shard table.
+
+    The shard table goes to table_path and the shards beside it (see
+    es_manifest.ShardWriter): entries are cut where es_manifest.ShardPlanner
+    says, and each shard is written by inscribe_manifest on one of jobs
+    threads while the next one fills, compressed with codec if given. Every
+    shard is a standalone manifest with its own sidecars, so duplicates are
+    only written as references within a shard. The cache (a ManifestCache or
+    ShardedManifestCache of the previous run) is closed before old shards are
+    removed. Returns the same tally as generate_established_source.
+    """
+    if announce:
+        print(f"⚜️  The Royal Scribe begins inscribing shards listed in {table_path}...")
+
+    def write_shard(outfile, entries, cache_writer, index_writer):
+        return inscribe_manifest(outfile, entries, cache_writer, index_writer, deduplicate, write_digests, profile)
+
+    def weigh(file_info):
+        return entry_weight(file_info, write_digests)
+
+    if profile is not None:
+        project_data = profile.timed_iter('wait', project_data)
+
+    try:
+        with es_manifest.ShardWriter(table_path, write_shard, budget, unit, weigh, codec, jobs,
+                                     fingerprint, write_index, time.time_ns()) as shards:
+            for file_info in project_data:
+                shards.add(file_info['relative_path'], file_info)
+            start = time.perf_counter()
+            tallies = shards.commit(cache)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    counts = tuple(sum(column) for column in zip((0, 0, 0, 0), *tallies))
+    unchanged = sum(shard['unchanged'] for shard in shards.shards)
+    if profile is not None:
+        profile.add('finalize', time.perf_counter() - start)
+        profile.count('output_bytes', os.path.getsize(table_path) + sum(shard['bytes'] for shard in shards.shards))
+        profile.count('shards', len(shards.shards))
+        profile.count('shards_unchanged', unchanged)
+        count_entries(profile, counts)
+
+    if announce:
+        print(f"⚜️  VICTORY! {len(shards.shards)} shards forged, {unchanged} of them unchanged since the last run!")
+    return counts
+
+def forge_manifest(project_data, output_file, args, fingerprint=None, cache=None, profile=None, announce=True):
+    """Write project_data to output_file as one manifest, or as shards when args asks for them.
+
+    A single manifest retires any shards an earlier sharded run left beside it.
+    """
+    if args.shard_entries or args.shard_size:
+        budget, unit = (args.shard_entries, 'entries') if args.shard_entries else (args.shard_size, 'bytes')
+        return generate_sharded_source(project_data, output_file, budget, unit, args.compress, fingerprint, cache,
+                                       args.index, args.dedup, args.digests, profile, announce)
+    counts = generate_established_source(project_data, output_file, fingerprint, cache, args.index, args.dedup,
+                                         args.digests, profile, announce)
+    es_manifest.remove_shards(os.path.join(os.path.dirname(output_file), OUTPUT_FILENAME))
+    return counts
+
+def forge_delta(base_manifest, output_file, codec=None):
+    """Write established-source.txt.delta beside output_file, carrying base_manifest to it."""
+    delta_file = es_manifest.compressed_name(
+        os.path.join(os.path.dirname(output_file), es_manifest.DELTA_FILENAME), codec)
+    try:
+        added, changed, removed = es_manifest.write_delta(base_manifest, output_file, delta_file)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Delta not written: {e}")
+        return
+    size = es_manifest.format_size(os.path.getsize(delta_file))
+    print(f"   Delta: {added} added, {changed} changed, {removed} removed since {base_manifest}")
+    print(f"   Delta File: {delta_file} ({size})")
+
+def binary_embedder(args):
+    """The BinaryEmbedder the command line asks for, or None to keep binary placeholders."""
+    if not args.embed_binaries:
+        return None
+    return es_manifest.BinaryEmbedder(args.embed_encoding, args.embed_max_size, args.embed)
+
+def open_watcher(project_root):
+    """An inotify watcher on Linux, else (or when told to) one that polls."""
+    try:
+        return es_manifest.InotifyWatcher(project_root)
+    except OSError as e:
+        print(f"👀 inotify unavailable ({e}) - polling every {WATCH_POLL_INTERVAL:g}s instead")
+        return es_manifest.PollingWatcher(project_root, WATCH_POLL_INTERVAL)
+
+def watch_project(project_root, output_file, args, extractors, profile=None):
+    """Generate the manifest, then keep it current until interrupted.
+
+    The tree is walked once: every included directory is watched and the
+    documented files are kept as a sorted path list with their last stat.
+    Each burst of changes (a save, a git checkout) is debounced, the changed
+    paths are re-stat'ed and folded into that list with the same exclusion
+    rules as a full survey, and the manifest is regenerated through the
+    cache - so only the affected entries are re-read and the output is the
+    same bytes a fresh full run would write.
+    """
+    excluded = compile_exclusions(EXCLUDED_ITEMS)
+    prefix = os.path.join(project_root, '')
+    embedder = binary_embedder(args)
+    fingerprint = (cache_fingerprint(project_root, args.max_file_size, args.digests, extractors, embedder)
+                   if args.cache else None)
+    stats = {}  # relative_path -> current stat of each documented file (None = stat it again)
+    order = []  # the same paths, kept sorted
+    dirs = set()  # watched directories, '' being the root
+
+    def add_file(relative_path, st=None):
+        if relative_path not in stats:
+            bisect.insort(order, relative_path)
+        stats[relative_path] = st
+
+    def remove_file(relative_path):
+        if stats.pop(relative_path, False) is not False:
+            del order[bisect.bisect_left(order, relative_path)]
+
+    def add_tree(relative_dir):
+        # Watches go on before each directory is listed, so nothing created meanwhile is missed
+        below = relative_dir + os.sep if relative_dir else ''
+
+        def enter(rel, entry, tag):
+            if excluded(prefix + below + rel):
+                return False
+            watcher.watch(below + rel)
+            dirs.add(below + rel)
+            return True
+
+        watcher.watch(relative_dir)
+        dirs.add(relative_dir)
+        for rel, entry, is_dir, _ in es_manifest.walk_tree(prefix + relative_dir, enter):
+            if not is_dir and not excluded(below + rel):
+                add_file(below + rel)
+
+    def remove_tree(relative_dir):
+        watcher.unwatch(relative_dir)
+        below = relative_dir + os.sep
+        dirs.difference_update([d for d in dirs if d == relative_dir or d.startswith(below)])
+        # Paths under a directory sort together, ending before its name + chr(ord(os.sep) + 1)
+        start = bisect.bisect_left(order, below)
+        end = bisect.bisect_left(order, relative_dir + chr(ord(os.sep) + 1))
+        for relative_path in order[start:end]:
+            del stats[relative_path]
+        del order[start:end]
+
+    def apply_changes(changed):
+        """Fold re-stat'ed paths into the survey; returns whether the manifest is affected."""
+        states = {}
+        for relative_path in changed:
+            path = prefix + relative_path
+            try:
+                st = os.stat(path)
+                kind = 'link' if stat.S_ISDIR(st.st_mode) and os.path.islink(path) else \
+                       'dir' if stat.S_ISDIR(st.st_mode) else 'file'
+            except OSError:
+                st = None
+                kind = 'file' if os.path.lexists(path) else None  # A dangling link is listed like a file
+            states[relative_path] = (kind, st)
+
+        affected = False
+        # Removals first: a directory moved within the tree keeps its watch descriptor
+        for relative_path, (kind, st) in states.items():
+            if relative_path in dirs and kind != 'dir':
+                remove_tree(relative_path)
+                affected = True
+            if relative_path in stats and kind != 'file':
+                remove_file(relative_path)
+                affected = True
+        for relative_path in sorted(states):
+            kind, st = states[relative_path]
+            if os.path.dirname(relative_path) not in dirs:
+                continue
+            if kind == 'dir' and relative_path not in dirs and not excluded(prefix + relative_path):
+                add_tree(relative_path)
+                affected = True
+            elif kind == 'file' and not excluded(relative_path):
+                add_file(relative_path, st)
+                affected = True
+        return affected
+
+    def regenerate():
+        cache = es_manifest.open_cache(es_manifest.locate_manifest(output_file), fingerprint) if args.cache else None
+        project_paths = [(prefix + relative_path, relative_path) for relative_path in order]
+        counts = forge_manifest(
+            iter_project_entries(project_paths, args.jobs, cache, args.max_file_size, extractors, profile, stats,
+                                 embedder),
+            output_file, args, fingerprint, cache, profile, announce=False)
+        return counts, cache
+
+    watcher = open_watcher(project_root)
+    try:
+        while True:
+            print("⚜️  The Royal Cartographer surveys the territory and posts the watch...")
+            try:
+                add_tree('')
+            except OSError as e:
+                # Most likely fs.inotify.max_user_watches - fall back to polling
+                print(f"👀 Cannot watch every directory ({e}) - polling every {WATCH_POLL_INTERVAL:g}s instead")
+                watcher.close()
+                watcher = es_manifest.PollingWatcher(project_root, WATCH_POLL_INTERVAL)
+                stats.clear()
+                order.clear()
+                dirs.clear()
+                add_tree('')
+            (text_files, binary_files, _, _), _ = regenerate()
+            print(f"⚜️  Manifest forged at {output_file}: {text_files} text, {binary_files} binary files")
+            print("👀 Watching for changes (Ctrl+C to stop)...")
+
+            rescan = False
+            while not rescan:
+                changed = watcher.read()
+                started = time.monotonic()
+                # Debounce: keep collecting until the tree is quiet, but never wait past WATCH_MAX_DELAY
+                while changed is not None:
+                    remaining = WATCH_MAX_DELAY - (time.monotonic() - started)
+                    if remaining <= 0:
+                        break
+                    more = watcher.read(min(WATCH_DEBOUNCE, remaining))
+                    if more is None:
+                        changed = None
+                    elif not more:
+                        break
+                    else:
+                        changed |= more
+                if changed is None:
+                    print("🌊 Change events overflowed - surveying the whole territory again")
+                    rescan = True
+                    break
+                try:
+                    affected = apply_changes(changed)
+                except OSError as e:
+                    print(f"🌊 Lost track of the tree ({e}) - surveying the whole territory again")
+                    rescan = True
+                    break
+                if not affected:
+                    continue
+                start = time.perf_counter()
+                _, cache = regenerate()
+                refreshed = f", {cache.refreshed} entries re-read" if cache is not None else ""
+                print(f"🔄 {len(changed)} change(s) -> manifest refreshed in {time.perf_counter() - start:.2f}s"
+                      f"{refreshed}")
+
+            watcher.unwatch('')
+            stats.clear()
+            order.clear()
+            dirs.clear()
+    except KeyboardInterrupt:
+        print("\n👋 The watch is ended; the manifest is current.")
+    finally:
+        watcher.close()
 
 def display_supported_formats():
     """Display the supported text formats for clarity."""
@@ -329,41 +1352,404 @@ def display_supported_formats():
     print(", ".join(text_formats))
     print()
 
-def main():
+def print_profile(report):
+    """Print a RunProfile report: stages, counters and the slowest files."""
+    print(f"\n⏱️  Royal Stopwatch (wall {report['wall_s']:.3f}s; read and extract are summed over reader threads)")
+    for name, timer in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"   {name:<24}{timer['seconds']:>10.3f}s{timer['calls']:>10} calls")
+    for name, value in report['counters'].items():
+        shown = es_manifest.format_size(value) if name.endswith('_bytes') else value
+        print(f"   {name:<24}{shown:>11}")
+    if report['slowest_files']:
+        print("🐌 Slowest files:")
+        for item in report['slowest_files']:
+            print(f"   {item['seconds']:>9.3f}s  {item['stage']:<8}{item['path']}")
+
+def manifest_path(project_root, args):
+    """Where a run with args writes project_root's manifest (or shard table)."""
+    output_file = os.path.join(project_root, OUTPUT_FILENAME)
+    if not (args.shard_entries or args.shard_size):
+        output_file = es_manifest.compressed_name(output_file, args.compress)
+    return output_file
+
+def print_settings(args, output_file):
+    """Print the settings every project of a run shares."""
+    print(f"Excluded Items: {EXCLUDED_ITEMS}")
+    print(f"Reader Workers: {args.jobs}")
+    if args.walk_jobs > 1:
+        print(f"Walk Workers: {args.walk_jobs}")
+    if args.gitignore:
+        print(f"Ignore Files: {', '.join(es_manifest.IGNORE_FILES)} and {es_manifest.IGNORE_EXCLUDE_FILE}")
+    print(f"Size Cap: {es_manifest.format_size(args.max_file_size) if args.max_file_size else 'none'}")
+    if args.shard_entries or args.shard_size:
+        per_shard = f"{args.shard_entries} entries" if args.shard_entries else es_manifest.format_size(args.shard_size)
+        print(f"Shards: about {per_shard} each, in {es_manifest.shard_dir(output_file)}")
+    if args.embed_binaries:
+        cap = es_manifest.format_size(args.embed_max_size) if args.embed_max_size else 'no cap'
+        print(f"Embedded Binaries: {args.embed_encoding}, {cap}, matching {args.embed or 'anything'}")
+
+def generate_project(project_root, args, extractors, profile=None, excluded=None):
+    """Survey project_root and forge its manifest as args (parse_args) asks.
+
+    This is the whole of a single run after the banner, usable from other
+    scripts: extractors is a DocumentExtractors the caller keeps (and closes),
+    excluded an optional compile_exclusions(EXCLUDED_ITEMS) matcher to reuse.
+    Returns a summary dict of what was written.
+    """
+    output_file = manifest_path(project_root, args)
+
+    # Survey the project structure (paths only - contents are streamed during inscription)
+    site_map = load_site_map_rules() if args.site_map else None
+    site_entries = []
+    project_paths = gather_project_structure(project_root, EXCLUDED_ITEMS, profile, site_map, site_entries,
+                                             excluded, args.walk_jobs, args.gitignore)
+
+    print(f"📊 Survey Complete: Found {len(project_paths)} files to document")
+    if site_map is not None:
+        site_map_file = os.path.join(project_root, site_map.OUTPUT_FILENAME)
+        mapped = site_map.write_site_map(site_entries, site_map_file)
+        print(f"🗺️  Site Map: {mapped} files mapped to {site_map_file} from the same survey")
+
+    # Unchanged files are copied from the previous manifest instead of being re-read
+    embedder = binary_embedder(args)
+    fingerprint = (cache_fingerprint(project_root, args.max_file_size, args.digests, extractors, embedder)
+                   if args.cache else None)
+    cache = es_manifest.open_cache(es_manifest.locate_manifest(output_file), fingerprint) if args.cache else None
+
+    # Generate the established source file (or its shards), reading one entry at a time
+    text_files, binary_files, duplicate_files, embedded_files = forge_manifest(
+        iter_project_entries(project_paths, args.jobs, cache, args.max_file_size, extractors, profile,
+                             embedder=embedder),
+        output_file, args, fingerprint, cache, profile)
+
+    # Count by type for pimp-tight reporting
+    print(f"   Text Files: {text_files}, Binary Files: {binary_files}")
+    if embedded_files:
+        print(f"   Embedded: {embedded_files} binaries written in full as {args.embed_encoding}")
+    if duplicate_files:
+        print(f"   Duplicates: {duplicate_files} written as references to their first copy")
+    if cache is not None:
+        print(f"   Cache: {cache.reused} entries reused, {cache.refreshed} refreshed")
+    return {'root': project_root, 'output': output_file, 'files': len(project_paths),
+            'text': text_files, 'binary': binary_files, 'duplicates': duplicate_files,
+            'embedded': embedded_files, 'reused': cache.reused if cache is not None else 0,
+            'refreshed': cache.refreshed if cache is not None else len(project_paths)}
+
+# The worker process's share of a batch: (args, DocumentExtractors, compiled exclusions)
+_batch_worker = None
+
+def _start_batch_worker(args, available):
+    """Process pool initializer: build what every root of this worker shares, once."""
+    global _batch_worker
+    extraction_cache = None
+    if args.extraction_cache_size:
+        try:
+            extraction_cache = es_manifest.ExtractionCache(EXTRACTION_CACHE_DIR, args.extraction_cache_size)
+        except OSError:
+            pass  # The parent already warned
+    extractors = DocumentExtractors(timeout=args.extract_timeout, cache=extraction_cache, available=available)
+    _batch_worker = (args, extractors, compile_exclusions(EXCLUDED_ITEMS))
+
+def _generate_batch_root(project_root):
+    """Forge one root of a batch in this worker; its chatter is kept, only warnings come back."""
+    args, extractors, excluded = _batch_worker
+    profile = es_manifest.RunProfile(args.profile_top) if args.profile or args.metrics else None
+    extractors.profile = profile
+    extraction_cache = extractors.cache
+    hits, misses = (extraction_cache.hits, extraction_cache.misses) if extraction_cache is not None else (0, 0)
+    chatter = io.StringIO()
+    start = time.perf_counter()
+    try:
+        if not os.path.isdir(project_root):
+            raise NotADirectoryError(f"not a project directory: {project_root}")
+        with contextlib.redirect_stdout(chatter):
+            summary = generate_project(project_root, args, extractors, profile, excluded)
+    except Exception as e:
+        summary = {'root': project_root, 'error': f"{type(e).__name__}: {e}"}
+    summary['seconds'] = time.perf_counter() - start
+    summary['warnings'] = [line for line in chatter.getvalue().splitlines() if line.startswith(('⚠️', '🔌'))]
+    summary['disabled'] = sorted(extractors.disabled)
+    if extraction_cache is not None:
+        summary['extraction_hits'] = extraction_cache.hits - hits
+        summary['extraction_misses'] = extraction_cache.misses - misses
+    summary['profile'] = profile.report() if profile is not None else None
+    return summary
+
+def generate_batch(project_roots, args, workers=BATCH_WORKERS, available=None, on_result=None):
+    """Forge one manifest per project root on a pool of worker processes.
+
+    Extractor detection runs once here (or is taken from available) and is
+    handed to every worker; each worker compiles the exclusions and opens the
+    extraction cache once, then forges roots one after another. on_result, if
+    given, sees each root's summary as it finishes. Returns the summaries in
+    project_roots order; a root that failed has an 'error' instead of counts.
+    A script importing this one must register it in sys.modules (importlib's
+    usual recipe) so the pool can hand these functions to its workers.
+    """
+    if available is None:
+        available = probe_extractors()
+    summaries = {}
+    workers = max(1, min(workers, len(project_roots)))
+    if workers == 1:
+        # Nothing to overlap - forge in this process and skip the pool's start-up
+        _start_batch_worker(args, available)
+        try:
+            for project_root in project_roots:
+                summaries[project_root] = _generate_batch_root(project_root)
+                if on_result is not None:
+                    on_result(summaries[project_root])
+        finally:
+            _batch_worker[1].close()
+        return [summaries[project_root] for project_root in project_roots]
+
+    with ProcessPoolExecutor(workers, initializer=_start_batch_worker, initargs=(args, available)) as pool:
+        futures = {pool.submit(_generate_batch_root, project_root): project_root for project_root in project_roots}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as e:  # The worker itself died
+                summary = {'root': futures[future], 'error': f"{type(e).__name__}: {e}", 'seconds': 0.0,
+                           'warnings': [], 'disabled': [], 'profile': None}
+            summaries[summary['root']] = summary
+            if on_result is not None:
+                on_result(summary)
+    return [summaries[project_root] for project_root in project_roots]
+
+def report_batch_root(summary):
+    """One line per finished root, plus any warnings it raised."""
+    if 'error' in summary:
+        print(f"❌ {summary['root']}: {summary['error']}")
+        return
+    print(f"✅ {summary['root']}: {summary['files']} files ({summary['text']} text, {summary['binary']} binary, "
+          f"{summary['reused']} reused) in {summary['seconds']:.2f}s")
+    for warning in summary['warnings']:
+        print(f"   {warning}")
+
+def run_batch(args, available, profile=None):
+    """The --batch run: every root on the process pool, then one consolidated summary."""
+    project_roots = list(dict.fromkeys(os.path.abspath(root) for root in args.batch))
+    workers = max(1, min(args.batch_workers, len(project_roots)))
+    print(f"Batch Roots: {len(project_roots)}, on {workers} worker processes")
+    print(f"Output File: {manifest_path('', args)} in each root")
+    print_settings(args, manifest_path('', args))
+    print()
+
+    start = time.perf_counter()
+    summaries = generate_batch(project_roots, args, workers, available, report_batch_root)
+    wall = time.perf_counter() - start
+
+    forged = [summary for summary in summaries if 'error' not in summary]
+    failed = len(summaries) - len(forged)
+    summed = sum(summary['seconds'] for summary in summaries)
+    print(f"\n📊 Batch Complete: {len(forged)} of {len(summaries)} manifests forged in {wall:.2f}s "
+          f"({summed:.2f}s of per-root work, {summed / wall if wall else 0:.1f}x overlap)")
+    print(f"   Files: {sum(s['files'] for s in forged)} ({sum(s['text'] for s in forged)} text, "
+          f"{sum(s['binary'] for s in forged)} binary)")
+    print(f"   Cache: {sum(s['reused'] for s in forged)} entries reused, {sum(s['refreshed'] for s in forged)} refreshed")
+    hits = sum(summary.get('extraction_hits', 0) for summary in summaries)
+    misses = sum(summary.get('extraction_misses', 0) for summary in summaries)
+    if hits + misses:
+        print(f"   Extraction Cache: {hits} hits, {misses} misses")
+    disabled = sorted(set().union(*(summary['disabled'] for summary in summaries)))
+    if disabled:
+        print(f"   Disabled Extractors: {', '.join(disabled)}")
+    if failed:
+        print(f"   Failed: {failed} of {len(summaries)} roots (see ❌ above)")
+    print("🐌 Slowest roots:")
+    for summary in sorted(summaries, key=lambda summary: -summary['seconds'])[:args.profile_top]:
+        files = f"{summary['files']:>7} files" if 'error' not in summary else f"{'failed':>13}"
+        print(f"   {summary['seconds']:>9.3f}s  {files}  {summary['root']}")
+
+    if profile is not None:
+        for summary in summaries:
+            if summary['profile'] is not None:
+                profile.absorb(summary['profile'], summary['root'])
+        profile.count('batch_roots', len(summaries))
+        profile.count('extraction_cache_hits', hits)
+        profile.count('extraction_cache_misses', misses)
+        if args.profile:
+            print_profile(profile.report())
+        if args.metrics:
+            profile.write_json(args.metrics, roots=[{key: value for key, value in summary.items() if key != 'profile'}
+                                                    for summary in summaries])
+            print(f"📈 Metrics saved to {args.metrics}")
+
+    print(f"\n⚜️  The Royal Archives are ready, one {OUTPUT_FILENAME} per root!")
+    print("The Pimpire's ground truth is now preserved with pimp-tight fidelity!")
+
+def parse_args(argv=None):
+    """Parse command-line overrides for the Royal Edicts."""
+    parser = argparse.ArgumentParser(description="Generate an established-source.txt manifest.")
+    parser.add_argument('-j', '--jobs', type=int, default=READ_JOBS,
+                        help=f"worker threads for reading and extraction, 1 = serial (default: {READ_JOBS})")
+    parser.add_argument('--walk-jobs', type=int, default=WALK_JOBS,
+                        help=f"threads listing directories during the survey, 1 = serial (default: {WALK_JOBS})")
+    parser.add_argument('--gitignore', action='store_true', default=HONOR_GITIGNORE,
+                        help="also leave out (and never walk into) what .gitignore, .ignore and "
+                             ".git/info/exclude ignore")
+    parser.add_argument('--no-cache', dest='cache', action='store_false', default=USE_CACHE,
+                        help="re-read every file instead of reusing unchanged entries from the previous manifest")
+    parser.add_argument('--no-index', dest='index', action='store_false', default=WRITE_INDEX,
+                        help="skip writing the established-source.txt.idx byte-offset index")
+    parser.add_argument('--max-file-size', type=es_manifest.parse_size, default=MAX_FILE_BYTES, metavar='SIZE',
+                        help="record larger files as placeholders, e.g. 512K, 16M, 0 = no cap "
+                             f"(default: {es_manifest.format_size(MAX_FILE_BYTES)})")
+    parser.add_argument('--dedup', action=argparse.BooleanOptionalAction, default=DEDUPLICATE,
+                        help="write a file whose content repeats an earlier entry as a reference to it "
+                             f"(default: {'on' if DEDUPLICATE else 'off'})")
+    parser.add_argument('--digests', action='store_true', default=WRITE_DIGESTS,
+                        help="record each text entry's sha256 on a line after its path")
+    parser.add_argument('--extraction-cache-size', type=es_manifest.parse_size, default=EXTRACTION_CACHE_BYTES,
+                        metavar='SIZE', help="cap on the .doc/.docx extraction store in "
+                        f"{EXTRACTION_CACHE_DIR}, 0 = no store (default: {es_manifest.format_size(EXTRACTION_CACHE_BYTES)})")
+    parser.add_argument('--extract-timeout', type=float, default=EXTRACT_TIMEOUT, metavar='SECONDS',
+                        help=f"per-document limit for .doc/.docx extractors (default: {EXTRACT_TIMEOUT})")
+    parser.add_argument('--compress', choices=sorted(es_manifest.COMPRESSION_CODECS), default=COMPRESSION,
+                        help="write established-source.txt.<gz|bz2|xz> in independently readable frames")
+    shards = parser.add_mutually_exclusive_group()
+    shards.add_argument('--shard-size', type=es_manifest.parse_size, default=SHARD_BYTES, metavar='SIZE',
+                        help="split the manifest into shards of about SIZE each (e.g. 64M), listed in a shard "
+                             "table at established-source.txt")
+    shards.add_argument('--shard-entries', type=int, default=SHARD_ENTRIES, metavar='N',
+                        help="split the manifest into shards of about N entries each")
+    parser.add_argument('--embed-binaries', action='store_true', default=EMBED_BINARIES,
+                        help="write binary files in full, as base64 or base85 lines, so restores give them back")
+    parser.add_argument('--embed-encoding', choices=sorted(es_manifest.EMBED_CODECS), default=EMBED_ENCODING,
+                        help=f"text encoding for embedded binaries (default: {EMBED_ENCODING})")
+    parser.add_argument('--embed-max-size', type=es_manifest.parse_size, default=EMBED_MAX_BYTES, metavar='SIZE',
+                        help="keep placeholders for larger binaries, 0 = no cap "
+                             f"(default: {es_manifest.format_size(EMBED_MAX_BYTES)})")
+    parser.add_argument('--embed', action='append', metavar='PATTERN',
+                        help="embed only binaries whose name or path matches this glob (repeatable; "
+                             "implies --embed-binaries)")
+    parser.add_argument('--delta-from', default=DELTA_BASE, metavar='MANIFEST',
+                        help="also write established-source.txt.delta carrying this earlier manifest to the new one")
+    parser.add_argument('--site-map', action='store_true', default=WRITE_SITE_MAP,
+                        help="also write site-map.txt (gen-sm-deb.py's rules) from the same directory walk")
+    parser.add_argument('--batch', nargs='+', default=[], metavar='ROOT',
+                        help="forge a manifest in each of these project roots instead of PROJECT_ROOT")
+    parser.add_argument('--batch-file', metavar='FILE',
+                        help="read more batch roots from FILE, one per line ('-' = stdin; # starts a comment)")
+    parser.add_argument('--batch-workers', type=int, default=BATCH_WORKERS, metavar='N',
+                        help=f"roots forged at once, each in its own process (default: {BATCH_WORKERS})")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and refresh the manifest whenever files change (inotify, else polling)")
+    parser.add_argument('--profile', action='store_true',
+                        help="print per-stage timings, counters and the slowest files when done")
+    parser.add_argument('--profile-top', type=int, default=PROFILE_TOP, metavar='N',
+                        help=f"slowest files to keep in the profile (default: {PROFILE_TOP})")
+    parser.add_argument('--metrics', metavar='FILE', help="save the profile as JSON to FILE")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.walk_jobs < 1:
+        parser.error("--walk-jobs must be at least 1")
+    if args.shard_entries < 0:
+        parser.error("--shard-entries cannot be negative")
+    if args.watch and args.gitignore:
+        parser.error("--watch follows EXCLUDED_ITEMS only; run --gitignore without --watch")
+    if args.watch and args.site_map:
+        parser.error("--watch keeps only the manifest current; run gen-sm-deb.py for the site map")
+    if args.delta_from and (args.watch or not args.index):
+        parser.error("--delta-from needs the .idx index and a single run (no --no-index or --watch)")
+    if args.batch_file:
+        try:
+            with (contextlib.nullcontext(sys.stdin) if args.batch_file == '-'
+                  else open(args.batch_file, encoding='utf-8')) as f:
+                args.batch += [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+        except OSError as e:
+            parser.error(f"cannot read --batch-file: {e}")
+        if not args.batch:
+            parser.error(f"--batch-file {args.batch_file} lists no roots")
+    if args.batch and (args.watch or args.delta_from):
+        parser.error("--batch forges each root once; run --watch and --delta-from one project at a time")
+    if args.batch_workers < 1:
+        parser.error("--batch-workers must be at least 1")
+    if args.embed:
+        args.embed_binaries = True
+    else:
+        args.embed = list(EMBED_PATTERNS)
+    return args
+
+def main(argv=None):
     """Execute the Royal Cartography Ritual."""
+    args = parse_args(argv)
+    # Instrumentation stays off (None) unless a report was asked for
+    profile = es_manifest.RunProfile(args.profile_top) if args.profile or args.metrics else None
+
     print("=" * 60)
     print("ROYAL PROJECT CARTOGRAPHER & SCRIBE")
     print("Dual Pimpinator Sovereign Utility v1.1 - PIMP-TIGHT EXCLUSION")
     print("=" * 60)
 
-    # Check document dependencies
-    docx_support = check_document_dependencies()
+    # Probe the document extractors once; nothing heavy is imported until a document turns up
+    extraction_cache = None
+    if args.extraction_cache_size:
+        try:
+            extraction_cache = es_manifest.ExtractionCache(EXTRACTION_CACHE_DIR, args.extraction_cache_size)
+        except OSError as e:
+            print(f"⚠️  Extraction cache unavailable ({e}) - documents will be extracted afresh")
+    extractors = DocumentExtractors(timeout=args.extract_timeout, cache=extraction_cache, profile=profile)
+    check_document_dependencies(extractors.available)
     print()
 
     # Display supported formats
     display_supported_formats()
 
+    if args.batch:
+        try:
+            run_batch(args, extractors.available, profile)
+        finally:
+            extractors.close()
+        return
+
     # Convert to absolute path for clarity in output
     project_root = os.path.abspath(PROJECT_ROOT)
-    output_file = os.path.join(project_root, OUTPUT_FILENAME)
+    output_file = manifest_path(project_root, args)
 
     print(f"Project Root: {project_root}")
     print(f"Output File: {output_file}")
-    print(f"Excluded Items: {EXCLUDED_ITEMS}")
+    print_settings(args, output_file)
+    if args.delta_from:
+        if os.path.realpath(args.delta_from) == os.path.realpath(output_file):
+            print("❌ --delta-from must name a copy of an earlier manifest, not the one being forged")
+            return
+        print(f"Delta From: {args.delta_from}")
     print()
 
-    # Gather the project structure
-    project_data = gather_project_structure(project_root, EXCLUDED_ITEMS)
+    if args.watch:
+        try:
+            watch_project(project_root, output_file, args, extractors, profile)
+        finally:
+            extractors.close()
+        if profile is not None:
+            if args.profile:
+                print_profile(profile.report())
+            if args.metrics:
+                profile.write_json(args.metrics)
+        return
 
-    print(f"📊 Survey Complete: Found {len(project_data)} files to document")
+    try:
+        generate_project(project_root, args, extractors, profile)
+    finally:
+        extractors.close()
 
-    # Count by type for pimp-tight reporting
-    text_files = sum(1 for f in project_data if not f['is_binary'])
-    binary_files = sum(1 for f in project_data if f['is_binary'])
-    print(f"   Text Files: {text_files}, Binary Files: {binary_files}")
+    if extraction_cache is not None and extraction_cache.hits + extraction_cache.misses:
+        print(f"   Extraction Cache: {extraction_cache.hits} hits, {extraction_cache.misses} misses")
+    if extractors.disabled:
+        print(f"   Disabled Extractors: {', '.join(sorted(extractors.disabled))}")
+    if args.delta_from:
+        forge_delta(args.delta_from, output_file, args.compress)
 
-    # Generate the established source file
-    generate_established_source(project_data, output_file)
+    if profile is not None:
+        if extraction_cache is not None:
+            profile.count('extraction_cache_hits', extraction_cache.hits)
+            profile.count('extraction_cache_misses', extraction_cache.misses)
+        if args.profile:
+            print_profile(profile.report())
+        if args.metrics:
+            profile.write_json(args.metrics)
+            print(f"📈 Metrics saved to {args.metrics}")
 
     print(f"\n⚜️  The Royal Archive is ready at: {output_file}")
     print("The Pimpire's ground truth is now preserved with pimp-tight fidelity!")
@@ -1,82 +1,95 @@
 #!/usr/bin/env python3
-import os
+import es_manifest
 
-def main():
-    """Generate site map."""
+OUTPUT_FILENAME = 'site-map.txt'
+
+# Directories to skip entirely (don't even go into them)
+SKIP_DIRS = {'node_modules', '.git', 'venv'}
+
+# File name patterns to exclude
+EXCLUDE_PATTERNS = ['site-map', 'established-source', 'gen-es-deb', 'gen-sm-deb', 'purify-es-deb.py', 'restore-es-uni.py', 'delta-es-uni.py', 'es_manifest']
+
+# Groups in the order they should appear
+GROUP_ORDER = [
+    '__pycache__',
+    'backups',
+    'examples',
+    'iago_sovereign_memory.egg-info',
+    'scripts',
+    'tests'
+]
+
+# Threads listing directories (1 = serial). Worth raising on network
+# filesystems and very wide trees, where the walk waits on the filesystem.
+WALK_JOBS = 1
 
-    # Directories to skip entirely (don't even go into them)
-    skip_dirs = {'node_modules', '.git', 'venv'}
-
-    # File name patterns to exclude
-    exclude_patterns = ['site-map', 'established-source', 'gen-es-deb', 'gen-sm-deb', 'purify-es-deb.py', 'restore-es-uni.py']
-
-    # Groups in the order they should appear
-    group_order = [
-        '__pycache__',
-        'backups',
-        'examples',
-        'iago_sovereign_memory.egg-info',
-        'scripts',
-        'tests'
-    ]
-
-    # Collect all files
-    files = []
-    for root, dirs, filenames in os.walk('.'):
-        # Skip unwanted directories
-        dirs[:] = [d for d in dirs if d not in skip_dirs]
-
-        for fname in filenames:
-            # Skip excluded patterns
-            if any(p in fname for p in exclude_patterns):
-                continue
-
-            # Create full path
-            path = os.path.join(root, fname)
-            if not path.startswith('./'):
-                path = './' + path.lstrip('./')
-            files.append(path)
-
-    # Sort case-insensitively
-    files.sort(key=str.lower)
+# The rules below are shared with gen-es-deb.py --site-map, which maps the
+# tree during the same traversal that builds the manifest.
+
+def enter_dir(name):
+    """Whether the walk should descend into a directory with this name."""
+    return name not in SKIP_DIRS
+
+def map_entry(rel_path, name, is_dir):
+    """The site-map line for a walked path, or None to leave it out."""
+    if is_dir or any(p in name for p in EXCLUDE_PATTERNS):
+        return None
+    return './' + rel_path
+
+def write_site_map(files, output_path=OUTPUT_FILENAME):
+    """Sort the mapped files once, group them and write the numbered site map; returns the count."""
+    # Sort case-insensitively (names differing only in case in their exact order, so the
+    # walk's order never shows) - grouping below keeps this order, so no group is sorted again
+    files.sort(key=lambda f: (f.lower(), f))
 
     # Categorize
-    groups = {g: [] for g in group_order}
+    groups = {g: [] for g in GROUP_ORDER}
     other_dirs = []
     root_files = []
 
     for f in files:
-        parts = f.split('/')
+        parts = f.split('/', 2)
         if len(parts) == 2:  # Root file (./file.txt)
             root_files.append(f)
         else:
             dir_name = parts[1]  # Directory after ./
-            if dir_name in group_order:
+            if dir_name in groups:
                 groups[dir_name].append(f)
             else:
                 other_dirs.append(f)
 
     # Write output
-    with open('site-map.txt', 'w') as out:
+    with open(output_path, 'w') as out:
         count = 1
 
-        # Write files in specific directories (in order)
-        for dir_name in group_order:
-            for f in sorted(groups[dir_name], key=str.lower):
+        # Write files in specific directories (in order), then other directories, then root files
+        for section in [*groups.values(), other_dirs, root_files]:
+            for f in section:
                 out.write(f"{count:03d} {f}\n")
                 count += 1
 
-        # Write other directories
-        for f in sorted(other_dirs, key=str.lower):
-            out.write(f"{count:03d} {f}\n")
-            count += 1
+    return count - 1
 
-        # Write root files
-        for f in sorted(root_files, key=str.lower):
-            out.write(f"{count:03d} {f}\n")
-            count += 1
+def main():
+    """Generate site map."""
 
-    print(f"✓ Generated site-map.txt with {count-1} files")
+    def collect(walk):
+        files = []
+        for rel_path, entry, is_dir, _ in walk:
+            line = map_entry(rel_path, entry.name, is_dir)
+            if line is not None:
+                files.append(line)
+        return files
+
+    # Collect all files (over WALK_JOBS threads, each listing whichever directory is next)
+    enter = lambda rel, entry, tag: enter_dir(entry.name)
+    if WALK_JOBS > 1:
+        files = [f for part in es_manifest.walk_tree_parallel('.', collect, enter, True, WALK_JOBS) for f in part]
+    else:
+        files = collect(es_manifest.walk_tree('.', enter))
+
+    count = write_site_map(files)
+    print(f"✓ Generated site-map.txt with {count} files")
 
 if __name__ == '__main__':
     main()
@@ -4,43 +4,52 @@
 import os
 import re
 
-def purify_relative_manifest(filename="established-source.txt"):
+import es_manifest
+
+# The package.json script line that shipped without its trailing comma
+DEV_ALL_LINE = rb'"dev:all": "concurrently \"npm run dev\" \"npm run dev:backend\""'
+
+# ===== Purification rules =====
+# (scope, pattern, replacement). Scope 'path' touches only path lines, 'content'
+# every file body, and a file name pattern (e.g. 'package.json') only the bodies
+# of matching entries. Patterns are bytes regexes without groups; all the rules
+# for a scope run as one compiled matcher in a single pass over the manifest.
+PURIFICATION_RULES = [
+    # RITUAL 1: Apostrophe & Slash Exorcism
+    ('content', rb"/'s", b"'s"),
+    # RITUAL 2: JSON Comma Restoration - after the closing quote, not inside the string
+    ('package.json', re.escape(DEV_ALL_LINE) + rb'(?!,)', DEV_ALL_LINE + b','),
+    # RITUAL 3: Path Consistency (Linux version) - convert Windows backslashes,
+    # then ensure a consistent ./ prefix
+    ('path', rb'\\\.\\', b'./'),
+    ('path', rb'\\\./', b'./'),
+    ('path', rb'^\.\\', b'./'),
+]
+
+def purify_relative_manifest(filename=None):
+    # Plain or compressed; a compressed manifest is purified into the same codec
+    filename = filename or es_manifest.locate_manifest("established-source.txt")
     print(f"⚜️ Initiating Relative Alchemical Purification on {filename}...")
 
     if not os.path.exists(filename):
         print(f"❌ Error: {filename} not found! The Scroll is missing.")
         return
 
-    with open(filename, 'r', encoding='utf-8', errors='replace') as f:
-        content = f.read()
-
-    # --- RITUAL 1: Apostrophe & Slash Exorcism ---
     print("🪄 Exorcising traitorous slashes from JavaScript strings...")
-    content = content.replace("/'s", "'s")
-
-    # --- RITUAL 2: JSON Comma Restoration ---
     print("🪄 Sanitizing package.json syntax for the OS Guardian...")
-    old_json_line = '"dev:all": "concurrently \\"npm run dev\\" \\"npm run dev:backend\\""'
-    new_json_line = '"dev:all": "concurrently \\"npm run dev\\" \\"npm run dev:backend\\","'
-
-    if old_json_line in content and f"{old_json_line}," not in content:
-        content = content.replace(old_json_line, new_json_line)
-
-    # --- RITUAL 3: Path Consistency (Linux version) ---
-    # On Linux, ensure consistent forward slashes
     print("🪄 Harmonizing path separators for Linux...")
-    # Convert any Windows backslashes to forward slashes
-    content = content.replace('\\.\\', './')
-    content = content.replace('\\./', './')
-
-    # Ensure consistent ./ prefix
-    content = re.sub(r'(\n)\.\\', r'\1./', content)
 
+    # One streaming pass: every ritual is applied while the manifest is copied
     output_name = f"PURIFIED-{filename}"
-    with open(output_name, 'w', encoding='utf-8') as f:
-        f.write(content)
-
-    print(f"⚜️ VICTORY! Purified Relative Manifest forged: {output_name}")
+    if es_manifest.read_shard_table(filename) is not None:
+        # A shard table: each shard is purified on its own into a new table
+        fixes = es_manifest.rewrite_shards(
+            filename, output_name, lambda scan, out: es_manifest.rewrite_manifest(scan, out, PURIFICATION_RULES))
+    else:
+        with es_manifest.ManifestScanner(filename) as scan, es_manifest.ManifestWriter(output_name) as out:
+            fixes = es_manifest.rewrite_manifest(scan, out, PURIFICATION_RULES)
+
+    print(f"⚜️ VICTORY! Purified Relative Manifest forged: {output_name} ({fixes} fixes)")
     print("The Pimpire's ground truth is now purified and Linux-ready.")
 
 if __name__ == "__main__":
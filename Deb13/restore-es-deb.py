@@ -2,11 +2,116 @@
 # [file name]: restore-es-deb.py
 # [directory]: ./ (Run in the folder where you want to restore)
 import os
-import sys
+import argparse
+import functools
 
-def restore_pimpire_standard():
-    # Priority: Check for Purified version first
-    es_filename = "PURIFIED-established-source.txt" if os.path.exists("PURIFIED-established-source.txt") else "established-source.txt"
+import es_manifest
+
+BEGIN = es_manifest.MARKER_BEGIN
+END = es_manifest.MARKER_END
+
+# Writer threads for restoring files (override with --jobs). With more than one,
+# per-file reporting gives way to a summary and the optional --progress counter,
+# and the shards of a sharded manifest are restored that many at a time, each in
+# a worker process of its own.
+RESTORE_JOBS = 1
+
+# Re-restoring over an existing tree leaves every file that already holds exactly
+# its entry untouched - no rewrite, no new mtime - after comparing its size and
+# then its content (disable with --rewrite-unchanged). Files that do change are
+# still written to a temp file and renamed into place, never truncated.
+SKIP_UNCHANGED = True
+
+def restore_indexed(es_filename, paths, writer, dry_run=False):
+    """Restore only the requested paths, seeking straight to them via the .idx sidecar.
+
+    Duplicates written as references are restored from the entry they name,
+    which is looked up in the index too, and embedded binaries are decoded
+    back to their exact bytes. Returns the number of files restored,
+    or None when the manifest has no usable index and the caller has to scan
+    it instead.
+    """
+    entries = es_manifest.find_indexed_entries(es_filename, paths)
+    if entries is None:
+        return None
+
+    restored_count = 0
+    keys = list(dict.fromkeys(es_manifest.index_key(p) for p in paths))
+    if not dry_run:
+        writer.prepare_dirs(k for k in keys if k in entries and entries[k][2] != es_manifest.ENTRY_BINARY)
+    with es_manifest.ManifestScanner(es_filename, lazy=True) as scan:
+        try:
+            sources = es_manifest.resolve_indexed_references(es_filename, scan, entries, keys)
+        except ValueError:
+            return None
+
+        for key in keys:
+            if key not in entries:
+                print(f"❓ Not in manifest: {key}")
+                continue
+            if entries[key][2] == es_manifest.ENTRY_BINARY:
+                print(f"⏭️  Binary placeholder, nothing to restore: {key}")
+                continue
+            if entries[key][2] == es_manifest.ENTRY_EMBEDDED:
+                offset, length, _ = entries[key]
+                try:
+                    start, end = scan.indexed_embedded(offset, length, key)
+                except ValueError:
+                    return None
+                if dry_run:
+                    print(f"DRY-RUN: would restore binary: {key}")
+                    restored_count += 1
+                elif restore_embedded(key, scan, start, end, writer):
+                    restored_count += 1
+                continue
+            source = sources.get(key, key)
+            if source not in entries or entries[source][2] != es_manifest.ENTRY_TEXT:
+                print(f"❓ Duplicate of an entry not in manifest: {key} -> {source}")
+                continue
+            offset, length, _ = entries[source]
+            try:
+                start, end = scan.indexed_body(offset, length, source)
+            except ValueError:
+                return None
+            if dry_run:
+                print(f"DRY-RUN: would restore: {key}")
+                restored_count += 1
+                continue
+            report_restored(key, writer.restore(key, scan, start, end), writer)
+            restored_count += 1
+    return restored_count
+
+def report_restored(path, written, writer, what=""):
+    """Report one restored file, unless the writer is summarising instead."""
+    if writer.parallel:
+        return
+    if written:
+        print(f"✅ Restored{what}: {path}")
+    else:
+        print(f"💤 Unchanged{what}, left alone: {path}")
+
+def restore_embedded(path, scan, start, end, writer):
+    """Decode one embedded binary to path; returns False when it is damaged and was skipped."""
+    try:
+        written = writer.restore_embedded(path, scan, start, end)
+    except ValueError as e:
+        print(f"❌ Embedded binary not restored: {path} ({e})")
+        return False
+    report_restored(path, written, writer, " binary")
+    return True
+
+def _path_from_line(stripped):
+    p = stripped.replace('\\', '/')
+    if p.startswith('./'):
+        p = p[2:]
+    return p
+
+def restore_pimpire_standard(paths=None, dry_run=False, jobs=RESTORE_JOBS, progress=False,
+                             skip_unchanged=SKIP_UNCHANGED):
+    # Priority: Check for Purified version first (plain or compressed)
+    es_filename = es_manifest.locate_manifest("PURIFIED-established-source.txt")
+    if not os.path.exists(es_filename):
+        es_filename = es_manifest.locate_manifest("established-source.txt")
 
     print(f"⚜️ Shadow Scribe restoring from: {es_filename}")
 
@@ -14,99 +119,110 @@ def restore_pimpire_standard():
         print("❌ Error: Manifest not found!")
         return
 
-    with open(es_filename, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+    shards = es_manifest.read_shard_table(es_filename)
+    writer = es_manifest.RestoreWriter(jobs, progress, keep_unchanged=skip_unchanged)
+    try:
+        if shards is not None:
+            print(f"🧩 Sharded manifest: {len(shards)} shards")
+            restored_count = restore_sharded(shards, paths, dry_run, jobs, writer)
+        else:
+            restored_count = _restore_from(es_filename, paths, dry_run, writer)
+    finally:
+        writer.close()
+
+    print(f"\n⚜️ VICTORY! {restored_count} artifacts resurrected.")
+    if not dry_run:
+        print(f"   ✍️  {writer.written} written, 💤 {writer.skipped} unchanged and left alone")
+
+def restore_sharded(shards, paths, dry_run, jobs, writer):
+    """Restore from the shards a shard table lists, jobs shards at a time.
+
+    Requested paths are looked up in each shard's index first, so only the
+    shards holding them are opened. Returns the number of files restored.
+    """
+    plan, missing = es_manifest.plan_shard_restore(shards, paths)
+    for key in missing:
+        print(f"❓ Not in manifest: {key}")
 
-    collecting = False
-    file_content = []
     restored_count = 0
-    current_file_path = None
-
-    dry_run = '--dry-run' in sys.argv
-
-    i = 0
-    n = len(lines)
-    while i < n:
-        line = lines[i]
-        stripped = line.strip()
-
-        # Path line like ./path or .\path
-        if not collecting and (stripped.startswith('.\\') or stripped.startswith('./')):
-            p = stripped.replace('\\', '/')
-            if p.startswith('./'):
-                p = p[2:]
-            current_file_path = p
-            i += 1
-            continue
-
-        # A file-block opener. Manifests sometimes put a path between two begin markers.
-        if not collecting and stripped == '[file content begin]':
-            # look ahead for a path line or a nested begin marker
-            j = i + 1
-            # skip blank lines
-            while j < n and lines[j].strip() == '':
-                j += 1
-            if j < n:
-                nextstr = lines[j].strip()
-                if nextstr.startswith('./') or nextstr.startswith('.\\'):
-                    # path follows this begin marker
-                    p = nextstr.replace('\\', '/')
-                    if p.startswith('./'):
-                        p = p[2:]
-                    current_file_path = p
-                    # advance i to the line after the path
-                    i = j + 1
-                    # If another begin marker follows, consume it and start collecting afterwards
-                    if i < n and lines[i].strip() == '[file content begin]':
-                        collecting = True
-                        file_content = []
-                        i += 1
-                        continue
-                    # else continue loop to find explicit content begin or start collecting immediately
-                    collecting = True
-                    file_content = []
-                    continue
-                elif nextstr == '[file content begin]':
-                    # nested begin — consume both and start collecting
-                    collecting = True
-                    file_content = []
-                    i = j + 1
+    restore = functools.partial(_restore_shard, dry_run=dry_run)
+    for shard, count in es_manifest.restore_shards(plan, restore, jobs, writer):
+        if jobs > 1:
+            print(f"📦 {os.path.basename(shard['path'])}: {count} artifacts")
+        restored_count += count
+    return restored_count
+
+def _restore_shard(es_filename, paths, writer, dry_run=False):
+    # Module level, so worker processes can be handed it
+    return _restore_from(es_filename, paths, dry_run, writer)
+
+def _restore_from(es_filename, paths, dry_run, writer):
+    # Selective restore: seek straight to the requested entries when an index exists
+    wanted = None
+    if paths:
+        restored_count = restore_indexed(es_filename, paths, writer, dry_run)
+        if restored_count is not None:
+            return restored_count
+        print("🔎 No usable index for this manifest - scanning it in full")
+        wanted = {es_manifest.index_key(p) for p in paths}
+
+    restored_count = 0
+
+    # Walk the mapped manifest entry by entry; each body is found with a
+    # bytes-level search for its end marker and copied straight to disk.
+    # A manifest cut off mid-entry leaves nothing half-written behind.
+    # Body spans are remembered by path so duplicates written as references
+    # can be copied from the entry they name. Embedded binaries are decoded.
+    spans = {}
+    with es_manifest.ManifestScanner(es_filename) as scan:
+        for kind, start, end, path_line in es_manifest.iter_entries(scan):
+            if kind not in ('body', 'ref', 'embed') or not path_line:
+                continue
+            current_file_path = _path_from_line(path_line)
+            if kind == 'embed':
+                if not current_file_path or (wanted is not None and current_file_path not in wanted):
                     continue
-            # fallback: start collecting from next line
-            collecting = True
-            file_content = []
-            i += 1
-            continue
-
-        # End of content for current file
-        if collecting and stripped == '[file content end]':
-            if current_file_path:
-                dirpath = os.path.dirname(current_file_path)
-                if dirpath and not dry_run:
-                    os.makedirs(dirpath, exist_ok=True)
                 if dry_run:
-                    print(f"DRY-RUN: would restore: {current_file_path}")
-                else:
-                    with open(current_file_path, 'w', encoding='utf-8') as f_out:
-                        f_out.writelines(file_content)
-                    print(f"✅ Restored: {current_file_path}")
-                restored_count += 1
-            collecting = False
-            current_file_path = None
-            file_content = []
-            i += 1
-            continue
-
-        # Normal collection of content lines
-        if collecting:
-            file_content.append(line)
-            i += 1
-            continue
+                    print(f"DRY-RUN: would restore binary: {current_file_path}")
+                    restored_count += 1
+                elif restore_embedded(current_file_path, scan, start, end, writer):
+                    restored_count += 1
+                continue
+            if kind == 'body':
+                spans[es_manifest.index_key(path_line)] = (start, end)
+            else:
+                target = es_manifest.reference_target(scan.text(start, end).strip())
+                span = spans.get(es_manifest.index_key(target))
+                if span is None:
+                    print(f"❓ Duplicate of an entry not in manifest: {current_file_path} -> {target}")
+                    continue
+                start, end = span
+            if not current_file_path or (wanted is not None and current_file_path not in wanted):
+                continue
+            if dry_run:
+                print(f"DRY-RUN: would restore: {current_file_path}")
+            else:
+                report_restored(current_file_path, writer.restore(current_file_path, scan, start, end), writer)
+            restored_count += 1
 
-        # Nothing matched; move on
-        i += 1
+    return restored_count
 
-    print(f"\n⚜️ VICTORY! {restored_count} artifacts resurrected.")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Restore a project from an established-source manifest.")
+    parser.add_argument('paths', nargs='*',
+                        help="restore only these relative paths (uses the .idx index when available)")
+    parser.add_argument('--dry-run', action='store_true', help="report what would be restored without writing")
+    parser.add_argument('-j', '--jobs', type=int, default=RESTORE_JOBS,
+                        help="writer threads, or shards restored at once for a sharded manifest; above 1 prints "
+                             f"a summary instead of every file (default: {RESTORE_JOBS})")
+    parser.add_argument('--progress', action='store_true', help="show a running count of restored files")
+    parser.add_argument('--rewrite-unchanged', dest='skip_unchanged', action='store_false', default=SKIP_UNCHANGED,
+                        help="rewrite every file, even those that already hold exactly their entry")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
 
 if __name__ == "__main__":
-    restore_pimpire_standard()
+    args = parse_args()
+    restore_pimpire_standard(args.paths, args.dry_run, args.jobs, args.progress, args.skip_unchanged)
@@ -0,0 +1,128 @@
+# [file name]: delta-es-uni.py
+# [directory]: ./ (Run in the restored folder to patch it, or beside the manifests)
+import os
+import argparse
+
+import es_manifest
+
+DELTA_OUTPUT = es_manifest.DELTA_FILENAME  # Default delta file (add .gz, .bz2 or .xz to compress it)
+RESTORE_JOBS = 1  # Writer threads (--jobs) when patching a restored tree
+SKIP_UNCHANGED = True  # Leave files that already hold their new entry untouched, mtime and all (--rewrite-unchanged)
+
+def forge_delta(old_manifest, new_manifest, delta_path):
+    """Write the delta carrying old_manifest to new_manifest."""
+    print(f"⚜️ Delta Scribe comparing {old_manifest} -> {new_manifest}")
+    try:
+        added, changed, removed = es_manifest.write_delta(old_manifest, new_manifest, delta_path)
+    except (OSError, ValueError) as e:
+        print(f"❌ Error: {e}")
+        return
+    size = es_manifest.format_size(os.path.getsize(delta_path))
+    print(f"⚜️ VICTORY! Delta forged at {delta_path} ({size}): {added} added, {changed} changed, {removed} removed.")
+
+def patch_manifest(delta_path, manifest_path):
+    """Carry the manifest at manifest_path forward in place."""
+    print(f"⚜️ Delta Scribe patching manifest: {manifest_path}")
+    try:
+        added, changed, removed = es_manifest.patch_manifest(manifest_path, delta_path)
+    except (OSError, ValueError) as e:
+        print(f"❌ Error: {e}")
+        return
+    print(f"⚜️ VICTORY! Manifest carried forward: {added} added, {changed} changed, {removed} removed.")
+
+def patch_tree(delta_path, jobs=RESTORE_JOBS, progress=False, skip_unchanged=SKIP_UNCHANGED):
+    """Bring the restored tree in the current folder up to the delta's target.
+
+    Only the entries the delta carries are touched: removed files are deleted
+    (with any folders that leaves empty), then added and changed ones are
+    restored exactly as restore-es-uni.py would restore them."""
+    print(f"⚜️ Delta Scribe patching the tree from: {delta_path}")
+    if not os.path.exists(delta_path):
+        print("❌ Error: Delta not found!")
+        return
+    with es_manifest.ManifestScanner(delta_path) as scan:
+        try:
+            _, _, changes = es_manifest.read_delta(scan)
+        except ValueError as e:
+            print(f"❌ Error: {e}")
+            return
+        removed = sum(remove_file(key) for key, change in changes.items()
+                      if change[0] == es_manifest.DELTA_REMOVED)
+        restored = 0
+        writer = es_manifest.RestoreWriter(jobs, progress, keep_unchanged=skip_unchanged)
+        try:
+            writer.prepare_dirs(key for key, change in changes.items()
+                                if change[0] in (es_manifest.ENTRY_TEXT, es_manifest.ENTRY_EMBEDDED))
+            for key, (kind, _, _, span) in changes.items():
+                if kind == es_manifest.ENTRY_TEXT:
+                    report_restored(key, writer.restore(key, scan, *span), writer)
+                    restored += 1
+                elif kind == es_manifest.ENTRY_EMBEDDED:
+                    restored += restore_embedded(key, scan, *span, writer)
+                elif kind == es_manifest.ENTRY_BINARY:
+                    print(f"⏭️ Binary placeholder, nothing to restore: {key}")
+        finally:
+            writer.close()
+    print(f"\n⚜️ VICTORY! {restored} artifacts resurrected, {removed} banished.")
+    print(f"   ✍️ {writer.written} written, 💤 {writer.skipped} unchanged and left alone")
+
+def report_restored(path, written, writer, what=""):
+    """Per-file report, when the writer is not summarising."""
+    if writer.parallel:
+        return
+    if written:
+        print(f"✅ Restored{what}: {path}")
+    else:
+        print(f"💤 Unchanged{what}, left alone: {path}")
+
+def restore_embedded(path, scan, start, end, writer):
+    """Decode one embedded binary to path; a damaged one is reported and skipped (returns False)."""
+    try:
+        written = writer.restore_embedded(path, scan, start, end)
+    except ValueError as e:
+        print(f"❌ Embedded binary not restored: {path} ({e})")
+        return False
+    report_restored(path, written, writer, " binary")
+    return True
+
+def remove_file(path):
+    """Delete a file the delta removes, then the folders that leaves empty; True if it was there."""
+    if os.path.isabs(path) or '..' in path.split('/'):
+        print(f"⛔ Refusing to remove a path outside the tree: {path}")
+        return False
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        print(f"❓ Already gone: {path}")
+        return False
+    print(f"🗑️ Removed: {path}")
+    parent = os.path.dirname(path)
+    if parent:
+        try:
+            os.removedirs(parent)
+        except OSError:
+            pass  # Not empty - something else still lives there
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Forge and apply deltas between established-source manifest generations.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    diff = commands.add_parser('diff', help="write the delta that carries OLD to NEW (both need their .idx index)")
+    diff.add_argument('old', help="the manifest (or shard table) downstream already has")
+    diff.add_argument('new', help="the freshly generated manifest (or shard table)")
+    diff.add_argument('-o', '--output', default=DELTA_OUTPUT, help=f"delta file to write (default {DELTA_OUTPUT})")
+    apply = commands.add_parser('apply', help="patch the restored tree in the current folder, or a manifest")
+    apply.add_argument('delta', nargs='?', default=DELTA_OUTPUT, help=f"delta file to apply (default {DELTA_OUTPUT})")
+    apply.add_argument('--manifest', metavar='PATH',
+                       help="patch this manifest (with its .idx) in place instead of the tree")
+    apply.add_argument('-j', '--jobs', type=int, default=RESTORE_JOBS, help="writer threads when patching the tree")
+    apply.add_argument('--progress', action='store_true', help="show a running count of restored files")
+    apply.add_argument('--rewrite-unchanged', dest='skip_unchanged', action='store_false', default=SKIP_UNCHANGED,
+                       help="rewrite every file the delta carries, even those that already hold it")
+    args = parser.parse_args()
+    if args.command == 'diff':
+        forge_delta(args.old, args.new, args.output)
+    elif args.manifest:
+        patch_manifest(es_manifest.locate_manifest(args.delta), args.manifest)
+    else:
+        patch_tree(es_manifest.locate_manifest(args.delta), max(1, args.jobs), args.progress, args.skip_unchanged)
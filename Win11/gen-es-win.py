@@ -1,11 +1,46 @@
 # [file name]: gen-es.py
 # [directory]: ./ (Run in the project root)
 import os
+import re
+import json
+import time
 import fnmatch
+import hashlib
+import functools
+import argparse
+import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import es_manifest
 
 # ===== CONFIGURATION: The Royal Edicts =====
 OUTPUT_FILENAME = "established-source.txt"
 PROJECT_ROOT = "."
+READ_JOBS = min(32, (os.cpu_count() or 1) + 4)  # Reader threads (--jobs); 1 = serial
+USE_CACHE = True  # Reuse unchanged entries via established-source.txt.cache (--no-cache)
+WRITE_INDEX = True  # Byte-offset index established-source.txt.idx for random access (--no-index)
+TEXT_FALLBACK_ENCODING = 'latin-1'  # Text that is not UTF-8 (cp1252 sources) is kept, decoded with this as on Debian
+MAX_FILE_BYTES = 16 << 20  # Bigger files become an [OVERSIZED FILE] placeholder (--max-file-size; 0 = no cap)
+DEDUPLICATE = False  # Repeated content becomes a reference to its first entry (--dedup; needs this release's restorers)
+WRITE_DIGESTS = False  # Record each text entry's sha256 after its path (--digests)
+COMPRESSION = None  # None, 'gzip', 'bz2' or 'xz': write established-source.txt.gz etc. in frames (--compress)
+WRITE_SITE_MAP = False  # Also write site-map.txt from the same walk, by gen-sm-win.py's rules (--site-map)
+SITE_MAP_SCRIPT = "gen-sm-win.py"
+SHARD_BYTES = 0  # Split into shards of about this size listed in a shard table (--shard-size; 0 = one manifest)
+SHARD_ENTRIES = 0  # ... or of about this many entries (--shard-entries)
+SHARD_WRITERS = min(4, os.cpu_count() or 1)  # Threads writing (and compressing) shards at once
+EMBED_BINARIES = False  # Write binaries in full as encoded lines instead of placeholders (--embed-binaries)
+EMBED_ENCODING = 'base64'  # ... or the denser, slower 'base85' (--embed-encoding)
+EMBED_MAX_BYTES = 64 << 20  # Larger binaries keep their placeholder (--embed-max-size; 0 = no cap)
+EMBED_PATTERNS = []  # Only embed binaries whose name or path matches one of these globs (--embed; empty = any)
+HONOR_GITIGNORE = False  # Also leave out (and never walk into) what .gitignore, .ignore and .git/info/exclude ignore (--gitignore)
+DELTA_BASE = None  # Also write established-source.txt.delta from this earlier manifest copy to the new one (--delta-from)
+
+# Per-file caps overriding MAX_FILE_BYTES, matched on the file name (first match wins)
+FILE_SIZE_LIMITS = {
+    # '*.csv': 64 << 20,
+}
 
 EXCLUDED_ITEMS = {
     'node_modules', '.git', '__pycache__', '*.pyc', '.DS_Store', 
@@ -13,6 +48,7 @@ EXCLUDED_ITEMS = {
     '.env', '*.log', 'dist', 'build', '.continue', 'data', '*.png',
     '*.jpg', '*.jpeg', '*.gif', '*.ico', '*.svg', 'gen-es.py',
     'gen-sm.py', 'established-source.txt', 'site-map.txt',
+    'established-source.txt.*', 'es_manifest.py',
 }
 
 WHITELISTED_FILES = {
@@ -30,52 +66,425 @@ def is_excluded(path, excluded_set):
             return True
     return False
 
-def main():
-    current_dir = os.path.basename(os.getcwd())
-    print(f"⚜️ Mapping territory with Relative Sovereignty: {current_dir}")
-    project_data = []
-    
-    for root, dirs, files in os.walk(PROJECT_ROOT):
+def compile_exclusions(excluded_set, whitelisted_files=WHITELISTED_FILES):
+    """Build a one-shot matcher equivalent to is_excluded: name set, extension set, one glob regex."""
+    names, extensions, globs = set(), set(), []
+    for pattern in excluded_set:
+        if not any(c in pattern for c in '*?['):
+            names.add(os.path.normcase(pattern))
+        elif pattern.startswith('*.') and not any(c in pattern[2:] for c in '*?[.'):
+            extensions.add(os.path.normcase(pattern[1:]))
+        else:
+            globs.append(pattern)
+    glob_re = re.compile('|'.join(fnmatch.translate(os.path.normcase(g)) for g in globs)) if globs else None
+    whitelist = frozenset(whitelisted_files)
+
+    def matcher(path):
+        basename = os.path.basename(path)
+        if basename in whitelist:
+            return False
+        name = os.path.normcase(basename)
+        full = os.path.normcase(path.replace('\\', '/'))
+        if name in names or full in names:
+            return True
+        dot = name.rfind('.')
+        if dot >= 0 and name[dot:] in extensions:
+            return True
+        return bool(glob_re and (glob_re.match(name) or glob_re.match(full)))
+
+    return matcher
+
+# Traversal tags: which outputs still want a directory's contents
+_MANIFEST = 1
+_SITE_MAP = 2
+
+def gather_relative_paths(site_map=None, site_entries=None, gitignore=False):
+    """Walk the territory and return sorted (rel_path, file_path) pairs - paths only, no content.
+
+    With site_map (the rules of gen-sm-win.py), the same walk also collects
+    the site map's lines into site_entries; a directory is entered while
+    either output still wants it. With gitignore, what the .gitignore and
+    .ignore files ignore is left out of the manifest, level by level.
+    """
+    project_paths = []
+    excluded = compile_exclusions(EXCLUDED_ITEMS)
+    prefix = os.path.join(PROJECT_ROOT, '')
+    levels = {'': es_manifest.IgnoreRules.for_root(PROJECT_ROOT)} if gitignore else None
+    ignored_dirs = ignored_files = 0
+
+    def enter(rel_dir, entry, wanted):
         # Prevent traversing into excluded dependency crypts
-        dirs[:] = [d for d in dirs if not is_excluded(os.path.join(root, d), EXCLUDED_ITEMS)]
-        
-        for file in files:
-            file_path = os.path.join(root, file)
-            # FORCE RELATIVE PATH: Establishing the root as "."
-            rel_path = os.path.relpath(file_path, PROJECT_ROOT)
-            if not rel_path.startswith('.'):
-                rel_path = os.path.join(".", rel_path)
-            
-            if is_excluded(rel_path, EXCLUDED_ITEMS):
-                continue
-            
-            try:
-                # Using 'replace' errors to handle any weird Windows encoding snooganly
-                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                    content = f.read()
-                project_data.append({
-                    "rel_path": rel_path, 
-                    "content": content
-                })
-            except Exception as e:
-                print(f"⚠️ Skipping {file}: {e}")
+        nonlocal ignored_dirs
+        keep = 0
+        if wanted & _MANIFEST and not excluded(prefix + rel_dir):
+            rules = levels[rel_dir.rpartition(os.sep)[0]] if levels is not None else None
+            if rules is None:
+                keep |= _MANIFEST
+            elif rules.ignored(rel_dir, True):
+                ignored_dirs += 1
+            else:
+                levels[rel_dir] = rules.child(rel_dir, entry.path)
+                keep |= _MANIFEST
+        if wanted & _SITE_MAP and site_map.enter_dir(entry.name):
+            keep |= _SITE_MAP
+        return keep
+
+    start_tag = _MANIFEST | (_SITE_MAP if site_map is not None else 0)
+    for rel_path, entry, is_dir, wanted in es_manifest.walk_tree(PROJECT_ROOT, enter, start_tag):
+        if wanted & _SITE_MAP:
+            line = site_map.map_entry(rel_path, entry.name, is_dir)
+            if line is not None:
+                site_entries.append(line)
+        if is_dir or not wanted & _MANIFEST:
+            continue
+        if levels is not None and levels[rel_path.rpartition(os.sep)[0]].ignored(rel_path):
+            ignored_files += 1
+            continue
+
+        # FORCE RELATIVE PATH: Establishing the root as "."
+        if not rel_path.startswith('.'):
+            rel_path = prefix + rel_path
+
+        if excluded(rel_path):
+            continue
+
+        project_paths.append((rel_path, entry.path))
+
+    project_paths.sort(key=lambda x: x[0])
+    if levels is not None:
+        print(f"🙈 Ignore files left out {ignored_dirs} directories and {ignored_files} files")
+    return project_paths
+
+def load_site_map_rules():
+    """Load the site-map rules from gen-sm-win.py beside this script (for --site-map)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), SITE_MAP_SCRIPT)
+    spec = importlib.util.spec_from_file_location('gen_sm_win', path)
+    rules = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(rules)
+    return rules
+
+def size_limit_for(file_path, max_bytes=MAX_FILE_BYTES):
+    name = os.path.basename(file_path)
+    for pattern, limit in FILE_SIZE_LIMITS.items():
+        if fnmatch.fnmatch(name, pattern):
+            return limit
+    return max_bytes
+
+def read_project_file(rel_path, file_path, st=None, max_bytes=MAX_FILE_BYTES, embedder=None):
+    try:
+        # Sniff first so .exe/.sqlite never get read in full; a binary signature or NUL bytes
+        # make a placeholder. Non-UTF-8 text (cp1252 sources) is kept via TEXT_FALLBACK_ENCODING.
+        content, skipped = es_manifest.read_text_file(file_path, st, size_limit_for(file_path, max_bytes),
+                                                      TEXT_FALLBACK_ENCODING)
+        if skipped:
+            info = {"rel_path": rel_path, "skipped": skipped, "stat": st}
+            if skipped[0] in ('BINARY', 'OVERSIZED') and embedder is not None:
+                # Embedded binaries are streamed from file_path when their entry is written;
+                # an oversized file is only embedded if its head shows it is binary
+                size = embedder.size_to_embed(file_path, rel_path, st)
+                if size is not None and skipped[0] == 'OVERSIZED':
+                    try:
+                        size = size if es_manifest.sniff_binary(file_path, TEXT_FALLBACK_ENCODING) else None
+                    except OSError:
+                        size = None
+                if size is not None:
+                    info.update(path=file_path, embed=(embedder.encoding, size))
+            return info
+        # Encoded and hashed in the worker; the digest is taken over the \n form on every platform
+        body = content if content.endswith('\n') else content + '\n'
+        data = body.encode('utf-8')
+        return {"rel_path": rel_path, "body": data if os.linesep == '\n' else encode_text(body),
+                "digest": es_manifest.content_digest(data), "stat": st}
+    except Exception as e:
+        return {"rel_path": rel_path, "error": e, "file": os.path.basename(file_path)}
+
+def iter_project_data(project_paths, jobs=1, cache=None, max_bytes=MAX_FILE_BYTES, embedder=None):
+    """Read files (on a thread pool when jobs > 1) but yield them in sorted order, one at a time.
+
+    Files whose stat matches the cache are not opened; their old entry bytes come back as "chunk".
+    A file last written as a reference comes back as its digest and a "reread" callable instead.
+    """
+    pool = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    window = 2 * jobs if pool else 1  # Bounded in-flight results keep memory flat
+    pending = deque()
+
+    def drain(limit):
+        while len(pending) > limit:
+            info = pending.popleft()
+            info = info.result() if isinstance(info, Future) else info
+            if "error" in info:
+                print(f"⚠️ Skipping {info['file']}: {info['error']}")
                 continue
+            yield info
+
+    try:
+        for rel_path, file_path in project_paths:
+            st = None
+            if cache is not None:
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    pass
+                hit = cache.lookup(rel_path, st)
+                if hit is not None:
+                    if hit[1] == es_manifest.ENTRY_REFERENCE:
+                        pending.append({"rel_path": rel_path, "digest": hit[2], "stat": st,
+                                        "reread": functools.partial(read_project_file, rel_path, file_path, st,
+                                                                    max_bytes, embedder)})
+                    else:
+                        pending.append({"rel_path": rel_path, "chunk": hit[0], "kind": hit[1],
+                                        "is_binary": hit[1] != es_manifest.ENTRY_TEXT, "digest": hit[2], "stat": st})
+                    yield from drain(window - 1)
+                    continue
+            if pool is not None:
+                pending.append(pool.submit(read_project_file, rel_path, file_path, st, max_bytes, embedder))
+            else:
+                pending.append(read_project_file(rel_path, file_path, st, max_bytes, embedder))
+            yield from drain(window - 1)
+        yield from drain(0)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+def encode_text(text):
+    # Mirror text-mode newline translation so offsets and cached bytes stay exact
+    if os.linesep != '\n':
+        text = text.replace('\n', os.linesep)
+    return text.encode('utf-8')
+
+def iter_entry_bytes(info, same_as=None, write_digest=WRITE_DIGESTS):
+    """Yield one entry's bytes as written; same_as turns a text entry into a reference to it."""
+    if info.get('embed'):
+        # Streamed from the file in blocks; one that vanished meanwhile keeps its placeholder
+        try:
+            source = open(info['path'], 'rb')
+        except OSError:
+            info['embed'] = None
+        else:
+            with source:
+                yield encode_text(f"\n{info['rel_path']}\n")
+                yield from es_manifest.iter_embedded_bytes(source, info['embed'][0], encode_text("\n"))
+            return
+    # We record only the relative path (e.g., .\README.md)
+    yield encode_text(f"\n{info['rel_path']}\n")
+    if "skipped" in info:
+        # A placeholder saying why - no content block to restore
+        label, reason = info['skipped']
+        yield encode_text(f"[{label} FILE - {os.path.normpath(info['rel_path'])} - {reason}]\n")
+        return
+    if write_digest:
+        yield encode_text(es_manifest.digest_line(info['digest']))
+    if same_as is not None:
+        yield encode_text(es_manifest.reference_line(same_as))
+        return
+    yield encode_text("[file content begin]\n")
+    yield info['body']
+    yield encode_text("[file content end]\n")
+
+def entry_weight(info, write_digest=WRITE_DIGESTS):
+    # What a byte budget counts: the entry written in full, whatever dedup makes of it
+    if "reread" in info:
+        info.update(info.pop("reread")())  # Only the file itself knows a cached duplicate's full size
+    if "error" in info:
+        return 0  # Skipped when the shard is written
+    if "chunk" in info:
+        return len(info['chunk'])
+    if info.get('embed'):
+        encoding, size = info['embed']
+        return len(encode_text(f"\n{info['rel_path']}\n")) + es_manifest.embedded_length(size, encoding)
+    return sum(map(len, iter_entry_bytes(info, None, write_digest)))
+
+def inscribe_manifest(f, entries, territory, cache_writer=None, index_writer=None,
+                      dedup=DEDUPLICATE, write_digests=WRITE_DIGESTS):
+    """Write the header, every entry and the closing marker to the ManifestWriter f.
+
+    Returns the number of (duplicates, embedded binaries) written."""
+    first_seen = {}  # body digest -> rel_path of the entry holding that body
+    duplicates = 0
+    embedded = 0
+    f.write(encode_text(f"[source territory]: {territory}\n"))
+    f.write(encode_text(f"[file name]: {OUTPUT_FILENAME}\n"))
+    f.write(encode_text("[file content begin]\n"))
+    for info in entries:
+        if 'reread' in info and not (dedup and info['digest'] in first_seen):
+            # A cached duplicate whose first copy is gone (or dedup is off) is written in full again
+            info = info['reread']()
+        if "error" in info:
+            print(f"⚠️ Skipping {info['file']}: {info['error']}")
+            continue
+        offset = f.tell()
+        is_binary = info.get('is_binary', False) or "skipped" in info
+        digest = info.get('digest') or ''
+        same_as = None
+        if dedup and digest and digest != es_manifest.EMPTY_DIGEST:
+            same_as = first_seen.setdefault(digest, info['rel_path'])
+            if same_as == info['rel_path']:
+                same_as = None
+        if same_as is None and "chunk" in info:
+            f.write(info['chunk'])
+        else:
+            # Identical content already inscribed is pointed at instead (cache hits qualify too)
+            for piece in iter_entry_bytes(info, same_as, write_digests):
+                f.write(piece)
+            duplicates += same_as is not None
+        if same_as is not None:
+            kind = es_manifest.ENTRY_REFERENCE
+        elif "chunk" in info:
+            kind = info['kind']
+        elif info.get('embed'):
+            kind = es_manifest.ENTRY_EMBEDDED
+        else:
+            kind = es_manifest.ENTRY_BINARY if is_binary else es_manifest.ENTRY_TEXT
+        embedded += kind == es_manifest.ENTRY_EMBEDDED
+        if cache_writer:  # A reference's digest lets the next run skip reading it
+            cache_writer.add(info['rel_path'], info['stat'], offset, f.tell() - offset, kind, digest)
+        if index_writer:
+            index_writer.add(info['rel_path'], offset, f.tell() - offset, kind)
+        f.mark()
+    f.write(encode_text("[file content end]\n"))
+    return duplicates, embedded
+
+def cache_fingerprint(max_bytes=MAX_FILE_BYTES, write_digests=WRITE_DIGESTS, embedder=None):
+    settings = {'excluded': sorted(EXCLUDED_ITEMS), 'whitelisted': sorted(WHITELISTED_FILES),
+                'root': os.path.abspath(PROJECT_ROOT), 'linesep': os.linesep, 'fallback': TEXT_FALLBACK_ENCODING,
+                'max_file_bytes': max_bytes, 'file_size_limits': FILE_SIZE_LIMITS,
+                'write_digests': write_digests, 'embed': embedder.signature() if embedder else None,
+                'sniff': [es_manifest.SNIFF_BYTES, [kind for _, kind in es_manifest.BINARY_SIGNATURES]]}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+def report_run(duplicates, embedded, cache):
+    if duplicates:
+        print(f"🪞 Duplicates: {duplicates} files written as references to their first copy")
+    if embedded:
+        print(f"📦 Embedded: {embedded} binaries written in full")
+    if cache:
+        print(f"♻️ Cache: {cache.reused} entries reused, {cache.refreshed} refreshed")
+
+def forge_delta(base_manifest, output_path, codec=None):
+    delta_path = es_manifest.compressed_name(es_manifest.DELTA_FILENAME, codec)
+    try:
+        added, changed, removed = es_manifest.write_delta(base_manifest, output_path, delta_path)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Delta not written: {e}")
+        return
+    size = es_manifest.format_size(os.path.getsize(delta_path))
+    print(f"🧬 Delta: {added} added, {changed} changed, {removed} removed since {base_manifest} -> {delta_path} ({size})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Forge a relative established-source.txt manifest.")
+    parser.add_argument('-j', '--jobs', type=int, default=READ_JOBS, help="reader threads, 1 = serial")
+    parser.add_argument('--no-cache', dest='cache', action='store_false', default=USE_CACHE,
+                        help="re-read every file instead of reusing unchanged entries")
+    parser.add_argument('--no-index', dest='index', action='store_false', default=WRITE_INDEX,
+                        help="skip writing the byte-offset index")
+    parser.add_argument('--max-file-size', type=es_manifest.parse_size, default=MAX_FILE_BYTES, metavar='SIZE',
+                        help="record larger files as placeholders, e.g. 512K, 16M, 0 = no cap")
+    parser.add_argument('--dedup', action=argparse.BooleanOptionalAction, default=DEDUPLICATE,
+                        help="write repeated content as references to its first entry")
+    parser.add_argument('--digests', action='store_true', default=WRITE_DIGESTS,
+                        help="record each text entry's sha256 after its path")
+    parser.add_argument('--compress', choices=sorted(es_manifest.COMPRESSION_CODECS), default=COMPRESSION,
+                        help="compress the manifest in independently readable frames")
+    parser.add_argument('--embed-binaries', action='store_true', default=EMBED_BINARIES,
+                        help="write binaries in full as base64/base85 lines so restores give them back")
+    parser.add_argument('--embed-encoding', choices=sorted(es_manifest.EMBED_CODECS), default=EMBED_ENCODING,
+                        help="text encoding for embedded binaries")
+    parser.add_argument('--embed-max-size', type=es_manifest.parse_size, default=EMBED_MAX_BYTES, metavar='SIZE',
+                        help="keep placeholders for larger binaries, 0 = no cap")
+    parser.add_argument('--embed', action='append', metavar='PATTERN',
+                        help="embed only binaries matching this glob (repeatable; implies --embed-binaries)")
+    parser.add_argument('--delta-from', default=DELTA_BASE, metavar='MANIFEST',
+                        help="also write established-source.txt.delta carrying this earlier manifest to the new one")
+    parser.add_argument('--gitignore', action='store_true', default=HONOR_GITIGNORE,
+                        help="also leave out what .gitignore, .ignore and .git/info/exclude ignore")
+    parser.add_argument('--site-map', action='store_true', default=WRITE_SITE_MAP,
+                        help="also write site-map.txt from the same directory walk")
+    sharding = parser.add_mutually_exclusive_group()
+    sharding.add_argument('--shard-size', type=es_manifest.parse_size, default=SHARD_BYTES, metavar='SIZE',
+                        help="split into shards of about SIZE each (e.g. 64M), listed in a shard table")
+    sharding.add_argument('--shard-entries', type=int, default=SHARD_ENTRIES, metavar='N',
+                        help="split into shards of about N entries each")
+    args = parser.parse_args(argv)
+    if args.shard_entries < 0:
+        parser.error("--shard-entries cannot be negative")
+    if args.delta_from and not args.index:
+        parser.error("--delta-from needs the .idx index")
+    output_path = OUTPUT_FILENAME  # The shard table, when sharding; shards carry the compression
+    if not (args.shard_entries or args.shard_size):
+        output_path = es_manifest.compressed_name(OUTPUT_FILENAME, args.compress)
+    if args.delta_from and os.path.realpath(args.delta_from) == os.path.realpath(output_path):
+        parser.error("--delta-from must name a copy of an earlier manifest, not the one being forged")
+    current_dir = os.path.basename(os.getcwd())
+    print(f"⚜️ Mapping territory with Relative Sovereignty: {current_dir}")
+    site_map = load_site_map_rules() if args.site_map else None
+    site_entries = []
+    project_paths = gather_relative_paths(site_map, site_entries, args.gitignore)
+    if site_map is not None:
+        site_map.write_site_map(site_entries)
+        print(f"🗺️ Site map forged at {site_map.OUTPUT_FILENAME} from the same walk ({len(site_entries)} entries)")
+
+    embedder = None
+    if args.embed_binaries or args.embed:
+        embedder = es_manifest.BinaryEmbedder(args.embed_encoding, args.embed_max_size, args.embed or EMBED_PATTERNS)
+    fingerprint = cache_fingerprint(args.max_file_size, args.digests, embedder) if args.cache else None
+    cache = es_manifest.open_cache(es_manifest.locate_manifest(output_path), fingerprint) if args.cache else None
+    entries = iter_project_data(project_paths, max(1, args.jobs), cache, args.max_file_size, embedder)
+
+    if args.shard_entries or args.shard_size:
+        budget, unit = (args.shard_entries, 'entries') if args.shard_entries else (args.shard_size, 'bytes')
+
+        def write_shard(f, shard_entries, cache_writer, index_writer):
+            return inscribe_manifest(f, shard_entries, current_dir, cache_writer, index_writer,
+                                     args.dedup, args.digests)
+
+        try:
+            with es_manifest.ShardWriter(output_path, write_shard, budget, unit,
+                                         lambda info: entry_weight(info, args.digests), args.compress,
+                                         SHARD_WRITERS, fingerprint, args.index, time.time_ns()) as shards:
+                for info in entries:
+                    shards.add(info['rel_path'], info)
+                duplicates, embedded = (sum(column) for column in zip((0, 0), *shards.commit(cache)))
+        finally:
+            if cache:
+                cache.close()
+        unchanged = sum(shard['unchanged'] for shard in shards.shards)
+        print(f"⚜️ VICTORY! {len(shards.shards)} shards forged and listed in {output_path} ({unchanged} unchanged)")
+        report_run(duplicates, embedded, cache)
+        if args.delta_from:
+            forge_delta(args.delta_from, output_path, args.compress)
+        return
+
+    cache_writer = es_manifest.ManifestCacheWriter(output_path, fingerprint, time.time_ns()) if args.cache else None
+    index_writer = es_manifest.ManifestIndexWriter(output_path) if args.index else None
+    tmp_path = output_path + '.tmp'
 
-    project_data.sort(key=lambda x: x["rel_path"])
-    
-    with open(OUTPUT_FILENAME, 'w', encoding='utf-8') as f:
-        f.write(f"[source territory]: {current_dir}\n")
-        f.write(f"[file name]: {OUTPUT_FILENAME}\n")
-        f.write("[file content begin]\n")
-        for info in project_data:
-            # We record only the relative path (e.g., .\README.md)
-            f.write(f"\n{info['rel_path']}\n")
-            f.write("[file content begin]\n")
-            f.write(info['content'])
-            if not info['content'].endswith('\n'): f.write('\n')
-            f.write("[file content end]\n")
-        f.write("[file content end]\n")
-    print(f"⚜️ VICTORY! Standardized Relative ES forged: {OUTPUT_FILENAME}")
+    try:
+        with es_manifest.ManifestWriter(tmp_path, args.compress) as f:
+            duplicates, embedded = inscribe_manifest(f, entries, current_dir, cache_writer, index_writer,
+                                                     args.dedup, args.digests)
+        if cache:
+            cache.close()  # Release the old manifest before it is replaced
+        if cache_writer:
+            cache_writer.commit(tmp_path)
+            cache_writer = None
+        if index_writer:
+            index_writer.commit(tmp_path, f)
+            index_writer = None
+        os.replace(tmp_path, output_path)
+    finally:
+        if cache:
+            cache.close()
+        if cache_writer:
+            cache_writer.discard()
+        if index_writer:
+            index_writer.discard()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    es_manifest.remove_shards(OUTPUT_FILENAME)  # A sharded layout from an earlier run is superseded
+    print(f"⚜️ VICTORY! Standardized Relative ES forged: {output_path}")
+    report_run(duplicates, embedded, cache)
+    if args.delta_from:
+        forge_delta(args.delta_from, output_path, args.compress)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,36 +1,45 @@
 # [file name]: gen-sm.py
 # [directory]: C:\Users\krist\agent\scripts\
 # [file content begin]
-import os
+import es_manifest
 
-def generate_site_map():
-    PROJECT_ROOT = "."
-    OUTPUT_FILENAME = "site-map.txt"
-    EXCLUDED_DIRS = {'.git', 'node_modules', '__pycache__'}
-    
-    print("⚜️ Mapping the territory...")
-    entries = []
-    
-    for root, dirs, files in os.walk(PROJECT_ROOT):
-        # Identify node_modules but don't go inside
-        for d in list(dirs):
-            if d in EXCLUDED_DIRS:
-                rel_dir = os.path.join(root, d).replace('\\', '/')
-                entries.append(f"{rel_dir} # Excluded Directory")
-                dirs.remove(d) # Don't recurse
-
-        for file in files:
-            rel_path = os.path.join(root, file).replace('\\', '/')
-            if not rel_path.startswith('./'):
-                rel_path = './' + rel_path
-            entries.append(rel_path)
+PROJECT_ROOT = "."
+OUTPUT_FILENAME = "site-map.txt"
+EXCLUDED_DIRS = {'.git', 'node_modules', '__pycache__'}
+
+# The rules below are shared with gen-es-win.py --site-map, which maps the
+# territory during the same traversal that forges the manifest.
 
+def enter_dir(name):
+    # Identify node_modules but don't go inside
+    return name not in EXCLUDED_DIRS
+
+def map_entry(rel_path, name, is_dir):
+    """The site-map line for a walked path, or None to leave it out."""
+    rel_path = './' + rel_path.replace('\\', '/')
+    if is_dir:
+        return f"{rel_path} # Excluded Directory" if name in EXCLUDED_DIRS else None
+    return rel_path
+
+def write_site_map(entries, output_path=OUTPUT_FILENAME):
+    """Sort the entries once and write the numbered site map; returns the count."""
     entries.sort()
-    
-    with open(OUTPUT_FILENAME, 'w', encoding='utf-8') as f:
+
+    with open(output_path, 'w', encoding='utf-8') as f:
         for i, entry in enumerate(entries, 1):
             f.write(f"{i:03} {entry}\n")
-            
+    return len(entries)
+
+def generate_site_map():
+    print("⚜️ Mapping the territory...")
+    entries = []
+
+    for rel_path, entry, is_dir, _ in es_manifest.walk_tree(PROJECT_ROOT, lambda rel, entry, tag: enter_dir(entry.name)):
+        line = map_entry(rel_path, entry.name, is_dir)
+        if line is not None:
+            entries.append(line)
+
+    write_site_map(entries)
     print(f"⚜️ Site map forged at {OUTPUT_FILENAME}")
 
 if __name__ == "__main__":
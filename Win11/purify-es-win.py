@@ -3,43 +3,49 @@
 import os
 import re
 
-def purify_relative_manifest(filename="established-source.txt"):
+import es_manifest
+
+# This targets the exact missing comma line we identified in the Diamondz project
+DEV_ALL_LINE = rb'"dev:all": "concurrently \"npm run dev\" \"npm run dev:backend\""'
+
+# ===== Purification rules =====
+# (scope, pattern, replacement). Scope 'path' touches only path lines, 'content'
+# every file body, and a file name pattern (e.g. 'package.json') only the bodies
+# of matching entries. All rules for a scope are compiled into one matcher.
+PURIFICATION_RULES = [
+    # RITUAL 1: Fix the "Diamond/'s" and "Sterling/'s" issues that caused the SyntaxError
+    ('content', rb"/'s", b"'s"),
+    # RITUAL 2: Fix the specific EJSONPARSE error in the package.json scripts -
+    # the comma goes after the closing quote, not inside the string
+    ('package.json', re.escape(DEV_ALL_LINE) + rb'(?!,)', DEV_ALL_LINE + b','),
+    # RITUAL 3: Paths use the Windows-standard backslash after the initial dot
+    ('path', rb'^\./(?=.)', b'.\\'),
+]
+
+def purify_relative_manifest(filename=None):
+    # Plain or compressed; a compressed manifest is purified into the same codec
+    filename = filename or es_manifest.locate_manifest("established-source.txt")
     print(f"⚜️ Initiating Relative Alchemical Purification on {filename}...")
     
     if not os.path.exists(filename):
         print(f"❌ Error: {filename} not found! The Scroll is missing.")
         return
 
-    with open(filename, 'r', encoding='utf-8', errors='replace') as f:
-        content = f.read()
-
-    # --- RITUAL 1: Apostrophe & Slash Exorcism ---
-    # Fix the "Diamond/'s" and "Sterling/'s" issues that caused the SyntaxError
     print("🪄 Exorcising traitorous slashes from JavaScript strings...")
-    # Globally replaces the incorrect forward-slash escape with the clean version
-    content = content.replace("/'s", "'s") 
-    
-    # --- RITUAL 2: JSON Comma Restoration ---
-    # Fix the specific EJSONPARSE error in the package.json scripts
     print("🪄 Sanitizing package.json syntax for the OS Guardian...")
-    # This targets the exact missing comma line we identified in the Diamondz project
-    old_json_line = '"dev:all": "concurrently \\"npm run dev\\" \\"npm run dev:backend\\""'
-    new_json_line = '"dev:all": "concurrently \\"npm run dev\\" \\"npm run dev:backend\\","'
-    
-    if old_json_line in content and f"{old_json_line}," not in content:
-        content = content.replace(old_json_line, new_json_line)
-
-    # --- RITUAL 3: Path Consistency ---
-    # Ensures all paths use the Windows-standard backslash for relative sovereignty
     print("🪄 Harmonizing path separators...")
-    # Find path markers and ensure they use backslashes after the initial dot
-    content = re.sub(r'(\n\.)/([^\n]+)', r'\1\\\2', content)
 
+    # Single streaming pass: the rituals run as the manifest is copied
     output_name = f"PURIFIED-{filename}"
-    with open(output_name, 'w', encoding='utf-8') as f:
-        f.write(content)
+    if es_manifest.read_shard_table(filename) is not None:
+        # A shard table: each shard is purified on its own into a new table
+        fixes = es_manifest.rewrite_shards(
+            filename, output_name, lambda scan, out: es_manifest.rewrite_manifest(scan, out, PURIFICATION_RULES))
+    else:
+        with es_manifest.ManifestScanner(filename) as scan, es_manifest.ManifestWriter(output_name) as out:
+            fixes = es_manifest.rewrite_manifest(scan, out, PURIFICATION_RULES)
 
-    print(f"⚜️ VICTORY! Purified Relative Manifest forged: {output_name}")
+    print(f"⚜️ VICTORY! Purified Relative Manifest forged: {output_name} ({fixes} fixes)")
     print("The Pimpire's ground truth is now purified and path-agnostic.")
 
 if __name__ == "__main__":
@@ -1,10 +1,82 @@
 # [file name]: restore-es.py
 # [directory]: ./ (Run in the folder where you want to restore)
 import os
+import argparse
 
-def restore_pimpire_standard():
-    # Priority: Check for Purified version first
-    es_filename = "PURIFIED-established-source.txt" if os.path.exists("PURIFIED-established-source.txt") else "established-source.txt"
+import es_manifest
+
+BEGIN = es_manifest.MARKER_BEGIN
+END = es_manifest.MARKER_END
+RESTORE_JOBS = 1  # Writer threads (--jobs), or shards restored at once in worker processes; above 1 prints a summary
+SKIP_UNCHANGED = True  # Leave files that already hold their entry untouched, mtime and all (--rewrite-unchanged)
+
+def restore_indexed(es_filename, paths, writer):
+    """Restore only the requested paths via the .idx sidecar; None means no usable index.
+
+    Duplicates written as references are copied from the entry they name, and
+    embedded binaries are decoded back to their exact bytes."""
+    entries = es_manifest.find_indexed_entries(es_filename, paths)
+    if entries is None:
+        return None
+    restored_count = 0
+    keys = list(dict.fromkeys(es_manifest.index_key(p) for p in paths))
+    writer.prepare_dirs(k for k in keys if k in entries and entries[k][2] != es_manifest.ENTRY_BINARY)
+    with es_manifest.ManifestScanner(es_filename, lazy=True) as scan:
+        try:
+            sources = es_manifest.resolve_indexed_references(es_filename, scan, entries, keys)
+        except ValueError:
+            return None
+        for key in keys:
+            if key not in entries:
+                print(f"❓ Not in manifest: {key}")
+                continue
+            if entries[key][2] == es_manifest.ENTRY_BINARY:
+                print(f"⏭️ Binary placeholder, nothing to restore: {key}")
+                continue
+            if entries[key][2] == es_manifest.ENTRY_EMBEDDED:
+                try:
+                    start, end = scan.indexed_embedded(entries[key][0], entries[key][1], key)
+                except ValueError:
+                    return None
+                restored_count += restore_embedded(key, scan, start, end, writer)
+                continue
+            source = sources.get(key, key)
+            if entries.get(source, (0, 0, None))[2] != es_manifest.ENTRY_TEXT:
+                print(f"❓ Duplicate of an entry not in manifest: {key} -> {source}")
+                continue
+            offset, length, _ = entries[source]
+            try:
+                start, end = scan.indexed_body(offset, length, source)
+            except ValueError:
+                return None
+            report_restored(key, writer.restore(key, scan, start, end), writer)
+            restored_count += 1
+    return restored_count
+
+def report_restored(path, written, writer, what=""):
+    """Per-file report, when the writer is not summarising."""
+    if writer.parallel:
+        return
+    if written:
+        print(f"✅ Restored{what}: {path}")
+    else:
+        print(f"💤 Unchanged{what}, left alone: {path}")
+
+def restore_embedded(path, scan, start, end, writer):
+    """Decode one embedded binary to path; a damaged one is reported and skipped (returns False)."""
+    try:
+        written = writer.restore_embedded(path, scan, start, end)
+    except ValueError as e:
+        print(f"❌ Embedded binary not restored: {path} ({e})")
+        return False
+    report_restored(path, written, writer, " binary")
+    return True
+
+def restore_pimpire_standard(paths=None, jobs=RESTORE_JOBS, progress=False, skip_unchanged=SKIP_UNCHANGED):
+    # Priority: Check for Purified version first (plain or compressed)
+    es_filename = es_manifest.locate_manifest("PURIFIED-established-source.txt")
+    if not os.path.exists(es_filename):
+        es_filename = es_manifest.locate_manifest("established-source.txt")
     
     print(f"⚜️ Shadow Scribe restoring from: {es_filename}")
     
@@ -12,45 +84,109 @@ def restore_pimpire_standard():
         print("❌ Error: Manifest not found!")
         return
 
-    with open(es_filename, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+    shards = es_manifest.read_shard_table(es_filename)
+    writer = es_manifest.RestoreWriter(jobs, progress, keep_unchanged=skip_unchanged)
+    try:
+        if shards is not None:
+            print(f"🧩 Sharded manifest: {len(shards)} shards")
+            restored = restore_sharded(shards, paths, jobs, writer)
+        else:
+            restored = _restore_from(es_filename, paths, writer)
+    finally:
+        writer.close()
+    print(f"\n⚜️ VICTORY! {restored} artifacts resurrected.")
+    print(f"   ✍️ {writer.written} written, 💤 {writer.skipped} unchanged and left alone")
+
+def restore_sharded(shards, paths, jobs, writer):
+    """Restore every shard of a sharded manifest, jobs at a time; paths only open the shards holding them."""
+    plan, missing = es_manifest.plan_shard_restore(shards, paths)
+    for key in missing:
+        print(f"❓ Not in manifest: {key}")
+    restored = 0
+    for shard, count in es_manifest.restore_shards(plan, _restore_from, jobs, writer):
+        if jobs > 1:
+            print(f"📦 {os.path.basename(shard['path'])}: {count} artifacts")
+        restored += count
+    return restored
+
+def _restore_from(es_filename, paths, writer):
+    # Selective restore (restore-es.py path/one path/two ...) seeks via the index
+    wanted = None
+    if paths:
+        restored = restore_indexed(es_filename, paths, writer)
+        if restored is not None:
+            return restored
+        print("🔎 No usable index - scanning the whole manifest")
+        wanted = {es_manifest.index_key(p) for p in paths}
 
-    collecting = False
-    file_content = []
     restored_count = 0
     current_file_path = None
+    spans = {}  # body span of each entry, for duplicates written as references
+
+    # Map the manifest: lines outside entries are decoded one by one, while an
+    # entry body is skipped with a bytes-level search for its end marker
+    with es_manifest.ManifestScanner(es_filename) as scan:
+        pos = 0
+        while pos < scan.size:
+            start = pos
+            end, following = scan.line_end(pos)
+            line = scan.text(pos, end)
+            pos = following
 
-    for line in lines:
-        # Detect the Relative Path marker (.\README.md, etc.)
-        if not collecting and (line.strip().startswith(".\\") or line.strip().startswith("./")):
-            current_file_path = line.strip()
-            continue
+            # Detect the Relative Path marker (.\README.md, etc.)
+            if line.strip().startswith(".\\") or line.strip().startswith("./"):
+                current_file_path = line.strip()
+                continue
 
-        if "[file content begin]" in line:
-            if not collecting and restored_count > 0:
-                collecting = True
-                file_content = []
+            # Embedded binary: decoded from its encoded lines, up to the end line
+            if line.startswith(es_manifest.EMBED_BEGIN_PREFIX) and current_file_path and restored_count > 0:
+                found = scan.find_marker_line(es_manifest.EMBED_END_PREFIX, pos, exact=False)
+                if found is None:
+                    break
+                if wanted is None or es_manifest.index_key(current_file_path) in wanted:
+                    restored_count += restore_embedded(current_file_path, scan, start, found[0], writer)
+                pos = found[1]
+                current_file_path = None
                 continue
-            elif restored_count == 0:
+
+            target = es_manifest.reference_target(line.strip())
+            if target and current_file_path and restored_count > 0:
+                span = spans.get(es_manifest.index_key(target))
+                if span is None:
+                    print(f"❓ Duplicate of an entry not in manifest: {current_file_path} -> {target}")
+                elif wanted is None or es_manifest.index_key(current_file_path) in wanted:
+                    report_restored(current_file_path, writer.restore(current_file_path, scan, *span), writer)
+                    restored_count += 1
+                continue
+
+            if BEGIN not in line:
+                continue
+            if restored_count == 0:
                 # Skip the ES header line
                 restored_count += 1
                 continue
 
-        if "[file content end]" in line and collecting:
+            found = scan.find_marker_line(END, pos, exact=False)
+            if found is None:
+                break
+            body_end, following = found
             if current_file_path:
-                # Recreate subdirectories if they exist in the path
-                os.makedirs(os.path.dirname(current_file_path), exist_ok=True)
-                with open(current_file_path, 'w', encoding='utf-8') as f_out:
-                    f_out.writelines(file_content)
-                print(f"✅ Restored: {current_file_path}")
+                spans[es_manifest.index_key(current_file_path)] = (pos, body_end)
+            if current_file_path and (wanted is None or es_manifest.index_key(current_file_path) in wanted):
+                # Subdirectories are recreated on the way
+                report_restored(current_file_path, writer.restore(current_file_path, scan, pos, body_end), writer)
                 restored_count += 1
-            collecting = False
-            continue
-
-        if collecting:
-            file_content.append(line)
+            pos = following
 
-    print(f"\n⚜️ VICTORY! {restored_count - 1} artifacts resurrected.")
+    return restored_count - 1
 
 if __name__ == "__main__":
-    restore_pimpire_standard()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Restore a project from an established-source manifest.")
+    parser.add_argument('paths', nargs='*', help="restore only these paths (seeks via the .idx index when present)")
+    parser.add_argument('-j', '--jobs', type=int, default=RESTORE_JOBS,
+                        help="writer threads, or shards restored at once for a sharded manifest")
+    parser.add_argument('--progress', action='store_true', help="show a running count of restored files")
+    parser.add_argument('--rewrite-unchanged', dest='skip_unchanged', action='store_false', default=SKIP_UNCHANGED,
+                        help="rewrite every file, even those that already hold exactly their entry")
+    args = parser.parse_args()
+    restore_pimpire_standard(args.paths, max(1, args.jobs), args.progress, args.skip_unchanged)
\ No newline at end of file